@@ -56,6 +56,8 @@ def __main__():
 	parser.add_option( '', '--qual', dest='qual', default='33', help='Fastq quality encoding: 33 or 64, [default: %default]')
 	parser.add_option( '', '--index', dest='index', default='y', help='Build reference index : y or n,  [default: %default]')
 	parser.add_option( '', '--rmindex', dest='rmindex', default='y', help='Remove reference index at the end of calculation: y or n, [default: %default]')
+	parser.add_option( '', '--index_cache', dest='index_cache', default='not_filled', help='Directory of reference indexes shared between runs. If filled, --index and --rmindex are ignored and the index is built only if not already in this directory')
+	parser.add_option( '', '--index_cache_size', dest='index_cache_size', default='50', help='Maximal size (in Go) of the index cache directory, least recently used indexes being removed first, [default: %default]')
 	parser.add_option( '', '--filter_multi', dest='filter_multi', default='y', help='Filter reads with multiple locations : y or n,  [default: %default]')
 	parser.add_option( '', '--mini_dis', dest='mini_dis', default='10000', help='The minimal insert size to keep the discordant read for structural variation search (integer), [default: %default]')
 	parser.add_option( '', '--mult_max_cov', dest='mult_max_cov', default='10', help='multiplicator of median coverage for maximal median coverage to keep a zone (float), [default: %default]')
@@ -63,6 +65,16 @@ def __main__():
 	parser.add_option( '', '--min_zone', dest='min_zone', default='500', help='Minimal number of covered sites in a zone to be considered (integer),  [default: %default]')
 	parser.add_option( '', '--min_gap', dest='min_gap', default='300', help='Maximal number of contiguous uncovered sites in a zone to be considered as a single zone (integer),  [default: %default]')
 	parser.add_option( '', '--thread', dest='thread', default='1', help='The thread number used for mapping (integer), [default: %default]')
+	parser.add_option( '', '--stream', dest='stream', default='n', help='Pair mate1 and mate2 alignments on the fly without intermediate sam and sorting (bowtie, bowtie2_single and bwa_mem only): y or n, [default: %default]')
+	parser.add_option( '', '--concurrent', dest='concurrent', default='n', help='Map mate1 and mate2 at the same time, sharing the --thread number between them (bowtie, bowtie2_single, bwa and bwa_mem only): y or n, [default: %default]')
+	parser.add_option( '', '--shard', dest='shard', default='1', help='Number of chunks the fastq files are split in to be mapped in parallel, the --thread number being shared between them (integer), [default: %default]')
+	parser.add_option( '', '--shard_retry', dest='shard_retry', default='1', help='Number of times a failed chunk is mapped again (integer), [default: %default]')
+	parser.add_option( '', '--out_format', dest='out_format', default='sam', help='Format of the mapping and single pair filter outputs: sam or bam, [default: %default]')
+	parser.add_option( '', '--fuse_filter', dest='fuse_filter', default='n', help='Apply the multi-hit filter of step 3 while the mapped pairs are written in step 2, step 3 then only reports the filter counts: y or n, [default: %default]')
+	parser.add_option( '', '--ins_sample', dest='ins_sample', default='0', help='Number of proper pairs sampled to estimate the insert size in step 5, 0 to use all of them (integer), [default: %default]')
+	parser.add_option( '', '--prop_windows', dest='prop_windows', default='1000', help='Window sizes of the discordant read proportion tracks of step 6, separated by "=", [default: %default]')
+	parser.add_option( '', '--list_format', dest='list_format', default='text', help='Format of the .list file of the read pairs written in step 6: text or binary (columns with a category index, read by step 6 and conf4circos.py), [default: %default]')
+	parser.add_option( '', '--zone_thread', dest='zone_thread', default='1', help='Number of processes checking the discordant zones of each discordant type in parallel in step 7, [default: %default]')
 	parser.add_option( '', '--msd', dest='msd', default='3', help='Multiplicator of standard deviation for discordant zone identification (integer), [default: %default]')
 	parser.add_option( '', '--max_dist_merge', dest='max_dist_merge', default=1000, help='Maximal distance between two discordant zone to merge, [default: %default]')
 	parser.add_option( '', '--YiS', dest='YiS', default=0, help='The Y-intercept of the linear function for zone size that will give the first component of product giving the score (integer), [default: %default]')
@@ -95,6 +107,16 @@ def __main__():
 	config.set('General','mini', options.mini)
 	config.set('General','maxi', options.maxi)
 	config.set('General','thread', options.thread)
+	config.set('General','stream', options.stream)
+	config.set('General','concurrent', options.concurrent)
+	config.set('General','shard', options.shard)
+	config.set('General','shard_retry', options.shard_retry)
+	config.set('General','out_format', options.out_format)
+	config.set('General','fuse_filter', options.fuse_filter)
+	config.set('General','ins_sample', options.ins_sample)
+	config.set('General','prop_windows', options.prop_windows)
+	config.set('General','list_format', options.list_format)
+	config.set('General','zone_thread', options.zone_thread)
 	config.set('General','tool', options.tool)
 	config.set('General','q1', options.q1)
 	config.set('General','q2', options.q2)
@@ -102,6 +124,8 @@ def __main__():
 	config.set('General','orient', options.orient)
 	config.set('General','index', options.index)
 	config.set('General','rmindex', options.rmindex)
+	config.set('General','index_cache', options.index_cache)
+	config.set('General','index_cache_size', options.index_cache_size)
 	config.set('General','sd_multiplicator', options.msd)
 	config.set('General','restimate', options.restimate)
 	config.set('General','mini_dis', options.mini_dis)
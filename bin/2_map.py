@@ -24,7 +24,9 @@
 #
 
 import optparse, os, shutil, subprocess, sys, tempfile, fileinput, ConfigParser, operator, time, random, datetime, glob, sys
-import multiprocessing
+import multiprocessing, hashlib, fcntl, gzip
+import merge_sam
+import utilsSR.utilsSR as utils
 
 def stop_err( msg ):
 	sys.stderr.write( "%s\n" % msg )
@@ -70,105 +72,472 @@ def worker(job):
 
 
 
-def Mapping(LOCA_PROGRAMS, TOOL, REF, Q1, Q2, ORIENT, MIN, MAX, QUAL, INDEX, RMINDEX, THREAD, OUT, PATHNAME):
-		interm1 = OUT+'_mate1.sam'
-		interm2 = OUT+'_mate2.sam'
-		interm_sort1 = OUT+'_mate1_sorted.sam'
-		interm_sort2 = OUT+'_mate2_sorted.sam'
-		t0 = datetime.datetime.now()
-		print t0
+def launch_job(cmd_line, STDOUT=None):
+	print cmd_line
+	error = tempfile.NamedTemporaryFile()
+	proc = subprocess.Popen( args=cmd_line, shell=True, stdout=STDOUT, stderr=error, bufsize=-1)
+	return [proc, error]
+
+def wait_job(job, ERROR):
+	returncode = job[0].wait()
+	job[1].seek(0)
+	stderr = job[1].read()
+	job[1].close()
+	if returncode != 0:
+		stop_err( ERROR + stderr )
+
+#Stop the jobs of launch_job whose outputs could not be read to the end, most likely because one of them failed.
+#The error of a job having ended within 5 seconds is reported, the jobs still running being killed.
+def stop_jobs(JOBS, ERROR):
+	for i in range(50):
+		if not [job for job in JOBS if job[0].poll() is None]:
+			break
+		time.sleep(0.1)
+	running = [job for job in JOBS if job[0].poll() is None]
+	for job in running:
+		job[0].kill()
+		if job[0].stdout:
+			job[0].stdout.close()
+		job[0].wait()
+		job[1].close()
+	for job in JOBS:
+		if job not in running:
+			wait_job(job, ERROR)
+
+#Run a mapping command line sending its sam to the standard output and write it in OUT, compressed on the fly in the bam format.
+#If FILTER is given, the pairs are passed through the multi-hit filter on the fly and [pair number, pair kept number] is returned.
+def run_mapping(LOCA_PROGRAMS, CMD, OUT, OUT_FORMAT, THREAD, ERROR, FILTER=None):
+	if FILTER is not None:
+		writer = utils.openSamWriter(LOCA_PROGRAMS, OUT, OUT_FORMAT, THREAD)
+		job = launch_job(CMD, subprocess.PIPE)
+		counts = merge_sam.filter_stream(job[0].stdout, writer[0], FILTER)
+		utils.closeSamWriter(writer)
+		wait_job(job, ERROR)
+		merge_sam.print_filter(counts)
+		return counts
+	elif OUT_FORMAT == 'bam':
+		writer = utils.openSamWriter(LOCA_PROGRAMS, OUT, OUT_FORMAT, THREAD)
+		wait_job(launch_job(CMD, writer[0]), ERROR)
+		utils.closeSamWriter(writer)
+	else:
+		run_job(CMD+' > '+OUT, ERROR)
+
+#Return the thread number of the mate1 and mate2 jobs.
+#Sequential mode: each mate uses all the threads, bowtie v1 staying single-threaded.
+#Concurrent mode (at least 2 threads, see map_pair()): the threads are shared between the two mates (the odd one going to mate1) and bowtie v1 is multi-threaded with its share.
+def mate_threads(TOOL, THREAD, CONCURRENT):
+	if CONCURRENT != 'y':
 		if TOOL == 'bowtie':
-			if INDEX == 'y':
-				build_index = '%s -q %s %s' % (LOCA_PROGRAMS.get('Programs','bowtie-build'), REF, REF)
-				run_job(build_index,'Indexing error:\n')
-			if QUAL == '33':
-				mapping1 = '%s --quiet -a -m 1 %s --phred33-quals -q %s -S %s' % (LOCA_PROGRAMS.get('Programs','bowtie'), REF, Q1, interm1)
-				mapping2 = '%s --quiet -a -m 1 %s --phred33-quals -q %s -S %s' % (LOCA_PROGRAMS.get('Programs','bowtie'), REF, Q2, interm2)
-				# mapping1 = '%s --quiet %s --phred33-quals -q %s -S %s' % (LOCA_PROGRAMS.get('Programs','bowtie'), REF, Q1, interm1)
-				# mapping2 = '%s --quiet %s --phred33-quals -q %s -S %s' % (LOCA_PROGRAMS.get('Programs','bowtie'), REF, Q2, interm2)
-			elif QUAL == '64':
-				mapping1 = '%s --quiet -a -m 1 %s --solexa1.3-quals -q %s -S %s' % (LOCA_PROGRAMS.get('Programs','bowtie'), REF, Q1, interm1)
-				mapping2 = '%s --quiet -a -m 1 %s --solexa1.3-quals -q %s -S %s' % (LOCA_PROGRAMS.get('Programs','bowtie'), REF, Q2, interm2)
-				# mapping1 = '%s --quiet %s --solexa1.3-quals -q %s -S %s' % (LOCA_PROGRAMS.get('Programs','bowtie'), REF, Q1, interm1)
-				# mapping2 = '%s --quiet %s --solexa1.3-quals -q %s -S %s' % (LOCA_PROGRAMS.get('Programs','bowtie'), REF, Q2, interm2)
-			else:
-				sys.exit('Unknown quality encoding : support only +33 or +64 encoding')
-			sorting1 = '%s -XX:ParallelGCThreads=%s -jar %s SortSam INPUT=%s OUTPUT=%s SORT_ORDER=queryname QUIET=true MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT' % (LOCA_PROGRAMS.get('Programs','java'), THREAD, LOCA_PROGRAMS.get('Programs','picard-tool'), interm1, interm_sort1)
-			sorting2 = '%s -XX:ParallelGCThreads=%s -jar %s SortSam INPUT=%s OUTPUT=%s SORT_ORDER=queryname QUIET=true MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT' % (LOCA_PROGRAMS.get('Programs','java'), THREAD, LOCA_PROGRAMS.get('Programs','picard-tool'), interm2, interm_sort2)
-			merging = '%s %s/merge_sam.py --file1 %s --file2 %s --out %s --min %s --max %s --orient %s' % (LOCA_PROGRAMS.get('Programs','python'), PATHNAME, interm_sort1, interm_sort2, OUT, MIN, MAX, ORIENT)
-			run_job(mapping1, 'Mapping error:\n')
-			run_job(sorting1, 'Sorting error:\n')
-			os.remove(interm1)
-			run_job(mapping2, 'Mapping error:\n')
-			run_job(sorting2, 'Sorting error:\n')
-			os.remove(interm2)
-			run_job(merging, 'Merging error:\n')
-			os.remove(interm_sort1)
-			os.remove(interm_sort2)
-		elif TOOL == 'bowtie2_single':
-			if INDEX == 'y':
-				build_index = '%s -q -f %s %s' % (LOCA_PROGRAMS.get('Programs','bowtie2-build'), REF, REF)
-				run_job(build_index,'Indexing error')
-			mapping1 = '%s -D 20 -R 3 -N 0 -L 20 -i S,1,0.50 -x %s -q %s --phred%s -p %s -S %s' % (LOCA_PROGRAMS.get('Programs','bowtie2'), REF, Q1, QUAL, THREAD, interm1)
-			mapping2 = '%s -D 20 -R 3 -N 0 -L 20 -i S,1,0.50 -x %s -q %s --phred%s -p %s -S %s' % (LOCA_PROGRAMS.get('Programs','bowtie2'), REF, Q2, QUAL, THREAD, interm2)
-			sorting1 = '%s -XX:ParallelGCThreads=%s -jar %s SortSam INPUT=%s OUTPUT=%s SORT_ORDER=queryname QUIET=true MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT' % (LOCA_PROGRAMS.get('Programs','java'), THREAD, LOCA_PROGRAMS.get('Programs','picard-tool'), interm1, interm_sort1)
-			sorting2 = '%s -XX:ParallelGCThreads=%s -jar %s SortSam INPUT=%s OUTPUT=%s SORT_ORDER=queryname QUIET=true MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT' % (LOCA_PROGRAMS.get('Programs','java'), THREAD, LOCA_PROGRAMS.get('Programs','picard-tool'), interm2, interm_sort2)
-			merging = '%s %s/merge_sam.py --file1 %s --file2 %s --out %s --min %s --max %s --orient %s' % (LOCA_PROGRAMS.get('Programs','python'), PATHNAME, interm_sort1, interm_sort2, OUT, MIN, MAX, ORIENT)
+			return ['1', '1']
+		return [THREAD, THREAD]
+	nb_thread = int(THREAD)
+	return [str(max(1, nb_thread - nb_thread/2)), str(max(1, nb_thread/2))]
 
-			run_job(mapping1, 'Mapping error:\n')
-			run_job(mapping2, 'Mapping error:\n')
+#Return the command line mapping one fastq file in single end mode with the sam sent to the standard output
+def single_mapping(LOCA_PROGRAMS, TOOL, REF, FASTQ, QUAL, THREAD, REORDER):
+	if TOOL == 'bowtie':
+		if QUAL == '33':
+			mapping = '%s --quiet -a -m 1 %s --phred33-quals -q %s -S' % (LOCA_PROGRAMS.get('Programs','bowtie'), REF, FASTQ)
+		elif QUAL == '64':
+			mapping = '%s --quiet -a -m 1 %s --solexa1.3-quals -q %s -S' % (LOCA_PROGRAMS.get('Programs','bowtie'), REF, FASTQ)
+		else:
+			sys.exit('Unknown quality encoding : support only +33 or +64 encoding')
+		if THREAD != '1':
+			mapping = mapping + ' -p ' + THREAD
+			if REORDER:
+				mapping = mapping + ' --reorder'
+		return mapping
+	elif TOOL == 'bowtie2_single':
+		mapping = '%s -D 20 -R 3 -N 0 -L 20 -i S,1,0.50 -x %s -q %s --phred%s -p %s' % (LOCA_PROGRAMS.get('Programs','bowtie2'), REF, FASTQ, QUAL, THREAD)
+		if REORDER:
+			mapping = mapping + ' --reorder'
+		return mapping
+	elif TOOL == 'bwa_mem':
+		return '%s mem -t %s -M %s %s' % (LOCA_PROGRAMS.get('Programs','bwa'), THREAD, REF, FASTQ)
+	else:
+		sys.exit('No single end mapping for tool: '+TOOL)
 
-			run_job(sorting1, 'Sorting error:\n')
-			run_job(sorting2, 'Sorting error:\n')
+#Map both mates, sort them by read name and merge them into a paired sam. In concurrent mode, the mate1 and mate2 mapping/sorting run side by side
+def Mapping_single(LOCA_PROGRAMS, TOOL, REF, Q1, Q2, ORIENT, MIN, MAX, QUAL, THREAD, CONCURRENT, FILTER, OUT, OUT_FORMAT):
+	interm1 = OUT+'_mate1.sam'
+	interm2 = OUT+'_mate2.sam'
+	interm_sort1 = OUT+'_mate1_sorted.sam'
+	interm_sort2 = OUT+'_mate2_sorted.sam'
+	THREADS = mate_threads(TOOL, THREAD, CONCURRENT)
+	mapping1 = '%s > %s' % (single_mapping(LOCA_PROGRAMS, TOOL, REF, Q1, QUAL, THREADS[0], False), interm1)
+	mapping2 = '%s > %s' % (single_mapping(LOCA_PROGRAMS, TOOL, REF, Q2, QUAL, THREADS[1], False), interm2)
+	if CONCURRENT == 'y':
+		gc_threads = THREADS
+	else:
+		gc_threads = [THREAD, THREAD]
+	sorting1 = '%s -XX:ParallelGCThreads=%s -jar %s SortSam INPUT=%s OUTPUT=%s SORT_ORDER=queryname QUIET=true MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT' % (LOCA_PROGRAMS.get('Programs','java'), gc_threads[0], LOCA_PROGRAMS.get('Programs','picard-tool'), interm1, interm_sort1)
+	sorting2 = '%s -XX:ParallelGCThreads=%s -jar %s SortSam INPUT=%s OUTPUT=%s SORT_ORDER=queryname QUIET=true MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT' % (LOCA_PROGRAMS.get('Programs','java'), gc_threads[1], LOCA_PROGRAMS.get('Programs','picard-tool'), interm2, interm_sort2)
+	if CONCURRENT == 'y':
+		job1 = launch_job(' && '.join([mapping1, sorting1, 'rm '+interm1]))
+		job2 = launch_job(' && '.join([mapping2, sorting2, 'rm '+interm2]))
+		wait_job(job1, 'Mapping/sorting error (mate1):\n')
+		wait_job(job2, 'Mapping/sorting error (mate2):\n')
+	else:
+		run_job(mapping1, 'Mapping error:\n')
+		run_job(sorting1, 'Sorting error:\n')
+		os.remove(interm1)
+		run_job(mapping2, 'Mapping error:\n')
+		run_job(sorting2, 'Sorting error:\n')
+		os.remove(interm2)
+	counts = merge_sam.merge2sam(LOCA_PROGRAMS, interm_sort1, interm_sort2, OUT, OUT_FORMAT, THREAD, int(MIN), int(MAX), ORIENT, FILTER)
+	os.remove(interm_sort1)
+	os.remove(interm_sort2)
+	return counts
 
-			run_job(merging, 'Merging error:\n')
-			os.remove(interm1)
-			os.remove(interm2)
-			os.remove(interm_sort1)
-			os.remove(interm_sort2)
-		elif TOOL == 'bowtie2':
-			if INDEX == 'y':
-				build_index = '%s -q -f %s %s' % (LOCA_PROGRAMS.get('Programs','bowtie2-build'), REF, REF)
-				run_job(build_index,'Indexing error')
-			mapping = '%s -D 20 -R 3 -N 0 -L 20 -i S,1,0.50 -I %s -X %s --%s -x %s -q1 %s -q2 %s --phred%s -p %s -S %s' % (LOCA_PROGRAMS.get('Programs','bowtie2'), MIN, MAX, ORIENT, REF, Q1, Q2, QUAL, THREAD, OUT)
-			run_job(mapping,'Mapping error:\n')
-		elif TOOL == 'bwa_mem':
-			if INDEX == 'y':
-				build_index = '%s index -a bwtsw %s 2>/dev/null' % (LOCA_PROGRAMS.get('Programs','bwa'), REF)
-				run_job(build_index,'Indexing error:')
-			mapping1 = '%s mem -t %s -M %s %s > %s' % (LOCA_PROGRAMS.get('Programs','bwa'), THREAD, REF, Q1, interm1)
-			mapping2 = '%s mem -t %s -M %s %s > %s' % (LOCA_PROGRAMS.get('Programs','bwa'), THREAD, REF, Q2, interm2)
-			sorting1 = '%s -XX:ParallelGCThreads=%s -jar %s SortSam INPUT=%s OUTPUT=%s SORT_ORDER=queryname QUIET=true MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT' % (LOCA_PROGRAMS.get('Programs','java'), THREAD, LOCA_PROGRAMS.get('Programs','picard-tool'), interm1, interm_sort1)
-			sorting2 = '%s -XX:ParallelGCThreads=%s -jar %s SortSam INPUT=%s OUTPUT=%s SORT_ORDER=queryname QUIET=true MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT' % (LOCA_PROGRAMS.get('Programs','java'), THREAD, LOCA_PROGRAMS.get('Programs','picard-tool'), interm2, interm_sort2)
-			merging = '%s %s/merge_sam.py --file1 %s --file2 %s --out %s --min %s --max %s --orient %s' % (LOCA_PROGRAMS.get('Programs','python'), PATHNAME, interm_sort1, interm_sort2, OUT, MIN, MAX, ORIENT)
+#Map both mates at the same time (sharing the threads) and pair the two sam streams on the fly: mappers keep the read order of the fastq files so neither intermediate sam nor sorting is needed
+def Mapping_stream(LOCA_PROGRAMS, TOOL, REF, Q1, Q2, ORIENT, MIN, MAX, QUAL, THREAD, FILTER, OUT, OUT_FORMAT):
+	THREADS = mate_threads(TOOL, THREAD, 'y')
+	job1 = launch_job(single_mapping(LOCA_PROGRAMS, TOOL, REF, Q1, QUAL, THREADS[0], True), subprocess.PIPE)
+	job2 = launch_job(single_mapping(LOCA_PROGRAMS, TOOL, REF, Q2, QUAL, THREADS[1], True), subprocess.PIPE)
+	writer = utils.openSamWriter(LOCA_PROGRAMS, OUT, OUT_FORMAT, THREAD)
+	merged = False
+	try:
+		counts = merge_sam.merge_stream(job1[0].stdout, job2[0].stdout, writer[0], int(MIN), int(MAX), ORIENT, FILTER)
+		merged = True
+	finally:
+		if not merged:
+			stop_jobs([job1, job2], 'Mapping error:\n')
+	utils.closeSamWriter(writer)
+	wait_job(job1, 'Mapping error:\n')
+	wait_job(job2, 'Mapping error:\n')
+	return counts
+
+#Return the command line building the index of REF under the PREFIX name for the tool used
+def build_index(LOCA_PROGRAMS, TOOL, REF, PREFIX):
+	if TOOL == 'bowtie':
+		return '%s -q %s %s' % (LOCA_PROGRAMS.get('Programs','bowtie-build'), REF, PREFIX)
+	elif TOOL in ['bowtie2', 'bowtie2_single']:
+		return '%s -q -f %s %s' % (LOCA_PROGRAMS.get('Programs','bowtie2-build'), REF, PREFIX)
+	elif TOOL in ['bwa', 'bwa_mem']:
+		return '%s index -a bwtsw -p %s %s 2>/dev/null' % (LOCA_PROGRAMS.get('Programs','bwa'), PREFIX, REF)
+	else:
+		sys.exit('Unknown tool: '+TOOL)
+
+def file_hash(FILE):
+	sha = hashlib.sha1()
+	fichier = open(FILE, 'rb')
+	block = fichier.read(1048576)
+	while block:
+		sha.update(block)
+		block = fichier.read(1048576)
+	fichier.close()
+	return sha.hexdigest()
+
+#Return the version lines printed by an indexer (bwa prints them in its usage), or the program command line if none is found
+def tool_version(PROGRAM):
+	proc = subprocess.Popen( args=PROGRAM+' --version', shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	output = proc.communicate()[0]
+	version = [line.strip() for line in output.split('\n') if 'version' in line.lower()]
+	if version:
+		return '\n'.join(version)
+	return PROGRAM
+
+def dir_size(DIR):
+	size = 0
+	for n in os.listdir(DIR):
+		size += os.path.getsize(os.path.join(DIR, n))
+	return size
+
+#Remove the least recently used index of the cache until the cache size is below MAX_SIZE (in Go). Indexes used by a running mapping are share-locked and kept.
+def evict_index(CACHE, MAX_SIZE, KEEP):
+	entries = []
+	total = 0
+	for n in os.listdir(CACHE):
+		entry = os.path.join(CACHE, n)
+		if os.path.isdir(entry) and os.path.isfile(entry+'.lock'):
+			size = dir_size(entry)
+			total += size
+			if n != KEEP:
+				entries.append([os.path.getmtime(entry), size, entry])
+	entries.sort()
+	max_size = float(MAX_SIZE)*1073741824
+	for n in entries:
+		if total <= max_size:
+			break
+		lock = open(n[2]+'.lock', 'a')
+		try:
+			fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except IOError:
+			lock.close()
+			continue
+		if os.path.isdir(n[2]):
+			print 'Removing index from cache: '+n[2]
+			shutil.rmtree(n[2])
+		total -= n[1]
+		fcntl.flock(lock, fcntl.LOCK_UN)
+		lock.close()
+
+#Return the index prefix of REF in the cache directory, building it if needed, and the lock (shared) to keep until the mapping ends.
+#Indexes are identified by the content of the reference, the indexer and its version.
+def cached_index(LOCA_PROGRAMS, TOOL, REF, CACHE, MAX_SIZE):
+	if TOOL == 'bowtie':
+		indexer = 'bowtie-build'
+	elif TOOL in ['bowtie2', 'bowtie2_single']:
+		indexer = 'bowtie2-build'
+	else:
+		indexer = 'bwa'
+	if not os.path.isdir(CACHE):
+		try:
+			os.makedirs(CACHE)
+		except OSError:
+			if not os.path.isdir(CACHE):
+				raise
+	key = hashlib.sha1('\n'.join([file_hash(REF), indexer, tool_version(LOCA_PROGRAMS.get('Programs',indexer))])).hexdigest()
+	entry = os.path.join(CACHE, key)
+	lock = open(entry+'.lock', 'a')
+	while True:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		if os.path.isdir(entry):
+			print 'Index found in cache: '+entry
+		else:
+			tmp = tempfile.mkdtemp(prefix=key+'_', dir=CACHE)
+			os.chmod(tmp, 0755)
+			try:
+				run_job(build_index(LOCA_PROGRAMS, TOOL, REF, os.path.join(tmp, 'index')), 'Indexing error:\n')
+			except SystemExit:
+				shutil.rmtree(tmp)
+				raise
+			os.rename(tmp, entry)
+		os.utime(entry, None)
+		#flock releases the exclusive lock before taking the shared one: the index may have been evicted by another run in between
+		fcntl.flock(lock, fcntl.LOCK_SH)
+		if os.path.isdir(entry):
+			break
+	evict_index(CACHE, MAX_SIZE, key)
+	return [os.path.join(entry, 'index'), lock]
+
+#Map a pair of fastq files on an already indexed reference, passing the pairs through the multi-hit filter if FILTER is given (see merge_sam.pair_filter).
+#Return [pair number, pair kept number] of the filter or None.
+def map_pair(LOCA_PROGRAMS, TOOL, INDEX_REF, Q1, Q2, ORIENT, MIN, MAX, QUAL, THREAD, STREAM, CONCURRENT, FILTER, OUT, OUT_FORMAT):
+	#the stream and concurrent modes run two mappers side by side: with a single thread, the mates are mapped one after the other
+	if int(THREAD) < 2 and TOOL != 'bowtie2' and (STREAM == 'y' or CONCURRENT == 'y'):
+		print 'A single thread is available: mate1 and mate2 are mapped sequentially'
+		STREAM = 'n'
+		CONCURRENT = 'n'
+	if TOOL in ['bowtie', 'bowtie2_single', 'bwa_mem']:
+		if STREAM == 'y':
+			return Mapping_stream(LOCA_PROGRAMS, TOOL, INDEX_REF, Q1, Q2, ORIENT, MIN, MAX, QUAL, THREAD, FILTER, OUT, OUT_FORMAT)
+		else:
+			return Mapping_single(LOCA_PROGRAMS, TOOL, INDEX_REF, Q1, Q2, ORIENT, MIN, MAX, QUAL, THREAD, CONCURRENT, FILTER, OUT, OUT_FORMAT)
+	elif TOOL == 'bowtie2':
+		mapping = '%s -D 20 -R 3 -N 0 -L 20 -i S,1,0.50 -I %s -X %s --%s -x %s -q1 %s -q2 %s --phred%s -p %s' % (LOCA_PROGRAMS.get('Programs','bowtie2'), MIN, MAX, ORIENT, INDEX_REF, Q1, Q2, QUAL, THREAD)
+		return run_mapping(LOCA_PROGRAMS, mapping, OUT, OUT_FORMAT, THREAD, 'Mapping error:\n', FILTER)
+	elif TOOL == 'bwa':
+		bwasai1 = OUT+'_mate1.sai'
+		bwasai2 = OUT+'_mate2.sai'
+		THREADS = mate_threads(TOOL, THREAD, CONCURRENT)
+		mapping1 = '%s aln -t %s %s %s > %s' % (LOCA_PROGRAMS.get('Programs','bwa'), THREADS[0], INDEX_REF, Q1, bwasai1)
+		mapping2 = '%s aln -t %s %s %s > %s' % (LOCA_PROGRAMS.get('Programs','bwa'), THREADS[1], INDEX_REF, Q2, bwasai2)
+		mapping2_1 = '%s sampe %s %s %s %s %s' % (LOCA_PROGRAMS.get('Programs','bwa'), INDEX_REF, bwasai1, bwasai2, Q1, Q2)
+		if CONCURRENT == 'y':
+			job1 = launch_job(mapping1)
+			job2 = launch_job(mapping2)
+			wait_job(job1, 'Mapping error:\n')
+			wait_job(job2, 'Mapping error:\n')
+		else:
 			run_job(mapping1, 'Mapping error:\n')
-			run_job(sorting1, 'Sorting error:\n')
-			os.remove(interm1)
 			run_job(mapping2, 'Mapping error:\n')
-			run_job(sorting2, 'Sorting error:\n')
-			os.remove(interm2)
-			run_job(merging, 'Merging error:\n')
-			os.remove(interm_sort1)
-			os.remove(interm_sort2)
-		elif TOOL == 'bwa':
+		counts = run_mapping(LOCA_PROGRAMS, mapping2_1, OUT, OUT_FORMAT, THREAD, 'Mapping2 error:\n', FILTER)
+		os.remove(bwasai1)
+		os.remove(bwasai2)
+		return counts
+
+def open_fastq(FASTQ):
+	if FASTQ.endswith('.gz'):
+		return gzip.open(FASTQ)
+	return open(FASTQ)
+
+#Open a chunk of fastq file for writing, with the fastest gzip compression if its name ends with .gz
+def open_shard(FASTQ):
+	if FASTQ.endswith('.gz'):
+		return gzip.open(FASTQ, 'wb', 1)
+	return open(FASTQ, 'w')
+
+#Split a pair of fastq files in at most NB_SHARD consecutive record-aligned chunks of about the same size, in a single pass without counting the reads first.
+#The chunks are cut on the position reached in Q1 (compressed position for a gzipped file) and yielded as [mate1 file, mate2 file] as soon as they are written,
+#compressed if Q1 is, so that their mapping starts while the next chunks are written
+def split_fastq(Q1, Q2, NB_SHARD, PREFIX):
+	size = os.path.getsize(Q1)
+	fichier1 = open_fastq(Q1)
+	fichier2 = open_fastq(Q2)
+	if Q1.endswith('.gz'):
+		position = fichier1.fileobj.tell
+		suffix = '.fastq.gz'
+	else:
+		position = fichier1.tell
+		suffix = '.fastq'
+	i = 0
+	shard = None
+	while True:
+		record1 = fichier1.readline()
+		record2 = fichier2.readline()
+		if not record1 or not record2:
+			if record1 or record2:
+				sys.exit('Mate1 and mate2 fastq files do not contain the same number of reads')
+			break
+		for n in range(3):
+			record1 += fichier1.readline()
+			record2 += fichier2.readline()
+		if shard is None:
+			shard = [PREFIX+str(i)+'_mate1'+suffix, PREFIX+str(i)+'_mate2'+suffix]
+			outfiles = [open_shard(shard[0]), open_shard(shard[1])]
+		outfiles[0].write(record1)
+		outfiles[1].write(record2)
+		if i < NB_SHARD-1 and position() >= (i+1)*size/NB_SHARD:
+			outfiles[0].close()
+			outfiles[1].close()
+			yield shard
+			shard = None
+			i += 1
+	fichier1.close()
+	fichier2.close()
+	if shard is None and i == 0:
+		#no read: a single empty chunk
+		shard = [PREFIX+'0_mate1'+suffix, PREFIX+'0_mate2'+suffix]
+		outfiles = [open_shard(shard[0]), open_shard(shard[1])]
+	if shard is not None:
+		outfiles[0].close()
+		outfiles[1].close()
+		yield shard
+
+#Map one shard in its own process (see ShardRunner), sending its filter counts through PIPE. A process that exits without sending them has failed
+def shard_worker(JOB, PIPE):
+	PIPE.send(map_pair(*JOB))
+	PIPE.close()
+
+#Map shards in separate processes, NB_PROC at most at the same time.
+#A shard whose process fails, crashes or is killed (out of memory...) is mapped again up to RETRY times, its fastq files being removed once it is mapped
+class ShardRunner:
+	def __init__(self, NB_PROC, RETRY):
+		self.nb_proc = NB_PROC
+		self.retry = RETRY
+		self.jobs = []
+		self.files = []
+		self.attempts = []
+		self.waiting = []
+		self.running = {}
+		self.results = {}
+		self.failed = []
+
+	#Queue the mapping job (arguments of map_pair()) of a shard and the files to remove once it is mapped
+	def add(self, JOB, FILES):
+		self.waiting.append(len(self.jobs))
+		self.jobs.append(JOB)
+		self.files.append(FILES)
+		self.attempts.append(0)
+		self.poll()
+
+	#Collect the finished shards and start the waiting ones
+	def poll(self):
+		for i in sorted(self.running):
+			proc, reader = self.running[i]
+			if proc.is_alive():
+				continue
+			proc.join()
+			try:
+				result = reader.recv()
+				done = proc.exitcode == 0
+			except EOFError:
+				done = False
+			reader.close()
+			del self.running[i]
+			if done:
+				self.results[i] = result
+				for n in self.files[i]:
+					os.remove(n)
+			else:
+				print 'Mapping of shard '+str(i)+' failed (attempt '+str(self.attempts[i])+', exit code '+str(proc.exitcode)+')'
+				if self.attempts[i] <= self.retry:
+					self.waiting.append(i)
+				else:
+					self.failed.append(i)
+		while self.waiting and len(self.running) < self.nb_proc:
+			i = self.waiting.pop(0)
+			self.attempts[i] += 1
+			reader, writer = multiprocessing.Pipe(False)
+			sys.stdout.flush()
+			proc = multiprocessing.Process(target=shard_worker, args=(self.jobs[i], writer))
+			proc.start()
+			writer.close()
+			self.running[i] = [proc, reader]
+
+	#Wait for all the shards and return the filter counts of each mapped shard and the list of the shards that could not be mapped
+	def wait(self):
+		while self.running or self.waiting:
+			time.sleep(1)
+			self.poll()
+		for i in self.failed:
+			for n in self.files[i]:
+				os.remove(n)
+		return [self.results, sorted(self.failed)]
+
+#Split the fastq files in NB_SHARD chunks mapped in parallel and concatenate the shard sam files in the fastq order
+def Mapping_shard(LOCA_PROGRAMS, TOOL, INDEX_REF, Q1, Q2, ORIENT, MIN, MAX, QUAL, THREAD, STREAM, CONCURRENT, FILTER, NB_SHARD, RETRY, OUT, OUT_FORMAT):
+	nb_proc = max(1, min(NB_SHARD, int(THREAD)))
+	shard_thread = str(max(1, int(THREAD)/nb_proc))
+	runner = ShardRunner(nb_proc, int(RETRY))
+	LIST_SAM = []
+	for shard in split_fastq(Q1, Q2, NB_SHARD, OUT+'_shard'):
+		LIST_SAM.append(OUT+'_shard'+str(len(LIST_SAM))+'.sam')
+		runner.add([LOCA_PROGRAMS, TOOL, INDEX_REF, shard[0], shard[1], ORIENT, MIN, MAX, QUAL, shard_thread, STREAM, CONCURRENT, FILTER, LIST_SAM[-1], 'sam'], shard)
+	results = runner.wait()
+	if results[1]:
+		for n in LIST_SAM:
+			if os.path.isfile(n):
+				os.remove(n)
+		sys.exit('Mapping error: shards '+', '.join([str(i) for i in results[1]])+' could not be mapped')
+	results = [results[0][i] for i in range(len(LIST_SAM))]
+	nb_shard = len(LIST_SAM)
+	writer = utils.openSamWriter(LOCA_PROGRAMS, OUT, OUT_FORMAT, THREAD)
+	outfile = writer[0]
+	for i in range(nb_shard):
+		fichier = open(LIST_SAM[i])
+		for line in fichier:
+			if line[0] != '@':
+				outfile.write(line)
+			elif i == 0:
+				#shards are concatenated so the whole file is not sorted any more
+				if line.startswith('@HD'):
+					line = line.replace('SO:queryname', 'SO:unsorted').replace('SO:coordinate', 'SO:unsorted')
+				outfile.write(line)
+		fichier.close()
+		os.remove(LIST_SAM[i])
+	utils.closeSamWriter(writer)
+	if FILTER is not None:
+		counts = [sum([n[0] for n in results]), sum([n[1] for n in results])]
+		print 'All shards:'
+		merge_sam.print_filter(counts)
+		return counts
+
+def Mapping(LOCA_PROGRAMS, TOOL, REF, Q1, Q2, ORIENT, MIN, MAX, QUAL, INDEX, RMINDEX, THREAD, STREAM, CONCURRENT, INDEX_CACHE, CACHE_SIZE, NB_SHARD, RETRY, FILTER, OUT, OUT_FORMAT):
+		t0 = datetime.datetime.now()
+		print t0
+		if INDEX_CACHE != 'not_filled':
+			cache = cached_index(LOCA_PROGRAMS, TOOL, REF, INDEX_CACHE, CACHE_SIZE)
+			INDEX_REF = cache[0]
+		else:
+			INDEX_REF = REF
 			if INDEX == 'y':
-				build_index = '%s index -a bwtsw %s 2>/dev/null' % (LOCA_PROGRAMS.get('Programs','bwa'), REF)
-				run_job(build_index,'Indexing error:')
-			bwasai1 = OUT+'_mate1.sai'
-			bwasai2 = OUT+'_mate2.sai'
-			mapping1 = '%s aln -t %s %s %s > %s' % (LOCA_PROGRAMS.get('Programs','bwa'), THREAD, REF, Q1, bwasai1)
-			mapping2 = '%s aln -t %s %s %s > %s' % (LOCA_PROGRAMS.get('Programs','bwa'), THREAD, REF, Q2, bwasai2)
-			mapping2_1 = '%s sampe %s %s %s %s %s > %s' % (LOCA_PROGRAMS.get('Programs','bwa'), REF, bwasai1, bwasai2, Q1, Q2, OUT)
-			run_job(mapping1, 'Mapping error:\n')
-			run_job(mapping2, 'Mapping error:\n')
-			run_job(mapping2_1, 'Mapping2 error:\n')
-			os.remove(bwasai1)
-			os.remove(bwasai2)
-		if RMINDEX == 'y':
+				run_job(build_index(LOCA_PROGRAMS, TOOL, REF, REF), 'Indexing error:\n')
+		if NB_SHARD > 1:
+			counts = Mapping_shard(LOCA_PROGRAMS, TOOL, INDEX_REF, Q1, Q2, ORIENT, MIN, MAX, QUAL, THREAD, STREAM, CONCURRENT, FILTER, NB_SHARD, RETRY, OUT, OUT_FORMAT)
+		else:
+			counts = map_pair(LOCA_PROGRAMS, TOOL, INDEX_REF, Q1, Q2, ORIENT, MIN, MAX, QUAL, THREAD, STREAM, CONCURRENT, FILTER, OUT, OUT_FORMAT)
+		if INDEX_CACHE != 'not_filled':
+			#indexes of the cache are kept for the next runs
+			fcntl.flock(cache[1], fcntl.LOCK_UN)
+			cache[1].close()
+		elif RMINDEX == 'y':
 			for filename in glob.glob(REF+'.*'):
 				# print filename
 				os.remove(filename)
 		print datetime.datetime.now() - t0
+		return counts
 
 def __main__():
 	#Parse Command Line
@@ -186,6 +555,16 @@ def __main__():
 	parser.add_option( '', '--index', dest='index', default='y', help='Build reference index : y or n,  [default: %default]')
 	parser.add_option( '', '--rmindex', dest='rmindex', default='y', help='Remove reference index at the end of calculation: y or n, [default: %default]')
 	parser.add_option( '', '--thread', dest='thread', default='1', help='The thread number used for mapping (integer), [default: %default]')
+	parser.add_option( '', '--stream', dest='stream', default='n', help='Pair mate1 and mate2 alignments on the fly without intermediate sam and sorting (bowtie, bowtie2_single and bwa_mem only): y or n, [default: %default]')
+	parser.add_option( '', '--concurrent', dest='concurrent', default='n', help='Map mate1 and mate2 at the same time, sharing the --thread number between them (bowtie, bowtie2_single, bwa and bwa_mem only): y or n, [default: %default]')
+	parser.add_option( '', '--index_cache', dest='index_cache', default='not_filled', help='Directory of reference indexes shared between runs. If filled, --index and --rmindex are ignored and the index is built only if not already in this directory')
+	parser.add_option( '', '--index_cache_size', dest='index_cache_size', default='50', help='Maximal size (in Go) of the index cache directory, least recently used indexes being removed first, [default: %default]')
+	parser.add_option( '', '--shard', dest='shard', default='1', help='Number of chunks the fastq files are split in to be mapped in parallel, the --thread number being shared between them (integer), [default: %default]')
+	parser.add_option( '', '--shard_retry', dest='shard_retry', default='1', help='Number of times a failed chunk is mapped again (integer), [default: %default]')
+	parser.add_option( '', '--out_format', dest='out_format', default='sam', help='Output format: sam or bam (compressed with --thread threads), [default: %default]')
+	parser.add_option( '', '--filter_asxs', dest='filter_asxs', default='not_filled', help='Keep only pairs whose mates have a difference between the best and second hit (AS/XS tags) reaching this value, filtering the pairs while they are written (same filter as 3_filter_single_pair.py --asxs)')
+	parser.add_option( '', '--filter_qual', dest='filter_qual', default='not_filled', help='Keep only pairs whose mates have a mapping quality reaching this value, filtering the pairs while they are written (same filter as 3_filter_single_pair.py --qual)')
+	parser.add_option( '', '--fuse_filter', dest='fuse_filter', default='n', help='With --config, apply the multi-hit filter of 3_filter_single_pair.py while the pairs are written: y or n, [default: %default]')
 	parser.add_option( '', '--out', dest='out', default='mate.sam', help='The ouput of mapped reads, [default: %default]')
 	parser.add_option( '', '--config', dest='config', default=None)
 	(options, args) = parser.parse_args()
@@ -200,14 +579,57 @@ def __main__():
 	if options.config:
 		config = ConfigParser.RawConfigParser()
 		config.read(options.config)
-		Mapping(loca_programs, config.get('General','tool'), config.get('General','ref'), config.get('General','q1'), config.get('General','q2'), config.get('General','orient'), config.get('General','mini'), config.get('General','maxi'), config.get('General','qual'), config.get('General','index'), config.get('General','rmindex'), config.get('General','thread'), options.out, pathname)
-		config.set('Mapping', 'out', options.out)
+		if config.has_option('General','stream'):
+			stream = config.get('General','stream')
+		else:
+			stream = options.stream
+		if config.has_option('General','concurrent'):
+			concurrent = config.get('General','concurrent')
+		else:
+			concurrent = options.concurrent
+		if config.has_option('General','index_cache'):
+			index_cache = config.get('General','index_cache')
+			index_cache_size = config.get('General','index_cache_size')
+		else:
+			index_cache = options.index_cache
+			index_cache_size = options.index_cache_size
+		if config.has_option('General','shard'):
+			shard = config.get('General','shard')
+			shard_retry = config.get('General','shard_retry')
+		else:
+			shard = options.shard
+			shard_retry = options.shard_retry
+		if config.has_option('General','out_format'):
+			out_format = config.get('General','out_format')
+		else:
+			out_format = options.out_format
+		if config.has_option('General','fuse_filter'):
+			fuse_filter = config.get('General','fuse_filter')
+		else:
+			fuse_filter = options.fuse_filter
 		if config.get('General','tool') in ['bowtie', 'bowtie2', 'bowtie2_single']:
-			config.set('Single_filter', 'asxs', 1)
-			config.set('Single_filter', 'qual', 'not_filled')
+			asxs = 1
+			qual = 'not_filled'
+		else:
+			asxs = 'not_filled'
+			qual = 0
+		if fuse_filter == 'y' and config.get('Single_filter','filter_multi') == 'y':
+			FILTER = merge_sam.pair_filter(asxs, qual)
+		else:
+			FILTER = None
+		counts = Mapping(loca_programs, config.get('General','tool'), config.get('General','ref'), config.get('General','q1'), config.get('General','q2'), config.get('General','orient'), config.get('General','mini'), config.get('General','maxi'), config.get('General','qual'), config.get('General','index'), config.get('General','rmindex'), config.get('General','thread'), stream, concurrent, index_cache, index_cache_size, int(shard), shard_retry, FILTER, options.out, out_format)
+		config.set('Mapping', 'out', options.out)
+		config.set('Mapping', 'type', out_format)
+		utils.setFileState(config, 'Mapping', 'grouped', 'n')
+		config.set('Single_filter', 'asxs', asxs)
+		config.set('Single_filter', 'qual', qual)
+		#3_filter_single_pair.py only reports the counts of a filter already applied here
+		if counts is None:
+			config.set('Single_filter', 'fused', 'n')
 		else:
-			config.set('Single_filter', 'asxs', 'not_filled')
-			config.set('Single_filter', 'qual', 0)
+			config.set('Single_filter', 'fused', 'y')
+			config.set('Single_filter', 'nb_input', counts[0])
+			config.set('Single_filter', 'nb_kept', counts[1])
 		with open(options.config, 'wb') as configfile:
 			config.write(configfile)
 	else:#For commande line
@@ -217,7 +639,7 @@ def __main__():
 			sys.exit('--q2 argument is missing')
 		if options.ref == 'not_filled':
 			sys.exit('--ref argument is missing')
-		Mapping(loca_programs, options.tool, options.ref, options.q1, options.q2, options.orient, options.mini, options.maxi, options.qual, options.index, options.rmindex, options.thread, options.out, pathname)
+		Mapping(loca_programs, options.tool, options.ref, options.q1, options.q2, options.orient, options.mini, options.maxi, options.qual, options.index, options.rmindex, options.thread, options.stream, options.concurrent, options.index_cache, options.index_cache_size, int(options.shard), options.shard_retry, merge_sam.pair_filter(options.filter_asxs, options.filter_qual), options.out, options.out_format)
 
 
 
@@ -23,128 +23,268 @@
 #
 #
 
-import optparse, os, shutil, subprocess, sys, tempfile, fileinput, ConfigParser, operator, time
+import optparse, os, shutil, subprocess, sys, tempfile, fileinput, ConfigParser, operator, time, multiprocessing
+import bisect, struct, zlib, pysam
+import utilsSR.utilsSR as utils
+import merge_sam
 
 
-def find_info(LINE):
-	dic = {}
-	for n in LINE[11:]:
-		liste = n.split(':')
-		dic[liste[0]] = liste[2]
-	return dic
+#File-like object reading the lines of FILE starting in the byte range [START, END[, START being a line start
+class RangeFile:
+	def __init__(self, FILE, START, END):
+		self.file = open(FILE)
+		self.file.seek(START)
+		self.left = END - START
+	def readline(self):
+		if self.left <= 0:
+			return ''
+		line = self.file.readline()
+		self.left -= len(line)
+		return line
+	def close(self):
+		self.file.close()
 
+#Return the offset of the first pair starting at or after the byte POS of a name grouped sam file (mates on consecutive lines)
+def pair_start(FILE, POS):
+	FILE.seek(POS-1)
+	FILE.readline()
+	start = FILE.tell()
+	line1 = FILE.readline()
+	line2 = FILE.readline()
+	if line1 and (not line2 or line1.split('\t', 1)[0] != line2.split('\t', 1)[0]):
+		#line1 is the second mate of a pair (possibly the last line of the file)
+		return start + len(line1)
+	return start
 
-def Filtre(SAM, ASXS, QUAL, OUT):
-	outfile = open(OUT, 'w')
-	
-	nb_input = 0
-	nb_kept = 0
-	
-	file = open(SAM)
-	if QUAL == 'not_filled':
-		min_dif = int(ASXS)
-		l1 = file.readline().split()
-		while l1[0][0] == '@':
-			outfile.write('\t'.join(l1)+'\n')
-			l1 = file.readline().split()
-		l2 = file.readline().split()
-		while l1:
-			nb_input += 1
-			if l1[0] != l2[0]:
-				sys.exit('Read should be sorted by query name in the sam file')
-			dico1 = find_info(l1)
-			dico2 = find_info(l2)
-			if 'XS' in dico1:
-				if 'XS' in dico2:
-					if abs(int(dico1['AS'])-int(dico1['XS'])) >= min_dif and abs(int(dico2['AS'])-int(dico2['XS'])) >= min_dif:
-						outfile.write('\t'.join(l1)+'\n')
-						outfile.write('\t'.join(l2)+'\n')
-						nb_kept += 1
-				else:
-					if abs(int(dico1['AS'])-int(dico1['XS'])) >= min_dif:
-						outfile.write('\t'.join(l1)+'\n')
-						outfile.write('\t'.join(l2)+'\n')
-						nb_kept += 1
-			elif 'XS' in dico2:
-				if abs(int(dico2['AS'])-int(dico2['XS'])) >= min_dif:
-					outfile.write('\t'.join(l1)+'\n')
-					outfile.write('\t'.join(l2)+'\n')
-					nb_kept += 1
-			else:
-				outfile.write('\t'.join(l1)+'\n')
-				outfile.write('\t'.join(l2)+'\n')
-				nb_kept += 1
-			l1 = file.readline().split()
-			l2 = file.readline().split()
-
-	elif ASXS == 'not_filled':
-		min_qual = int(QUAL)
-		l1 = file.readline().split()
-		while l1[0][0] == '@':
-			outfile.write('\t'.join(l1)+'\n')
-			l1 = file.readline().split()
-		l2 = file.readline().split()
-		while l1:
-			nb_input += 1
-			if l1[0] != l2[0]:
-				sys.exit('Read should be sorted by query name in the sam file')
-			if int(l1[4]) >= min_qual and int(l2[4]) >= min_qual:
-				outfile.write('\t'.join(l1)+'\n')
-				outfile.write('\t'.join(l2)+'\n')
-				nb_kept += 1
-			l1 = file.readline().split()
-			l2 = file.readline().split()
+#File-like object giving the sam lines of the records of the bam file BAM whose virtual offset is in [START, END[ (END being None for the end of the file), START being a record start.
+#An error is raised if the records do not end exactly at END, END being then a wrongly guessed record start.
+class BamRangeFile:
+	def __init__(self, BAM, START, END):
+		self.bam = pysam.AlignmentFile(BAM, 'rb', check_sq=False)
+		self.bam.seek(START)
+		self.end = END
+	def readline(self):
+		if self.end is not None and self.bam.tell() >= self.end:
+			if self.bam.tell() != self.end:
+				raise ValueError('The bam records do not end at the virtual offset '+str(self.end))
+			return ''
+		read = next(self.bam, None)
+		if read is None:
+			if self.end is not None:
+				raise ValueError('The bam records do not end at the virtual offset '+str(self.end))
+			return ''
+		return read.to_string()+'\n'
+	def close(self):
+		self.bam.close()
+
+#Return the offsets of the BGZF blocks of the bam file BAM, followed by the file size
+def bgzf_blocks(BAM):
+	blocks = []
+	file = open(BAM, 'rb')
+	offset = 0
+	header = file.read(18)
+	while header:
+		if len(header) < 18 or header[:4] != b'\x1f\x8b\x08\x04':
+			sys.exit('Error: '+BAM+' is not a BGZF compressed bam file')
+		xlen = struct.unpack_from('<H', header, 10)[0]
+		extra = header[12:] + file.read(xlen-6)
+		bsize = None
+		i = 0
+		while i + 4 <= xlen:
+			slen = struct.unpack_from('<H', extra, i+2)[0]
+			if extra[i:i+2] == b'BC' and slen == 2:
+				bsize = struct.unpack_from('<H', extra, i+4)[0]
+			i += 4 + slen
+		if bsize is None:
+			sys.exit('Error: '+BAM+' is not a BGZF compressed bam file')
+		blocks.append(offset)
+		offset += bsize + 1
+		file.seek(offset)
+		header = file.read(18)
+	file.close()
+	blocks.append(offset)
+	return blocks
+
+#Return the offset of the record following the one starting at POS in the decompressed bam data DATA, or None if the fields of this record are not consistent
+def record_end(DATA, POS, NB_REF):
+	block_size, ref, pos, l_name, mapq, bin, n_cigar, flag, l_seq, next_ref, next_pos, tlen = struct.unpack_from('<iiiBBHHHiiii', DATA, POS)
+	if not (-1 <= ref < NB_REF and -1 <= next_ref < NB_REF and pos >= -1 and next_pos >= -1 and l_name > 1 and l_seq >= 0):
+		return None
+	if block_size < 32 + l_name + 4*n_cigar + (l_seq+1)/2 + l_seq:
+		return None
+	name = DATA[POS+36:POS+36+l_name]
+	if len(name) == l_name and (name[-1:] != b'\x00' or b'\x00' in name[:-1]):
+		return None
+	return POS + 4 + block_size
+
+#Return the offset of the first record starting in the FIRST_SIZE first bytes of the decompressed bam data DATA, or None.
+#An offset is kept when the records chained from it are consistent up to the end of DATA.
+def first_record(DATA, FIRST_SIZE, NB_REF):
+	for start in xrange(FIRST_SIZE):
+		pos = start
+		while pos is not None and pos + 36 <= len(DATA):
+			pos = record_end(DATA, pos, NB_REF)
+		if pos is not None:
+			return start
+	return None
+
+#Return the name of the record starting at POS in the decompressed bam data DATA
+def record_name(DATA, POS):
+	return DATA[POS+36:POS+35+struct.unpack_from('<B', DATA, POS+12)[0]]
+
+#Return the virtual offset of the first pair starting in or after the BGZF block I of the name grouped bam file FILE opened in binary mode, BLOCKS being given by bgzf_blocks, or None
+def bam_pair_start(FILE, BLOCKS, I, NB_REF):
+	for j in range(I, len(BLOCKS)-1):
+		#the records are checked on the two following blocks at least
+		FILE.seek(BLOCKS[j])
+		data = b''
+		ends = []
+		k = j
+		while k < len(BLOCKS)-1 and (not ends or len(data) < ends[0] + 131072):
+			data += zlib.decompress(FILE.read(BLOCKS[k+1]-BLOCKS[k]), 31)
+			ends.append(len(data))
+			k += 1
+		start = first_record(data, ends[0], NB_REF)
+		if start is not None:
+			end1 = record_end(data, start, NB_REF)
+			if end1 + 36 > len(data) or record_name(data, start) != record_name(data, end1):
+				#the first record is the second mate of a pair
+				start = end1
+			#virtual offset of start, a record ending with a block being followed by the start of the next block
+			for b in range(len(ends)):
+				if start < ends[b]:
+					return (BLOCKS[j+b] << 16) | (start - (ends[b-1] if b else 0))
+			return BLOCKS[k] << 16
+	return None
+
+def filter_range(job):
+	if job[5] == 'bam':
+		fichier = BamRangeFile(job[0], job[1], job[2])
 	else:
-		min_dif = int(ASXS)
-		min_qual = int(QUAL)
-		l1 = file.readline().split()
-		while l1[0][0] == '@':
-			outfile.write('\t'.join(l1)+'\n')
-			l1 = file.readline().split()
-		l2 = file.readline().split()
-		while l1:
-			nb_input += 1
-			if l1[0] != l2[0]:
-				sys.exit('Read should be sorted by query name in the sam file')
-			dico1 = find_info(l1)
-			dico2 = find_info(l2)
-			if 'XS' in dico1:
-				if 'XS' in dico2:
-					if abs(int(dico1['AS'])-int(dico1['XS'])) >= min_dif and abs(int(dico2['AS'])-int(dico2['XS'])) >= min_dif:
-						if int(l1[4]) >= min_qual and int(l2[4]) >= min_qual:
-							outfile.write('\t'.join(l1)+'\n')
-							outfile.write('\t'.join(l2)+'\n')
-							nb_kept += 1
-				else:
-					if abs(int(dico1['AS'])-int(dico1['XS'])) >= min_dif:
-						if int(l1[4]) >= min_qual and int(l2[4]) >= min_qual:
-							outfile.write('\t'.join(l1)+'\n')
-							outfile.write('\t'.join(l2)+'\n')
-							nb_kept += 1
-			elif 'XS' in dico2:
-				if abs(int(dico2['AS'])-int(dico2['XS'])) >= min_dif:
-					if int(l1[4]) >= min_qual and int(l2[4]) >= min_qual:
-						outfile.write('\t'.join(l1)+'\n')
-						outfile.write('\t'.join(l2)+'\n')
-						nb_kept += 1
-			else:
-				if int(l1[4]) >= min_qual and int(l2[4]) >= min_qual:
-					outfile.write('\t'.join(l1)+'\n')
-					outfile.write('\t'.join(l2)+'\n')
-					nb_kept += 1
-			l1 = file.readline().split()
-			l2 = file.readline().split()
+		fichier = RangeFile(job[0], job[1], job[2])
+	outfile = open(job[3], 'w')
+	try:
+		counts = merge_sam.filter_stream(fichier, outfile, job[4])
+	except SystemExit, e:
+		#an exit would leave the pool waiting for the result of this job
+		raise ValueError(str(e))
+	finally:
+		outfile.close()
+		fichier.close()
+	return counts
+
+#Filter the ranges of LISTE_JOB in NB_PROC workers and return their counts, or None if a worker fails, the output files of the workers being then removed
+def filter_ranges(LISTE_JOB, NB_PROC):
+	pool = multiprocessing.Pool(processes=NB_PROC)
+	try:
+		results = pool.map(filter_range, LISTE_JOB)
+	except Exception, e:
+		print 'Parallel filtering failed: '+str(e)
+		results = None
+	pool.close()
+	pool.join()
+	if results is None:
+		for n in LISTE_JOB:
+			if os.path.isfile(n[3]):
+				os.remove(n[3])
+	return results
+
+#Write the filtered files of LISTE_JOB to OUTFILE in order and remove them
+def concat_ranges(LISTE_JOB, OUTFILE):
+	for n in LISTE_JOB:
+		chunk = open(n[3])
+		shutil.copyfileobj(chunk, OUTFILE, 1048576)
+		chunk.close()
+		os.remove(n[3])
+
+#Sam input: the file is cut in NB_PROC byte ranges aligned on pairs, each range being filtered by a worker in its own file and the files being concatenated in order.
+#Return the counts, or None if a worker fails.
+def Filtre_sam_parallel(LOCA_PROGRAMS, SAM, FILTER, OUT, TYPE, THREAD, NB_PROC):
+	file = open(SAM)
+	header = []
+	line = file.readline()
+	while line and line[0] == '@':
+		header.append(line)
+		line = file.readline()
+	header_end = file.tell() - len(line)
+	size = os.path.getsize(SAM)
+	bornes = [header_end]
+	for i in range(1, NB_PROC):
+		bornes.append(max(bornes[-1], pair_start(file, header_end + (size-header_end)*i/NB_PROC)))
+	bornes.append(size)
+	file.close()
+	liste_job = []
+	for i in range(NB_PROC):
+		liste_job.append([SAM, bornes[i], bornes[i+1], OUT+'_chunk'+str(i)+'.sam', FILTER, TYPE])
+	results = filter_ranges(liste_job, NB_PROC)
+	if results is None:
+		return None
+	writer = utils.openSamWriter(LOCA_PROGRAMS, OUT, TYPE, THREAD)
+	writer[0].writelines(header)
+	concat_ranges(liste_job, writer[0])
+	utils.closeSamWriter(writer)
+	return [sum([n[0] for n in results]), sum([n[1] for n in results])]
 
-	print('Mapped pairs: %s' % nb_input)
-	print('Mapped pairs kept: %s' % nb_kept)
-	print('Mapped pairs proportion kept: %s' % str(float(nb_kept)/float(nb_input)))
+#Bam input: the BGZF blocks are cut in NB_PROC ranges, each range starting at the first pair of its first block and being given to a worker as virtual offsets.
+#The first record of a block is guessed from the consistency of the records chained from it; a wrong guess is detected by the worker of the previous range, which has to end exactly at this record.
+#Return the counts, or None if a worker fails.
+def Filtre_bam_parallel(LOCA_PROGRAMS, SAM, FILTER, OUT, TYPE, THREAD, NB_PROC):
+	blocks = bgzf_blocks(SAM)
+	bam = pysam.AlignmentFile(SAM, 'rb', check_sq=False)
+	first = bam.tell()
+	nb_ref = bam.nreferences
+	bam.close()
+	file = open(SAM, 'rb')
+	bornes = [first]
+	for i in range(1, NB_PROC):
+		j = bisect.bisect_left(blocks, blocks[-1]*i/NB_PROC, 0, len(blocks)-1)
+		if blocks[j] <= first >> 16:
+			continue
+		start = bam_pair_start(file, blocks, j, nb_ref)
+		if start is not None and start > bornes[-1]:
+			bornes.append(start)
+	bornes.append(None)
+	file.close()
+	liste_job = []
+	for i in range(len(bornes)-1):
+		liste_job.append([SAM, bornes[i], bornes[i+1], OUT+'_chunk'+str(i)+'.sam', FILTER, TYPE])
+	results = filter_ranges(liste_job, NB_PROC)
+	if results is None:
+		return None
+	writer = utils.openSamWriter(LOCA_PROGRAMS, OUT, TYPE, THREAD)
+	reader = utils.openSamReader(LOCA_PROGRAMS, SAM, TYPE, True)
+	shutil.copyfileobj(reader[0], writer[0])
+	utils.closeSamReader(reader)
+	concat_ranges(liste_job, writer[0])
+	utils.closeSamWriter(writer)
+	return [sum([n[0] for n in results]), sum([n[1] for n in results])]
+
+#The output file has the same format as the input file (sam or bam), bam being read and written on the fly by samtools.
+#With more than one thread, the pairs are filtered in parallel and written in the input order. If the parallel filtering fails, the file is filtered again in a single process to report the error.
+def Filtre(LOCA_PROGRAMS, SAM, TYPE, ASXS, QUAL, OUT, THREAD):
+	FILTER = merge_sam.pair_filter(ASXS, QUAL)
+	nb_proc = int(THREAD)
+	counts = None
+	if nb_proc > 1 and TYPE == 'sam':
+		counts = Filtre_sam_parallel(LOCA_PROGRAMS, SAM, FILTER, OUT, TYPE, THREAD, nb_proc)
+	elif nb_proc > 1 and TYPE == 'bam':
+		counts = Filtre_bam_parallel(LOCA_PROGRAMS, SAM, FILTER, OUT, TYPE, THREAD, nb_proc)
+	if counts is None:
+		writer = utils.openSamWriter(LOCA_PROGRAMS, OUT, TYPE, THREAD)
+		reader = utils.openSamReader(LOCA_PROGRAMS, SAM, TYPE)
+		counts = merge_sam.filter_stream(reader[0], writer[0], FILTER)
+		utils.closeSamReader(reader)
+		utils.closeSamWriter(writer)
+	merge_sam.print_filter(counts)
 
 def __main__():
 	#Parse Command Line
 	parser = optparse.OptionParser(usage="python %prog [options]\n\nProgram designed by Guillaume MARTIN : guillaume.martin@cirad.fr"
 	"\n\n This script takes a sam file and output only paired reads were both mates pass filter threshold on the AS/XS flags or mapping quality or both provided.")
 	# Wrapper options. 
-	parser.add_option( '', '--sam', dest='sam', default='not_filled', help='Paired sam file')
+	parser.add_option( '', '--sam', dest='sam', default='not_filled', help='Paired sam/bam file')
+	parser.add_option( '', '--type', dest='type', default='sam', help='Input type : sam or bam, the output having the same type, [default: %default]')
+	parser.add_option( '', '--thread', dest='thread', default='1', help='The thread number used for filtering and bam compression (integer), [default: %default]')
 	parser.add_option( '', '--asxs', dest='asxs', default='not_filled', help='Minimal difference between the best and second hit accepted to consider the hit as single')
 	parser.add_option( '', '--qual', dest='qual', default='not_filled', help='Minimal mapping quality to keep the hit')
 	parser.add_option( '', '--rminput', dest='rminput', default='n', help='Remove input file: y or n, [default: %default]')
@@ -154,18 +294,35 @@ def __main__():
 	
 	
 	
+	pathname = os.path.dirname(sys.argv[0])
+	
+	loca_programs = ConfigParser.RawConfigParser()
+	loca_programs.read(pathname+'/loca_programs.conf')
+	
 	if options.config:
 		config = ConfigParser.RawConfigParser()
 		config.read(options.config)
-		if config.get('Single_filter','filter_multi') == 'y':
-			Filtre(config.get('Mapping','out'), config.get('Single_filter','asxs'), config.get('Single_filter','qual'), options.out)
+		if config.has_option('Mapping','type'):
+			type = config.get('Mapping','type')
+		else:
+			type = 'sam'
+		if config.has_option('Single_filter','fused') and config.get('Single_filter','fused') == 'y':
+			print 'The multi-hit filter has already been applied by 2_map.py'
+			merge_sam.print_filter([config.getint('Single_filter','nb_input'), config.getint('Single_filter','nb_kept')])
+			if config.get('Single_filter','rminput') == 'y':
+				shutil.move(config.get('Mapping','out'), options.out)
+			else:
+				shutil.copyfile(config.get('Mapping','out'), options.out)
+		elif config.get('Single_filter','filter_multi') == 'y':
+			Filtre(loca_programs, config.get('Mapping','out'), type, config.get('Single_filter','asxs'), config.get('Single_filter','qual'), options.out, config.get('General','thread'))
 		else:
 			print 'The input sam is the sam as the output sam in 3_filter_single_pair'
 			os.system('cp % %' % (config.get('Mapping','out'), options.out))
-		if config.get('Single_filter','rminput') == 'y':
+		if config.get('Single_filter','rminput') == 'y' and os.path.isfile(config.get('Mapping','out')):
 			os.remove(config.get('Mapping','out'))
 		config.set('Single_filter', 'out', options.out)
-		config.set('Single_filter', 'type', 'sam')
+		config.set('Single_filter', 'type', type)
+		utils.setFileState(config, 'Single_filter', utils.getFileSort(config, 'Mapping', 'grouped'), 'n')
 		config.set('Remove_dup', 'sort', 'coordinate')
 		with open(options.config, 'wb') as configfile:
 			config.write(configfile)
@@ -176,7 +333,7 @@ def __main__():
 			print 'No --asxs or --qual argument are passed the imput sam is the sam as the output sam in 3_filter_single_pair'
 			os.system('cp % %' % (options.sam, options.out))
 		else:
-			Filtre(options.sam, options.asxs, options.qual, options.out)
+			Filtre(loca_programs, options.sam, options.type, options.asxs, options.qual, options.out, options.thread)
 		if options.rminput == 'y':
 			os.remove(options.sam)
 
@@ -23,7 +23,8 @@
 #
 #
 
-import optparse, os, shutil, subprocess, sys, tempfile, fileinput, ConfigParser, operator, time
+import optparse, os, shutil, subprocess, sys, tempfile, fileinput, ConfigParser, operator, time, array
+import utilsSR.utilsSR as utils
 
 def stop_err( msg ):
     sys.stderr.write( "%s\n" % msg )
@@ -55,36 +56,240 @@ def run_job (cmd_line, ERROR):
 	except Exception, e:
 		stop_err( ERROR + str( e ) )
 
-def Filter(LOCA_PROGRAMS, SAM, TYPE, SORT, OUT):
-	bamfile = OUT+'_filtered.bam'
-	sortedbam = OUT+'_sorted.bam'
-	rmdupbam = OUT+'_rmdup.bam'
-	rmdupmetrics = OUT+'_rmdupmetrics.bam'
-	temporary = OUT+'_tmp'
-	if TYPE == 'sam':
-		filter = '%s view -bS %s | %s view -uF 4 - | %s view -uF 8 - > %s' % (LOCA_PROGRAMS.get('Programs','samtools'), SAM, LOCA_PROGRAMS.get('Programs','samtools'), LOCA_PROGRAMS.get('Programs','samtools'), bamfile)
-	elif TYPE == 'bam':
-		filter = '%s view -uF 4 %s | %s view -uF 8 - > %s' % (LOCA_PROGRAMS.get('Programs','samtools'), SAM, LOCA_PROGRAMS.get('Programs','samtools'), bamfile)
-	else:
+#Size (in octets) of the partition files of the pairs examined: the input is spilled in about its size (BAM_RATIO times the size of a bam) divided by
+#PARTITION_SIZE partitions (MAX_PARTITIONS at most), a partition still bigger being split again, at most MAX_DEPTH times
+PARTITION_SIZE = 268435456
+BAM_RATIO = 4
+MAX_PARTITIONS = 256
+MAX_DEPTH = 3
+#Maximal distance (in pixels) between two duplicates of the same tile to count them as optical duplicates.
+#As in Picard, optical duplicates are not searched in duplicate sets bigger than MAX_OPTICAL_SET_SIZE.
+OPTICAL_DISTANCE = 100
+MAX_OPTICAL_SET_SIZE = 300000
+#Base qualities under 15 are not counted in the pair score used to choose the pair kept among duplicates
+SCORE_TABLE = ''.join([chr(max(0, n-33)) if n-33 >= 15 else chr(0) for n in range(256)])
+
+#Return the reader (see utils.openSamReader) of the sam lines of SAM grouped by pair, coordinate sorted files being sorted by read name on the fly by samtools
+def open_name_grouped(LOCA_PROGRAMS, SAM, TYPE, THREAD, OUT):
+	reader = utils.openSamReader(LOCA_PROGRAMS, SAM, TYPE, True)
+	line = reader[0].readline()
+	if TYPE == 'bam':
+		reader[0].read()
+	utils.closeSamReader(reader, 'Error in header reading')
+	if line.startswith('@HD') and 'SO:coordinate' in line:
+		sorting = '%s sort -n -@ %s -O sam -T %s %s' % (LOCA_PROGRAMS.get('Programs','samtools'), THREAD, OUT+'_nsort', SAM)
+		print sorting
+		proc = subprocess.Popen( args=sorting, shell=True, stdout=subprocess.PIPE, bufsize=-1)
+		return [proc.stdout, proc]
+	return utils.openSamReader(LOCA_PROGRAMS, SAM, TYPE)
+
+#Return the duplicate key of a pair: chromosome, unclipped 5' position and strand of both mates, the leftmost mate first
+def pair_key(data1, data2):
+	flag1 = int(data1[1])
+	flag2 = int(data2[1])
+	end1 = (data1[2], utils.unclippedFivePrime(data1[5], int(data1[3]), flag1 & 16 != 0), flag1 & 16)
+	end2 = (data2[2], utils.unclippedFivePrime(data2[5], int(data2[3]), flag2 & 16 != 0), flag2 & 16)
+	if end2 < end1:
+		return (end2, end1)
+	return (end1, end2)
+
+#Return the tile and the x, y coordinates of an Illumina read name (5 or 7 fields separated by ':'), or None
+def tile_position(NAME):
+	field = NAME.split(':')
+	if len(field) == 5 or len(field) == 7:
+		try:
+			return (field[-3], int(field[-2]), int(field[-1]))
+		except ValueError:
+			return None
+	return None
+
+#Number of optical duplicates of a duplicate set: reads close to a previous read of the same tile, the reads being sorted by tile and x coordinate
+def count_optical(POSITIONS):
+	if len(POSITIONS) > MAX_OPTICAL_SET_SIZE:
+		return 0
+	POSITIONS.sort()
+	optical = 0
+	for j in range(1, len(POSITIONS)):
+		i = j - 1
+		while i >= 0 and POSITIONS[i][0] == POSITIONS[j][0] and POSITIONS[j][1]-POSITIONS[i][1] <= OPTICAL_DISTANCE:
+			if abs(POSITIONS[i][2]-POSITIONS[j][2]) <= OPTICAL_DISTANCE:
+				optical += 1
+				break
+			i -= 1
+	return optical
+
+#Return the records of a partition file: [meta line (duplicate key and score), the two lines of the pair, offset of the pair lines]
+def read_records(FILE):
+	while True:
+		meta = FILE.readline()
+		if not meta:
+			break
+		offset = FILE.tell()
+		yield [meta, FILE.readline()+FILE.readline(), offset]
+
+#Return the partition of a duplicate key among NB_PART, at a DEPTH of partitioning
+def partition(KEY, DEPTH, NB_PART):
+	return hash((DEPTH, KEY)) % NB_PART
+
+#Write the best pair of each duplicate set of a partition file in outfile, the partition file being removed.
+#Only the key, the score, the offset and the number of pairs of each set are kept in memory, the best pairs being read back from the file at the end;
+#the tile positions are read in a second pass, for the sets of more than one pair only.
+#Return [duplicate number, optical duplicate number]
+def dedup(PART, outfile, DEPTH=0):
+	size = os.path.getsize(PART)
+	if size > PARTITION_SIZE and DEPTH < MAX_DEPTH:
+		nb_part = min(MAX_PARTITIONS, size/PARTITION_SIZE + 1)
+		names = [PART+'_'+str(i) for i in range(nb_part)]
+		parts = [open(n, 'w') for n in names]
+		file = open(PART)
+		for n in read_records(file):
+			parts[partition(n[0][:n[0].rindex('\t')], DEPTH+1, nb_part)].write(n[0]+n[1])
+		file.close()
+		os.remove(PART)
+		counts = [0, 0]
+		for i in range(nb_part):
+			parts[i].close()
+			result = dedup(names[i], outfile, DEPTH+1)
+			counts[0] += result[0]
+			counts[1] += result[1]
+		return counts
+	index = {}
+	scores = array.array('l')
+	offsets = array.array('l')
+	lengths = array.array('l')
+	nb = array.array('l')
+	duplicate = 0
+	file = open(PART)
+	for n in read_records(file):
+		i = n[0].rindex('\t')
+		key = n[0][:i]
+		score = int(n[0][i+1:])
+		if key in index:
+			duplicate += 1
+			row = index[key]
+			nb[row] += 1
+			if score > scores[row]:
+				scores[row] = score
+				offsets[row] = n[2]
+				lengths[row] = len(n[1])
+		else:
+			index[key] = len(scores)
+			scores.append(score)
+			offsets.append(n[2])
+			lengths.append(len(n[1]))
+			nb.append(1)
+	optical = 0
+	if duplicate:
+		positions = {}
+		file.seek(0)
+		for n in read_records(file):
+			row = index[n[0][:n[0].rindex('\t')]]
+			if nb[row] > 1:
+				position = tile_position(n[1].split('\t', 1)[0])
+				if position is not None:
+					positions.setdefault(row, []).append(position)
+		for n in positions.itervalues():
+			if len(n) > 1:
+				optical += count_optical(n)
+		positions = None
+	index = None
+	for row in sorted(xrange(len(offsets)), key=offsets.__getitem__):
+		file.seek(offsets[row])
+		outfile.write(file.read(lengths[row]))
+	file.close()
+	os.remove(PART)
+	return [duplicate, optical]
+
+#Write the same lines in several files
+class Tee:
+	def __init__(self, FILES):
+		self.files = FILES
+	def write(self, TEXT):
+		for n in self.files:
+			n.write(TEXT)
+
+#Remove unmapped pairs and pair duplicates in a single pass of a name grouped sam/bam file, the output bam being written by samtools sort in the SORT order.
+#Duplicates are pairs sharing chromosome, unclipped 5' position and strand of both mates, the pair having the highest sum of base qualities (>= 15) being kept.
+#The pairs examined are spilled in partition files by key (see PARTITION_SIZE) and each partition is deduplicated on its own (see dedup()).
+#If GROUPED is filled, the same pairs are also written unsorted in the GROUPED bam, mates on consecutive lines, for the steps reading pairs.
+def Filter(LOCA_PROGRAMS, SAM, TYPE, SORT, OUT, THREAD, GROUPED='not_filled'):
+	if TYPE != 'sam' and TYPE != 'bam':
 		mot = SAM+' argument passed in --sam is not recognized'
 		sys.exit(mot)
-	sorting1 = '%s -XX:ParallelGCThreads=1 -jar %s SortSam INPUT=%s OUTPUT=%s SORT_ORDER=coordinate QUIET=true MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), bamfile, sortedbam, temporary)
-	rmdup = '%s -XX:ParallelGCThreads=1 -jar %s MarkDuplicates INPUT=%s OUTPUT=%s METRICS_FILE=%s REMOVE_DUPLICATES=true QUIET=true MAX_FILE_HANDLES_FOR_READ_ENDS_MAP=1000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), sortedbam, rmdupbam, rmdupmetrics, temporary)
-	sorting2 = '%s -XX:ParallelGCThreads=1 -jar %s SortSam INPUT=%s OUTPUT=%s SORT_ORDER=%s QUIET=true MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), rmdupbam, OUT, SORT, temporary)
+	if SORT == 'coordinate':
+		sorting = '%s sort -@ %s -O bam -T %s -o %s -' % (LOCA_PROGRAMS.get('Programs','samtools'), THREAD, OUT+'_tmp', OUT)
+	elif SORT == 'queryname':
+		sorting = '%s sort -n -@ %s -O bam -T %s -o %s -' % (LOCA_PROGRAMS.get('Programs','samtools'), THREAD, OUT+'_tmp', OUT)
+	else:
+		sys.exit('Unrecognized sort order : '+SORT)
+	print sorting
+	proc = subprocess.Popen( args=sorting, shell=True, stdin=subprocess.PIPE, bufsize=-1)
+	if GROUPED == 'not_filled':
+		outfile = proc.stdin
+	else:
+		grouped = utils.openSamWriter(LOCA_PROGRAMS, GROUPED, 'bam', THREAD)
+		outfile = Tee([proc.stdin, grouped[0]])
 	
-	run_job(filter, 'Error in first filter:')
-	run_job(sorting1, 'Error in sorting1:')
-	os.remove(bamfile)
-	run_job(rmdup, 'Error in removing duplicates:')
-	os.remove(sortedbam)
-	run_job(sorting2, 'Error in sorting2:')
-	os.remove(rmdupbam)
-	os.system("sed -n 8p %s | cut -f 3 | sed 's/^/Read pairs examined : /'" % rmdupmetrics)
-	os.system("sed -n 8p %s | cut -f 6 | sed 's/^/Read pairs duplicates : /'" % rmdupmetrics)
-	os.system("sed -n 8p %s | cut -f 7 | sed 's/^/Read pairs optical duplicates : /'" % rmdupmetrics)
-	os.system("sed -n 8p %s | cut -f 8 | sed 's/^/Duplication proportion : /'" % rmdupmetrics)
-	os.remove(rmdupmetrics)
-	shutil.rmtree(temporary)
+	reader = open_name_grouped(LOCA_PROGRAMS, SAM, TYPE, THREAD, OUT)
+	file = reader[0]
+	size = os.path.getsize(SAM)
+	if TYPE == 'bam':
+		size = size*BAM_RATIO
+	nb_part = min(MAX_PARTITIONS, size/PARTITION_SIZE + 1)
+	partitions = [open(OUT+'_part'+str(i), 'w') for i in range(nb_part)]
+	examined = 0
+	pending = None
+	for line in file:
+		if line[0] == '@':
+			if GROUPED != 'not_filled' and line.startswith('@HD'):
+				proc.stdin.write(line)
+				grouped[0].write(line.replace('SO:queryname', 'SO:unsorted').replace('SO:coordinate', 'SO:unsorted'))
+			else:
+				outfile.write(line)
+			continue
+		data = line.split('\t', 11)
+		flag = int(data[1])
+		if flag & 12:#read or mate unmapped
+			continue
+		if flag & 2304:#secondary and supplementary alignments are not examined
+			outfile.write(line)
+			continue
+		if pending is None:
+			pending = [line, data]
+			continue
+		if pending[1][0] != data[0]:
+			outfile.write(pending[0])
+			pending = [line, data]
+			continue
+		examined += 1
+		key = pair_key(pending[1], data)
+		score = sum(bytearray(pending[1][10].translate(SCORE_TABLE))) + sum(bytearray(data[10].translate(SCORE_TABLE)))
+		key = '%s\t%d\t%d\t%s\t%d\t%d' % (key[0][0], key[0][1], key[0][2], key[1][0], key[1][1], key[1][2])
+		if line[-1] != '\n':
+			line += '\n'
+		partitions[partition(key, 0, nb_part)].write(key+'\t'+str(score)+'\n'+pending[0]+line)
+		pending = None
+	utils.closeSamReader(reader, 'Error in reading '+SAM)
+	if pending is not None:
+		outfile.write(pending[0])
+	counts = [0, 0]
+	for i in range(nb_part):
+		partitions[i].close()
+		result = dedup(OUT+'_part'+str(i), outfile)
+		counts[0] += result[0]
+		counts[1] += result[1]
+	if GROUPED != 'not_filled':
+		utils.closeSamWriter(grouped)
+	proc.stdin.close()
+	if proc.wait() != 0:
+		sys.exit('Error in sorting')
+	print 'Read pairs examined : '+str(examined)
+	print 'Read pairs duplicates : '+str(counts[0])
+	print 'Read pairs optical duplicates : '+str(counts[1])
+	if examined:
+		print 'Duplication proportion : %.6f' % (float(counts[0])/examined)
+	else:
+		print 'Duplication proportion : 0'
 
 def __main__():
 	#Parse Command Line
@@ -94,8 +299,10 @@ def __main__():
 	parser.add_option( '', '--sam', dest='sam', default='not_filled', help='Paired sam/bam file')
 	parser.add_option( '', '--type', dest='type', default='sam', help='Input type : sam or bam, [default: %default]')
 	parser.add_option( '', '--sort', dest='sort', default='coordinate', help='Sort order queryname or coordinate, [default: %default]')
+	parser.add_option( '', '--thread', dest='thread', default='1', help='The thread number used by samtools for sorting and bam compression (integer), [default: %default]')
 	parser.add_option( '', '--rminput', dest='rminput', default='n', help='Remove input file: y or n, [default: %default]')
 	parser.add_option( '', '--out', dest='out', default='rmdup_mapped.bam', help='Output file')
+	parser.add_option( '', '--out_grouped', dest='out_grouped', default='not_filled', help='Optional second output bam with the same pairs, unsorted with mates on consecutive lines')
 	parser.add_option( '', '--config', dest='config', default=None)
 	(options, args) = parser.parse_args()
 	
@@ -109,20 +316,27 @@ def __main__():
 	if options.config:
 		config = ConfigParser.RawConfigParser()
 		config.read(options.config)
+		#the wrapper asks for the grouped output when a later step reads pairs (see plan_orders)
+		if config.has_option('Remove_dup','grouped') and config.get('Remove_dup','grouped') == 'y':
+			out_grouped = options.out.replace('.bam','')+'_grouped.bam'
+		else:
+			out_grouped = options.out_grouped
 		if options.sam == 'not_filled':
-			Filter(loca_programs, config.get('Single_filter','out'), config.get('Single_filter','type'), config.get('Remove_dup','sort'), options.out)
+			Filter(loca_programs, config.get('Single_filter','out'), config.get('Single_filter','type'), config.get('Remove_dup','sort'), options.out, config.get('General','thread'), out_grouped)
 		else:
-			Filter(loca_programs, options.sam, config.get('Single_filter','type'), config.get('Remove_dup','sort'), options.out)
+			Filter(loca_programs, options.sam, config.get('Single_filter','type'), config.get('Remove_dup','sort'), options.out, config.get('General','thread'), out_grouped)
 		if config.get('Remove_dup','rminput') == 'y':
 			os.remove(config.get('Single_filter','out'))
 		config.set('Remove_dup', 'out', options.out)
 		config.set('Remove_dup', 'type', 'bam')
+		config.set('Remove_dup', 'out_grouped', out_grouped)
+		utils.setFileState(config, 'Remove_dup', config.get('Remove_dup','sort'), 'n')
 		with open(options.config, 'wb') as configfile:
 			config.write(configfile)
 	else:
 		if options.sam == 'not_filled':
 			sys.exit('--sam argument is missing, please provide a bam or a sam')
-		Filter(loca_programs, options.sam, options.type, options.sort, options.out)
+		Filter(loca_programs, options.sam, options.type, options.sort, options.out, options.thread, options.out_grouped)
 		if options.rminput == 'y':
 			os.remove(options.sam)
 	
@@ -24,6 +24,11 @@
 #
 
 import optparse, os, shutil, subprocess, sys, tempfile, fileinput, ConfigParser, operator, time, math
+import utilsSR.utilsSR as utils
+import utilsSR.coverage as coverage
+import utilsSR.covstore as covstore
+import utilsSR.insertsize as insertsize
+import functools
 
 def stop_err( msg ):
     sys.stderr.write( "%s\n" % msg )
@@ -55,54 +60,22 @@ def run_job (cmd_line, ERROR):
 	except Exception, e:
 		stop_err( ERROR + str( e ) )
 
-def recal_ins(LOCA_PROGRAMS, FILE, TYPE):
-	# os.system('echo "Calculating insert size on the firts approximation of the well mapped read"')
-	tmp = os.path.basename(tempfile.NamedTemporaryFile().name)
-	# print tmp
-	if TYPE == 'bam':
-		estim_insert = '%s view -uf 2 %s | %s view -h -o %s - ' % (LOCA_PROGRAMS.get('Programs','samtools'), FILE, LOCA_PROGRAMS.get('Programs','samtools'), tmp)
-	elif TYPE == 'sam':
-		estim_insert = '%s view -bS %s | %s view -uf 2 - | %s view -h -o %s - ' % (LOCA_PROGRAMS.get('Programs','samtools'), FILE, LOCA_PROGRAMS.get('Programs','samtools'), LOCA_PROGRAMS.get('Programs','samtools'), tmp)
-	else:
+#The insert size is estimated in a single pass on the proper pairs (SAMPLE of them drawn if SAMPLE is not 0), its histogram being written in HISTO_FILE if given
+def recal_ins(LOCA_PROGRAMS, FILE, TYPE, SAMPLE=0, HISTO_FILE=None):
+	if TYPE != 'bam' and TYPE != 'sam':
 		mot = TYPE+' argument passed in --sam is not recognized'
 		sys.exit(mot)
-	
-	run_job(estim_insert, 'Error in bam/sam filtering:\n')
-	
-	LIST = []
-	fichier = open(tmp)
-	i = 0
-	for line in fichier:
-		data = line.split()
-		if data != []:
-			if line[0] != '@':
-				if i == 0:
-					i = 1
-					LIST.append(abs(int(data[8])))
-				else:
-					i = 0
-	MED = mediane(LIST)
-	MOY = moyenne(LIST)
-	EC = ecart_type(LIST)
-	LIST = []
-	os.remove(tmp)
-	return [MED, MOY, EC]
+	HISTO = insertsize.insertHisto(FILE, SAMPLE)
+	if HISTO_FILE:
+		insertsize.writeHisto(HISTO, HISTO_FILE)
+	return insertsize.histoStats(HISTO)
 
-#Fonction that calculate la median, mean and interval containing (INT*100)% of values, COL: column to treate (0 based)
-def stat(FILE, COL, INT, VERBOSE, STAT_FILE):
-	FICH = open(FILE)
-	DIC = {}
+#Compute the median, mean and interval containing (INT*100)% of values from the sorted (value, count) histogram of each chromosome
+def stat_histo(DIC, INT, VERBOSE, STAT_FILE):
 	DIC_final = {}
-	for LINE in FICH:
-		DATA = LINE.split()
-		if DATA != []:
-			if DATA[0] in DIC:
-				DIC[DATA[0]].append(float(DATA[COL]))
-			else:
-				DIC[DATA[0]] = []
-				DIC[DATA[0]].append(float(DATA[COL]))
 	for n in DIC:
-		DIC_final[n] = [moyenne(DIC[n]), mediane(DIC[n]), intervalle(DIC[n], INT), len(DIC[n])]
+		H = DIC[n]
+		DIC_final[n] = [histo_moyenne(H), histo_mediane(H), histo_intervalle(H, INT), histo_len(H)]
 	somme_moy = 0
 	somme_med = 0
 	taille = 0
@@ -123,61 +96,74 @@ def stat(FILE, COL, INT, VERBOSE, STAT_FILE):
 	outfile.close()
 	return [somme_moy/taille, somme_med/taille]
 
-def moyenne(L):
-	if len(L) == 0:
-		moyenne = 0
-	else:
-		moyenne = sum(L)/float(len(L))
-	return moyenne
+def histo_len(H):
+	return sum([n[1] for n in H])
+
+#Return the value at the index K (0 based) of the sorted values of a (value, count) list
+def histo_value(H, K):
+	cumul = 0
+	for n in H:
+		cumul += n[1]
+		if K < cumul:
+			return n[0]
+	raise IndexError('histogram index out of range')
+
+def histo_moyenne(H):
+	N = histo_len(H)
+	if N == 0:
+		return 0
+	return sum([n[0]*n[1] for n in H])/float(N)
 
-def mediane(L):
-	L.sort()
-	N = len(L)
+#Median of the values of a (value, count) list, the mean of the two middle values for an even number of values above 2
+def histo_mediane(H):
+	N = histo_len(H)
 	n = N/2.0
 	p = int(n)
 	if n == 0:
 		return 0
 	if n == 1:
-		return (L[0])
+		return histo_value(H, 0)
 	elif n == p:
-		return (L[p-1]+L[p])/2.0
+		return (histo_value(H, p-1)+histo_value(H, p))/2.0
 	else:
-		return L[p]
-		
-def intervalle(L, P):
-	L.sort()
-	N = len(L)
-	return [L[int((N-(N*P))/2.0)],L[int(N-((N-(N*P))/2.0))]]
+		return histo_value(H, p)
 
-def variance(L) :
-	n = len(L)
-	mq = moyenne(L)**2
-	s = sum([x**2 for x in L])
-	variance = (n/(n-1))*(s / n - mq)
-	return variance
-	
-def ecart_type(L) :
-	VAR = variance(L)
-	ecart_type = math.sqrt(VAR)
-	return ecart_type
+#Interval containing (P*100)% of the values of a (value, count) list
+def histo_intervalle(H, P):
+	N = histo_len(H)
+	return [histo_value(H, int((N-(N*P))/2.0)), histo_value(H, int(N-((N-(N*P))/2.0)))]
 
-def calcul_stat(LOCA_PROGRAMS, SAM, TYPE, OUT, STAT_FILE):
-	if TYPE == 'bam':
-		cal_cov = '%s depth %s > %s' % (LOCA_PROGRAMS.get('Programs','samtools'), SAM, OUT)
-	elif TYPE == 'sam':
-		sam2bam = '%s view -bS %s > %s' % (LOCA_PROGRAMS.get('Programs','samtools'), SAM, OUT+'.bam')
-		run_job(sam2bam, 'Error in sam2bam conversion:\n')
-		cal_cov = '%s depth %s > %s' %  (LOCA_PROGRAMS.get('Programs','samtools'), OUT+'.bam', OUT)
-	else:
+#Write the covered sites of a chromosome in a chunk file and all its sites in a chunk of binary store,
+#and return the chromosome, the chunk file, the depth histogram, the dtype and the file of the store chunk
+def cov_chunk(OUT, SIZES, CHROM, OFFSET, DEPTH):
+	chunk = tempfile.NamedTemporaryFile(prefix=os.path.basename(OUT)+'_', dir=os.path.dirname(os.path.abspath(OUT)), delete=False)
+	coverage.writeDepth(chunk, CHROM, OFFSET, DEPTH)
+	chunk.close()
+	dtype = covstore.writeChrom(chunk.name+'.bin', SIZES[CHROM], OFFSET, DEPTH)
+	return [CHROM, chunk.name, coverage.depthHisto(DEPTH), dtype, chunk.name+'.bin']
+
+#The coverage is computed in process from the alignment blocks (chromosomes of an indexed bam being computed in THREAD parallel processes),
+#the statistics being computed from the depth histograms while OUT keeps the samtools depth format.
+#The binary store of OUT (covstore.storeName()) is written at the same time, to be mapped by the next steps instead of parsing OUT
+def calcul_stat(LOCA_PROGRAMS, SAM, TYPE, OUT, STAT_FILE, THREAD=1, SAMPLE=0, HISTO_FILE=None):
+	if TYPE != 'bam' and TYPE != 'sam':
 		mot = TYPE+' argument passed in --type is not recognized'
 		sys.exit(mot)
-	run_job(cal_cov, 'Error in calculating coverage:\n')
-	if TYPE == 'sam':
-		os.remove(OUT+'.bam')
+	results = coverage.mapCoverage(SAM, functools.partial(cov_chunk, OUT, coverage.referenceLengths(SAM)), THREAD)
+	outfile = open(OUT, 'w')
+	DIC = {}
+	for n in results:
+		chunk = open(n[1])
+		shutil.copyfileobj(chunk, outfile, 1048576)
+		chunk.close()
+		os.remove(n[1])
+		DIC[n[0]] = n[2]
+	outfile.close()
+	covstore.writeStore(covstore.storeName(OUT), [[n[0], n[3], n[4]] for n in results])
 	
-	liste = stat(OUT, 2, 0.9, 'all', STAT_FILE)
+	liste = stat_histo(DIC, 0.9, 'all', STAT_FILE)
 	
-	INFO_INSERT = recal_ins(LOCA_PROGRAMS, SAM, TYPE)
+	INFO_INSERT = recal_ins(LOCA_PROGRAMS, SAM, TYPE, SAMPLE, HISTO_FILE)
 	insert = float(INFO_INSERT[0])
 	standev = str(INFO_INSERT[2])
 	outfile = open(STAT_FILE, 'a')
@@ -197,6 +183,8 @@ def __main__():
 	parser.add_option( '', '--out', dest='out', default='coverage.cov', help='Output file')
 	parser.add_option( '', '--stat', dest='stat', default='stat.txt', help='Output statistic file')
 	parser.add_option( '', '--outconf', dest='outconf', default='stat.conf', help='Output configuration file with statistics')
+	parser.add_option( '', '--ins_histo', dest='ins_histo', default='insert_size.histo', help='Output histogram of the insert size (insert size, number of pairs)')
+	parser.add_option( '', '--ins_sample', dest='ins_sample', default='0', help='Number of proper pairs sampled to estimate the insert size, 0 to use all of them (integer), [default: %default]')
 	parser.add_option( '', '--config', dest='config', default=None)
 	(options, args) = parser.parse_args()
 	
@@ -210,13 +198,23 @@ def __main__():
 	if options.config:
 		config = ConfigParser.RawConfigParser()
 		config.read(options.config)
+		if config.has_option('General','ins_sample'):
+			ins_sample = config.getint('General','ins_sample')
+		else:
+			ins_sample = int(options.ins_sample)
 		if options.sam == 'not_filled':
-			STAT = calcul_stat(loca_programs, config.get('Remove_dup','out'), config.get('Remove_dup','type'), options.out, options.stat)
+			#the coverage is computed whatever the sort order, a coordinate sorted bam being indexed to compute chromosomes through the index (in parallel with several threads)
+			if config.get('Remove_dup','type') == 'bam' and utils.getFileSort(config, 'Remove_dup') == 'coordinate':
+				if not os.path.isfile(config.get('Remove_dup','out')+'.bai'):
+					utils.indexBamFile(loca_programs, config.get('Remove_dup','out'))
+				utils.setFileState(config, 'Remove_dup', 'coordinate', 'y')
+			STAT = calcul_stat(loca_programs, config.get('Remove_dup','out'), config.get('Remove_dup','type'), options.out, options.stat, config.getint('General','thread'), ins_sample, options.ins_histo)
 		else:
-			STAT = calcul_stat(loca_programs, options.sam, config.get('Remove_dup','type'), options.out, options.stat)
+			STAT = calcul_stat(loca_programs, options.sam, config.get('Remove_dup','type'), options.out, options.stat, config.getint('General','thread'), ins_sample, options.ins_histo)
 		mini = float(STAT[0] - (config.getfloat('General','sd_multiplicator')*STAT[2]))
 		maxi = float(STAT[0] + (config.getfloat('General','sd_multiplicator')*STAT[2]))
 		config.set('Calc_coverage', 'out', options.out)
+		config.set('Calc_coverage', 'insert_histo', options.ins_histo)
 		config.set('Calc_coverage', 'median_insert', STAT[0])
 		config.set('Calc_coverage', 'mean_insert', STAT[1])
 		config.set('Calc_coverage', 'standard_deviation_insert', STAT[2])
@@ -234,7 +232,7 @@ def __main__():
 		if options.sam == 'not_filled':
 			mot = 'Please provide an argument for --sam'
 			sys.exit(mot)
-		calcul_stat(loca_programs, options.sam, options.type, options.out, options.stat)
+		calcul_stat(loca_programs, options.sam, options.type, options.out, options.stat, 1, int(options.ins_sample), options.ins_histo)
 	
 	
 if __name__ == "__main__": __main__()
\ No newline at end of file
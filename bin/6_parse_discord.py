@@ -24,6 +24,9 @@
 #
 
 import optparse, os, shutil, subprocess, sys, tempfile, fileinput, ConfigParser, operator, time, math
+import utilsSR.utilsSR as utils
+import utilsSR.pairlist as pairlist
+import numpy, array
 
 def stop_err( msg ):
     sys.stderr.write( "%s\n" % msg )
@@ -55,621 +58,363 @@ def run_job (cmd_line, ERROR):
 	except Exception, e:
 		stop_err( ERROR + str( e ) )
 
-def trie2discord_pair(LOCA_PROGRAMS, SAM, TYPE, SORT, MINI_DIS, MINI, MAXI, ORIENT, CHR, LISTE):
+#Maximal number of mates waiting for their mate in memory in pair_mates() before being spilled to disk
+MATE_BUFFER = 2000000
+#Number of files the waiting mates are spilled in, split on the read name
+SPILL_PARTS = 64
+#Number of pairs labelled at once by classify_batch()
+BATCH_SIZE = 100000
+
+#Sam files in any sort order are read in a single pass by pair_mates(), no queryname sort being needed
+#The list is written in FORMAT: text (a line per pair) or binary (pairlist.ListWriter)
+def trie2discord_pair(LOCA_PROGRAMS, SAM, TYPE, SORT, MINI_DIS, MINI, MAXI, ORIENT, CHR, LISTE, FORMAT = 'text'):
+	if SORT not in utils.SORT_SATISFIES:
+		mot = 'Unrecognized --sort option : '+SORT
+		sys.exit(mot)
+	if FORMAT != 'text' and FORMAT != 'binary':
+		mot = 'Unrecognized --list_format option : '+FORMAT
+		sys.exit(mot)
+	trielinebyline(LOCA_PROGRAMS, SAM, TYPE, MINI_DIS, MINI, MAXI, ORIENT, CHR, LISTE, FORMAT)
 
-	temporary = SAM+'_tempo_tmp'
-	
-	if TYPE == 'bam':
-		tmp = os.path.basename((tempfile.NamedTemporaryFile().name)+'.sam')
-		if SORT == 'coordinate' or SORT == 'unsorted':
-			bam2sam = '%s -XX:ParallelGCThreads=1 -jar %s SortSam INPUT=%s OUTPUT=%s SORT_ORDER=queryname QUIET=true MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), SAM, tmp, temporary)
-		elif SORT == 'queryname':
-			bam2sam = 'samtools view -h -o %s %s' % (tmp, SAM)
-		else:
-			mot = 'Unrecognized --sort option : '+SORT
-			sys.exit(mot)
-		run_job (bam2sam, 'Error in bam2sam conversion:')
-		trielinebyline(tmp, MINI_DIS, MINI, MAXI, ORIENT, CHR, LISTE)
-		# print tmp
-		os.remove(tmp)
+#Pair the split sam lines of two mates, mate1 first
+def mate_order(DATA, MATE):
+	if int(DATA[1]) & 64:
+		return [DATA, MATE]
 	else:
-		if SORT == 'coordinate' or SORT == 'unsorted':
-			tmp = os.path.basename((tempfile.NamedTemporaryFile().name)+'.sam')
-			Sorting = '%s -XX:ParallelGCThreads=1 -jar %s SortSam INPUT=%s OUTPUT=%s SORT_ORDER=queryname QUIET=true MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), SAM, tmp, temporary)
-			run_job (Sorting, 'Error in samtools :')
-			trielinebyline(SAM, MINI_DIS, MINI, MAXI, ORIENT, CHR, LISTE)
-			# print tmp
-			os.remove(tmp)
-		elif SORT == 'queryname':
-			trielinebyline(SAM, MINI_DIS, MINI, MAXI, ORIENT, CHR, LISTE)
-		else:
-			mot = 'Unrecognized --sort option : '+SORT
-			sys.exit(mot)
-	shutil.rmtree(temporary)
-
-def trielinebyline(SAM, MINI_DIS, MINI, MAXI, ORIENT, CHR, LISTE):
+		return [MATE, DATA]
+
+#Give the [mate1, mate2] split sam lines of each pair of a sam file in any sort order: the first mate read waits in a name-keyed buffer
+#until its mate is read. When the buffer holds more than MATE_BUFFER mates, they are spilled in SPILL_PARTS files (TMP_0, TMP_1...)
+#split on the read name, the mates of a pair being then in the same file, and each file is paired in memory at the end.
+def pair_mates(FILE, TMP):
+	buffer = {}
+	spill = []
+	try:
+		for line in FILE:
+			if line[0] == '@':
+				continue
+			data = line.split()
+			if data == []:
+				continue
+			if data[0] in buffer:
+				yield mate_order(data, buffer.pop(data[0]))
+			else:
+				buffer[data[0]] = data
+				if len(buffer) > MATE_BUFFER:
+					if spill == []:
+						spill = [open(TMP+'_'+str(n), 'w') for n in range(SPILL_PARTS)]
+					for n in buffer:
+						spill[hash(n) % SPILL_PARTS].write('\t'.join(buffer[n])+'\n')
+					buffer = {}
+		if spill:
+			for n in buffer:
+				spill[hash(n) % SPILL_PARTS].write('\t'.join(buffer[n])+'\n')
+			buffer = {}
+			for n in range(SPILL_PARTS):
+				spill[n].close()
+				for line in open(TMP+'_'+str(n)):
+					data = line.split()
+					if data[0] in buffer:
+						yield mate_order(data, buffer.pop(data[0]))
+					else:
+						buffer[data[0]] = data
+				os.remove(TMP+'_'+str(n))
+				if buffer:
+					break
+		if buffer:
+			sys.exit('The reads are not paired')
+	finally:
+		#the spill files are removed even if the reads are not paired or the pairs are not all read
+		for n in range(len(spill)):
+			spill[n].close()
+			if os.path.isfile(TMP+'_'+str(n)):
+				os.remove(TMP+'_'+str(n))
+
+def trielinebyline(LOCA_PROGRAMS, SAM, TYPE, MINI_DIS, MINI, MAXI, ORIENT, CHR, LISTE, FORMAT = 'text'):
 	############################################
 	#recording chromosome order
 	############################################
-	liste_chr = []
+	rank = {}
 	file = open(CHR)
 	for line in file:
 		data = line.split()
-		if data:
-			liste_chr.append(data[0])
+		if data and not(data[0] in rank):
+			rank[data[0]] = len(rank)
 	file.close()
 
 	############################################
 	#Creating the liste of discordant reads
 	############################################
-	file = open(SAM)
-	outfile = open(LISTE,'w')
-	l1 = file.readline().split()
-	while l1[0][0] == '@':
-		l1 = file.readline().split()
-	l2 = file.readline().split()
-	while l1:
-		if ORIENT == 'rf':
-			outfile.write('\t'.join(trie_discord_rf(l1, l2, MINI_DIS, MINI, MAXI, liste_chr))+'\n')
-		elif ORIENT == 'fr':
-			outfile.write('\t'.join(trie_discord_fr(l1, l2, MINI_DIS, MINI, MAXI, liste_chr))+'\n')
-		else:
-			sys.exit('Orientation information is incorrect')
-		l1 = file.readline().split()
-		l2 = file.readline().split()
-	outfile.close()
-	file.close()
-
-
-def trie_discord_rf(UN, DEUX, MINI_DIS, MINI, MAXI, LISTE_CHR):
-	ident1 = UN[0]
-	ident2 = DEUX[0]
-	flag1 = UN[1]
-	flag2 = DEUX[1]
-	pos1 = UN[3]
-	pos2 = DEUX[3]
-	chr1 = UN[2]
-	chr2 = DEUX[2]
-	INSERT1 = abs(int(UN[8]))
-	INSERT2 = abs(int(DEUX[8]))
-	if INSERT1 != INSERT2:
-		sys.exit('The two mate do not share same absolute insert size')
-	if ident1 != ident2:
-		sys.exit('The reads are not paired')
-	elif (flag1 == '83' and flag2 == '163'):					#read rf avec R en mate 1
-		if INSERT1 > MAXI:											##le read est discordant de deletion
-			type = 'del'
-		elif INSERT1 < MINI:										##le read est discordant d insertion
-			type = 'ins'
-		else:														##le read est concordant
-			type = 'ok'
-	elif (flag1 == '99' and flag2 == '147'): 					#read rf avec F en mate 1
-		if INSERT1 > MAXI:											##le read est discordant de deletion
-			type = 'del'
-		elif INSERT1 < MINI:										##le read est discordant d insertion
-			type = 'ins'
-		else:														##le read est concordant
-			type = 'ok'
+	if ORIENT != 'rf' and ORIENT != 'fr':
+		sys.exit('Orientation information is incorrect')
+	reader = utils.openSamReader(LOCA_PROGRAMS, SAM, TYPE)
+	file = reader[0]
+	if FORMAT == 'binary':
+		outfile = pairlist.ListWriter(LISTE, CHR, LABELS)
 	else:
-		if chr1 != chr2:										#discordance de chromosome
-			if (flag1 == '113' and flag2 == '177'):					##discordance "rr"
-				type = 'chr_rr'
-			elif (flag1 == '65' and flag2 == '129'):				##discordance "ff"
-				type = 'chr_ff'
-			elif (flag1 == '81' and flag2 == '161'):				##la mate 1 est Reverse la 2 est Forward
-				if LISTE_CHR.index(chr1) < LISTE_CHR.index(chr2):
-					type = 'chr_rf'										###Le chr mate1 avant chr mate2
-				else:
-					type = 'chr_fr'										###Le chr mate1 apres chr mate2
-			elif (flag1 == '97' and flag2 == '145'):				##la mate 1 est Forward la 2 est Reverse
-				if LISTE_CHR.index(chr1) < LISTE_CHR.index(chr2):
-					type = 'chr_fr'										###Le chr mate1 avant chr mate2
-				else:
-					type = 'chr_rf'										###Le chr mate1 apres chr mate2
-			else:
-				sys.exit('Problem in sam flag')
-		elif (flag1 == '113' and flag2 == '177'):				#discordance rr
-			type = 'rr'
-		elif (flag1 == '65' and flag2 == '129'):				#discordance ff
-			type = 'ff'
-		elif (flag1 == '81' and flag2 == '161'):				#read rf ou fr et la mate 1 est Reverse
-			if int(pos1) <= int(pos2):								##read rf
-				if INSERT1 > int(MAXI):									###le read est discordant de deletion
-					type = 'del'
-				elif INSERT1 < int(MINI):								###le read est discordant d insertion
-					type = 'ins'
-				else:													###le read est concordant
-					type = 'ok'
-			else:													##read fr
-				type = 'fr'
-		elif (flag1 == '97' and flag2 == '145'):				#read rf ou fr et la mate 1 est Forward
-			if int(pos1) >= int(pos2):								##read rf
-				if INSERT1 > int(MAXI):									###le read est discordant de deletion
-					type = 'del'
-				elif INSERT1 < int(MINI):								###le read est discordant d insertion
-					type = 'ins'
-				else:													###le read est concordant
-					type = 'ok'
-			else:													##read fr
-				type = 'fr'
-		else:
-			sys.exit('Problem in sam flag')
-	if type in ['ff', 'rr', 'fr', 'del']:
-		if INSERT1 < MINI_DIS:
-			return [ident1, pos1, pos2, chr1, chr2, 'discard', type]
-		else:
-			return [ident1, pos1, pos2, chr1, chr2, type]
-	else:
-		return [ident1, pos1, pos2, chr1, chr2, type]
-
-def trie_discord_fr(UN, DEUX, MINI_DIS, MINI, MAXI, LISTE_CHR):
-	ident1 = UN[0]
-	ident2 = DEUX[0]
-	flag1 = UN[1]
-	flag2 = DEUX[1]
-	pos1 = UN[3]
-	pos2 = DEUX[3]
-	chr1 = UN[2]
-	chr2 = DEUX[2]
-	INSERT1 = abs(int(UN[8]))
-	INSERT2 = abs(int(DEUX[8]))
-	if INSERT1 != INSERT2:
+		outfile = open(LISTE,'w')
+	batch = []
+	for pair in pair_mates(file, LISTE+'_spill'):
+		batch.append(pair)
+		if len(batch) == BATCH_SIZE:
+			write_batch(outfile, batch, classify_batch(batch, MINI_DIS, MINI, MAXI, ORIENT, rank))
+			batch = []
+	if batch:
+		write_batch(outfile, batch, classify_batch(batch, MINI_DIS, MINI, MAXI, ORIENT, rank))
+	outfile.close()
+	utils.closeSamReader(reader)
+
+#Write the pairs of PAIRS labelled by classify_batch() (LABEL: [codes, discard flags]) in the liste OUTFILE, a text file or a pairlist.ListWriter.
+#A text line is: read name, position of mate1, position of mate2, chromosome of mate1, chromosome of mate2, label
+#(pairs discarded being labelled "discard", followed by their label)
+def write_batch(OUTFILE, PAIRS, LABEL):
+	if isinstance(OUTFILE, pairlist.ListWriter):
+		OUTFILE.add([n[0][0] for n in PAIRS], [n[0][3] for n in PAIRS], [n[1][3] for n in PAIRS], [n[0][2] for n in PAIRS], [n[1][2] for n in PAIRS], LABEL[0], LABEL[1])
+		return
+	lines = []
+	for i in xrange(len(PAIRS)):
+		line = [PAIRS[i][0][0], PAIRS[i][0][3], PAIRS[i][1][3], PAIRS[i][0][2], PAIRS[i][1][2]]
+		if LABEL[1][i]:
+			line.append('discard')
+		line.append(LABELS[LABEL[0][i]])
+		lines.append('\t'.join(line)+'\n')
+	OUTFILE.write(''.join(lines))
+
+
+#Labels given by classify_batch(), the code of a label being its index
+LABELS = ['ok', 'ins', 'del', 'fr', 'rf', 'ff', 'rr', 'chr_ff', 'chr_rr', 'chr_fr', 'chr_rf']
+OK, INS, DEL, FR, RF, FF, RR, CHR_FF, CHR_RR, CHR_FR, CHR_RF = range(len(LABELS))
+
+#Label each [mate1, mate2] pair of split sam lines of PAIRS for the ORIENT expected orientation, the flags, positions, insert sizes
+#and chromosome ranks (RANK: chromosome name -> index in the chromosome file) of the whole batch being compared as numpy arrays.
+#Return the label code of each pair and whether it is discarded (pairs of the ff, rr, del and discordant orientation labels with an insert size below MINI_DIS)
+def classify_batch(PAIRS, MINI_DIS, MINI, MAXI, ORIENT, RANK):
+	flag1 = numpy.array([n[0][1] for n in PAIRS]).astype(numpy.int64)
+	flag2 = numpy.array([n[1][1] for n in PAIRS]).astype(numpy.int64)
+	pos1 = numpy.array([n[0][3] for n in PAIRS]).astype(numpy.int64)
+	pos2 = numpy.array([n[1][3] for n in PAIRS]).astype(numpy.int64)
+	insert = numpy.abs(numpy.array([n[0][8] for n in PAIRS]).astype(numpy.int64))
+	if (insert != numpy.abs(numpy.array([n[1][8] for n in PAIRS]).astype(numpy.int64))).any():
 		sys.exit('The two mate do not share same absolute insert size')
-	if ident1 != ident2:
-		sys.exit('The reads are not paired')
-	elif (flag1 == '83' and flag2 == '163'):					#read fr avec R en mate 1
-		if INSERT1 > MAXI:											##le read est discordant de deletion
-			type = 'del'
-		elif INSERT1 < MINI:										##le read est discordant d insertion
-			type = 'ins'
-		else:														##le read est concordant
-			type = 'ok'
-	elif (flag1 == '99' and flag2 == '147'): 					#read fr avec F en mate 1
-		if INSERT1 > MAXI:											##le read est discordant de deletion
-			type = 'del'
-		elif INSERT1 < MINI:										##le read est discordant d insertion
-			type = 'ins'
-		else:														##le read est concordant
-			type = 'ok'
-	else:
-		if chr1 != chr2:										#discordance de chromosome
-			if (flag1 == '113' and flag2 == '177'):					##discordance "rr"
-				type = 'chr_rr'
-			elif (flag1 == '65' and flag2 == '129'):				##discordance "ff"
-				type = 'chr_ff'
-			elif (flag1 == '81' and flag2 == '161'):				##la mate 1 est Reverse la 2 est Forward
-				if LISTE_CHR.index(chr1) < LISTE_CHR.index(chr2):
-					type = 'chr_rf'										###Le chr mate1 avant chr mate2
-				else:
-					type = 'chr_fr'										###Le chr mate1 apres chr mate2
-			elif (flag1 == '97' and flag2 == '145'):				##la mate 1 est Forward la 2 est Reverse
-				if LISTE_CHR.index(chr1) < LISTE_CHR.index(chr2):
-					type = 'chr_fr'										###Le chr mate1 avant chr mate2
-				else:
-					type = 'chr_rf'										###Le chr mate1 apres chr mate2
-			else:
-				sys.exit('Problem in sam flag')
-		elif (flag1 == '113' and flag2 == '177'):				#discordance rr
-			type = 'rr'
-		elif (flag1 == '65' and flag2 == '129'):				#discordance ff
-			type = 'ff'
-		elif (flag1 == '81' and flag2 == '161'):				#read rf ou fr et la mate 1 est Reverse
-			if int(pos1) >= int(pos2):								##read rf
-				if INSERT1 > int(MAXI):									###le read est discordant de deletion
-					type = 'del'
-				elif INSERT1 < int(MINI):								###le read est discordant d insertion
-					type = 'ins'
-				else:													###le read est concordant
-					type = 'ok'
-			else:													##read fr
-				type = 'rf'
-		elif (flag1 == '97' and flag2 == '145'):				#read rf ou fr et la mate 1 est Forward
-			if int(pos1) <= int(pos2):								##read rf
-				if INSERT1 > int(MAXI):									###le read est discordant de deletion
-					type = 'del'
-				elif INSERT1 < int(MINI):								###le read est discordant d insertion
-					type = 'ins'
-				else:													###le read est concordant
-					type = 'ok'
-			else:													##read fr
-				type = 'rf'
-		else:
-			sys.exit('Problem in sam flag')
-	if type in ['ff', 'rr', 'rf', 'del']:
-		if INSERT1 < MINI_DIS:
-			return [ident1, pos1, pos2, chr1, chr2, 'discard', type]
-		else:
-			return [ident1, pos1, pos2, chr1, chr2, type]
-	else:
-		return [ident1, pos1, pos2, chr1, chr2, type]
-
-def grep(FILE, OUT, MOT, KEEP, COL):
-	outfile = open(OUT, 'w')
-	i = 0
-	if COL == 'all':
-		if KEEP == 'keep':
-			for line in open(FILE):
-				if MOT in line.split():
-					outfile.write(line)
-					i += 1
-		elif KEEP == 'rm':
-			for line in open(FILE):
-				if not(MOT in line.split()):
-					outfile.write(line)
-					i += 1
-		else:
-			sys.exit('bug in grep')
+	same = numpy.array([n[0][2] == n[1][2] for n in PAIRS])
+	rank1 = numpy.array([RANK.get(n[0][2], -1) for n in PAIRS])
+	rank2 = numpy.array([RANK.get(n[1][2], -1) for n in PAIRS])
+	
+	proper = ((flag1 == 83) & (flag2 == 163)) | ((flag1 == 99) & (flag2 == 147))
+	rr = (flag1 == 113) & (flag2 == 177)
+	ff = (flag1 == 65) & (flag2 == 129)
+	r = (flag1 == 81) & (flag2 == 161)										#mate1 Reverse, mate2 Forward
+	f = (flag1 == 97) & (flag2 == 145)										#mate1 Forward, mate2 Reverse
+	if ORIENT == 'rf':
+		r_ok = pos1 <= pos2
+		f_ok = pos1 >= pos2
+		other = FR
+	elif ORIENT == 'fr':
+		r_ok = pos1 >= pos2
+		f_ok = pos1 <= pos2
+		other = RF
 	else:
-		if KEEP == 'keep':
-			for line in open(FILE):
-				if MOT in line.split():
-					data = line.split()
-					liste = []
-					for n in COL:
-						liste.append(data[n])
-					if MOT in liste:
-						outfile.write(line)
-						i += 1
-		elif KEEP == 'rm':
-			for line in open(FILE):
-				if MOT in line.split():
-					data = line.split()
-					liste = []
-					for n in COL:
-						liste.append(data[n])
-					if not(MOT in liste):
-						outfile.write(line)
-						i += 1
+		sys.exit('Orientation information is incorrect')
+	
+	code = numpy.empty(len(PAIRS), dtype=numpy.int64)
+	code.fill(-1)
+	#chromosome discordance
+	diff = ~proper & ~same
+	if (diff & (r | f) & ((rank1 < 0) | (rank2 < 0))).any():
+		raise ValueError('A chromosome of the sam file is not in the chromosome file')
+	before = rank1 < rank2
+	code[diff & rr] = CHR_RR
+	code[diff & ff] = CHR_FF
+	code[diff & r] = numpy.where(before, CHR_RF, CHR_FR)[diff & r]
+	code[diff & f] = numpy.where(before, CHR_FR, CHR_RF)[diff & f]
+	#same chromosome, the insert size being compared to the integer part of MINI and MAXI
+	sizes = numpy.where(insert > int(MAXI), DEL, numpy.where(insert < int(MINI), INS, OK))
+	code[~proper & same & rr] = RR
+	code[~proper & same & ff] = FF
+	code[~proper & same & r] = numpy.where(r_ok, sizes, other)[~proper & same & r]
+	code[~proper & same & f] = numpy.where(f_ok, sizes, other)[~proper & same & f]
+	#proper pair flags
+	code[proper] = numpy.where(insert > MAXI, DEL, numpy.where(insert < MINI, INS, OK))[proper]
+	if (code < 0).any():
+		sys.exit('Problem in sam flag')
+	discard = ((code == FF) | (code == RR) | (code == other) | (code == DEL)) & (insert < MINI_DIS)
+	return [code, discard]
+
+#Count the alignment starts of the non discordant (class 0) and discordant (class 1) reads in the windows of each size of WINDOWS,
+#along the chromosomes of INFO_CHR. The windows of a chromosome start at 1, 1+W, 1+2W..., the last one ending at the chromosome end
+#and being up to W+1 long. Starts are buffered and counted with numpy.bincount every CHUNK_SIZE starts.
+class WindowCounter:
+	CHUNK_SIZE = 1000000
+
+	def __init__(self, INFO_CHR, WINDOWS):
+		self.names = []
+		self.lengths = []
+		self.index = {}
+		for line in open(INFO_CHR):
+			data = line.split()
+			if data and not(data[0] in self.index):
+				self.index[data[0]] = len(self.names)
+				self.names.append(data[0])
+				self.lengths.append(int(data[1]))
+		self.windows = WINDOWS
+		self.last = {}
+		self.offset = {}
+		self.counts = {}
+		for W in WINDOWS:
+			#index of the last window of each chromosome: the first one reaching the chromosome end
+			last = numpy.array([max(0, -(-(L-1-W)/W)) for L in self.lengths], dtype=numpy.int64)
+			self.last[W] = last
+			self.offset[W] = numpy.concatenate([[0], numpy.cumsum(last+1)])
+			self.counts[W] = numpy.zeros((2, self.offset[W][-1]), dtype=numpy.int64)
+		self.pending = [[array.array('l'), array.array('l')], [array.array('l'), array.array('l')]]
+
+	def add(self, CLASS, CHROM, POS):
+		#unmapped alignments and chromosomes absent from INFO_CHR have no window
+		if not(CHROM in self.index):
+			return
+		self.pending[CLASS][0].append(self.index[CHROM])
+		self.pending[CLASS][1].append(POS)
+		if len(self.pending[CLASS][0]) >= self.CHUNK_SIZE:
+			self.flush()
+
+	def flush(self):
+		for CLASS in range(2):
+			if not self.pending[CLASS][0]:
+				continue
+			chrom = numpy.frombuffer(self.pending[CLASS][0], dtype=numpy.int_)
+			pos = numpy.frombuffer(self.pending[CLASS][1], dtype=numpy.int_)
+			for W in self.windows:
+				window = numpy.minimum((pos-1)/W, self.last[W][chrom]) + self.offset[W][chrom]
+				self.counts[W][CLASS] += numpy.bincount(window, minlength=len(self.counts[W][CLASS]))
+			self.pending[CLASS] = [array.array('l'), array.array('l')]
+
+	#Write the proportion of discordant reads of each window of size W (-0.2 for windows without read): chromosome, start, end, proportion
+	def write(self, W, OUT):
+		self.flush()
+		total = self.counts[W][0] + self.counts[W][1]
+		prop = numpy.where(total == 0, -0.2, self.counts[W][1] / numpy.maximum(total, 1).astype(numpy.float64)).tolist()
+		outfile = open(OUT, 'w')
+		for i in range(len(self.names)):
+			first = self.offset[W][i]
+			for k in xrange(self.last[W][i]+1):
+				if k == self.last[W][i]:
+					end = self.lengths[i]
 				else:
-					outfile.write(line)
-					i += 1
-		else:
-			sys.exit('bug in grep')
-	outfile.close()
-	return i
-
-def calcul_prop(OUT, SAM, INSERT, INFO_CHR):
-	############################################
-	#recording chromosome order
-	############################################
-	DIC_REF = {}
-	file = open(INFO_CHR)
-	for line in file:
-		data = line.split()
-		if data:
-			DIC_REF[data[0]] = int(data[1])
-	file.close()
-
-	############################################
-	#Calculating
-	############################################
-	OUTFILE = open(OUT,'w')
-	FEN = int(INSERT)
-	#now for each window size
-	FILE  = open(SAM)
-	NB = 0
-	WINDOW = 1
-	CHR = ''
-	LISTE_CHR = []
-	for LINE in FILE:
-		DATA = LINE.split()
-		if DATA != []:
-			if LINE[0] != '@': # pour gerer les headers
-				if CHR == '':
-					CHR = DATA[2]
-					LISTE_CHR.append(DATA[2])
-				elif DATA[2] != CHR:#changing of chromosomes
-					if WINDOW+FEN < DIC_REF[CHR]:
-						OUTFILE.write(CHR+'\t'+str(WINDOW)+'\t'+str(WINDOW+FEN-1)+'\t'+str(NB)+'\n')
-						WINDOW = WINDOW + FEN
-						while DIC_REF[CHR] > (WINDOW + FEN):
-							OUTFILE.write(CHR+'\t'+str(WINDOW)+'\t'+str(WINDOW+FEN-1)+'\t0\n')
-							WINDOW = WINDOW + FEN
-						OUTFILE.write(CHR+'\t'+str(WINDOW)+'\t'+str(DIC_REF[CHR])+'\t0\n')
-					elif WINDOW >= DIC_REF[CHR]:
-						#The window is larger than the sequence
-						OUTFILE.write(CHR+'\t0\t'+str(DIC_REF[CHR])+'\t0\n')
-						# sys.exit('ERROR : Probleme in the script, this is a crash')
-					else:
-						OUTFILE.write(CHR+'\t'+str(WINDOW)+'\t'+str(DIC_REF[CHR])+'\t'+str(NB)+'\n')
-					CHR = DATA[2]
-					NB = 0
-					WINDOW = 1
-					LISTE_CHR.append(DATA[2])
-				if DATA[2] == CHR:
-					if int(DATA[3]) < (WINDOW + FEN):
-						NB = NB + 1
-					else:
-						if NB:
-							OUTFILE.write(CHR+'\t'+str(WINDOW)+'\t'+str(WINDOW+FEN-1)+'\t'+str(NB)+'\n')
-						elif WINDOW == 1:
-							OUTFILE.write(CHR+'\t'+str(WINDOW)+'\t'+str(WINDOW+FEN-1)+'\t0\n')
-						NB = 1
-						WINDOW = WINDOW + FEN
-						while int(DATA[3]) >= (WINDOW + FEN):
-							OUTFILE.write(CHR+'\t'+str(WINDOW)+'\t'+str(WINDOW+FEN-1)+'\t0\n')
-							WINDOW = WINDOW + FEN
-	if WINDOW+FEN < DIC_REF[CHR]:
-		OUTFILE.write(CHR+'\t'+str(WINDOW)+'\t'+str(WINDOW+FEN-1)+'\t'+str(NB)+'\n')
-		WINDOW = WINDOW + FEN
-		while DIC_REF[CHR] > (WINDOW + FEN):
-			OUTFILE.write(CHR+'\t'+str(WINDOW)+'\t'+str(WINDOW+FEN-1)+'\t0\n')
-			WINDOW = WINDOW + FEN
-		OUTFILE.write(CHR+'\t'+str(WINDOW)+'\t'+str(DIC_REF[CHR])+'\t0\n')
-	elif WINDOW >= DIC_REF[CHR]:
-		#The window is larger than the sequence
-		OUTFILE.write(CHR+'\t0\t'+str(DIC_REF[CHR])+'\t0\n')
-		# sys.exit('ERROR : Probleme in the script, this is a crash')
-	else:
-		OUTFILE.write(CHR+'\t'+str(WINDOW)+'\t'+str(DIC_REF[CHR])+'\t'+str(NB)+'\n')
-	for n in DIC_REF:
-		if not(n in LISTE_CHR):
-			WINDOW = 1
-			if WINDOW+FEN < DIC_REF[n]:
-				OUTFILE.write(n+'\t'+str(WINDOW)+'\t'+str(WINDOW+FEN-1)+'\t0\n')
-				WINDOW = WINDOW + FEN
-				while DIC_REF[n] > (WINDOW + FEN):
-					OUTFILE.write(n+'\t'+str(WINDOW)+'\t'+str(WINDOW+FEN-1)+'\t0\n')
-					WINDOW = WINDOW + FEN
-				OUTFILE.write(n+'\t'+str(WINDOW)+'\t'+str(DIC_REF[n])+'\t0\n')
-			elif WINDOW >= DIC_REF[n]:
-				#The window is larger than the sequence
-				OUTFILE.write(n+'\t0\t'+str(DIC_REF[n])+'\t0\n')
-				# sys.exit('ERROR : Probleme in the script, this is a crash')
-			else:
-				OUTFILE.write(n+'\t'+str(WINDOW)+'\t'+str(DIC_REF[n])+'\t0\n')
-	OUTFILE.close()
+					end = (k+1)*W
+				outfile.write(self.names[i]+'\t'+str(1+k*W)+'\t'+str(end)+'\t'+str(prop[first+k])+'\n')
+		outfile.close()
 
-def prop_dis(N_DIS, DIS, OUT, INFO_CHR):
-	############################################
-	#recording chromosome order
-	############################################
-	DIC_REF = {}
-	file = open(INFO_CHR)
+#Name of the discordant proportion track of the window size W, the track of the first window size being DISCORD_PROP
+def prop_file(DISCORD_PROP, WINDOWS, W):
+	if W == WINDOWS[0]:
+		return DISCORD_PROP
+	base = os.path.splitext(DISCORD_PROP)
+	return base[0]+'_'+str(W)+base[1]
+
+#Write each alignment of SAM in the bam file of the category of its read in CATEGORY (reads absent being "ok"), all the bam files being written in a single pass.
+#Alignments on the EXCLUDE chromosomes (or with their mate on them) are dropped. The starts of the discordant and non discordant
+#alignments are counted in COUNTER (WindowCounter). Return the bam files written.
+def split_categories(LOCA_PROGRAMS, SAM, TYPE, CATEGORY, EXCLUDE, OUTPUTS, COUNTER):
+	reader = utils.openSamReader(LOCA_PROGRAMS, SAM, TYPE)
+	file = reader[0]
+	header = []
+	writers = {}
 	for line in file:
-		data = line.split()
-		if data:
-			DIC_REF[data[0]] = int(data[1])
-	file.close()
-
-	outfile = open(OUT,'w')
-	CHR = ''
-	for n in DIC_REF:
-		FILE = open(DIS)
-		DATA = FILE.readline().split()
-		if DATA == []:
-			break
-		while DATA[0] != n:
-			DATA = FILE.readline().split()
-			if DATA == []:
-				break
-		FILE_N = open(N_DIS)
-		DATA_N = FILE_N.readline().split()
-		if DATA_N == []:
-			break
-		while DATA_N[0] != n:
-			DATA_N = FILE_N.readline().split()
-			if DATA_N == []:
-				break
-		# print n, DATA_N, 'toto', DATA
-		while DATA_N[0] == n:
-			if DATA_N[1] == DATA[1] and DATA_N[2] == DATA[2]:
-				if int(DATA_N[3]) == int(DATA[3]) == 0:
-					outfile.write(DATA[0]+'\t'+DATA[1]+'\t'+DATA[2]+'\t'+str(-0.2)+'\n')
-				else:
-					outfile.write(DATA[0]+'\t'+DATA[1]+'\t'+DATA[2]+'\t'+str(int(DATA[3])/float(int(DATA_N[3])+int(DATA[3])))+'\n')
-			else:
-				sys.exit('ERROR : windows do not match')
-			DATA_N = FILE_N.readline().split()
-			DATA = FILE.readline().split()
-			if DATA_N == []:
-				break
-		FILE_N.close()
-		FILE.close()
-	outfile.close()
-
-
-def calcul_discord_prop_and_parse(LOCA_PROGRAMS, CHR, SAM, LISTE_TYPE, OUT_INS, OUT_DEL, OUT_FR, OUT_RF, OUT_FF, OUT_RR, OUT_CHR_FR, OUT_CHR_RF, OUT_CHR_FF, OUT_CHR_RR, OUT_DISCARDED, DISCORD_PROP, OR, EXCLUDE):
+		if line[0] == '@':
+			header.append(line)
+			continue
+		data = line.split('\t', 7)
+		if len(data) < 7:
+			continue
+		if data[2] in EXCLUDE or data[6] in EXCLUDE:
+			continue
+		if data[0] in CATEGORY:
+			category = CATEGORY[data[0]]
+			COUNTER.add(1, data[2], int(data[3]))
+		else:
+			category = 'ok'
+			COUNTER.add(0, data[2], int(data[3]))
+		if OUTPUTS[category] not in writers:
+			writers[OUTPUTS[category]] = utils.openSamWriter(LOCA_PROGRAMS, OUTPUTS[category], 'bam')
+			writers[OUTPUTS[category]][0].write(''.join(header))
+		writers[OUTPUTS[category]][0].write(line)
+	utils.closeSamReader(reader)
+	#the bam file of the non discordant reads is always written
+	if OUTPUTS['ok'] not in writers:
+		writers[OUTPUTS['ok']] = utils.openSamWriter(LOCA_PROGRAMS, OUTPUTS['ok'], 'bam')
+		writers[OUTPUTS['ok']][0].write(''.join(header))
+	for n in writers:
+		utils.closeSamWriter(writers[n])
+	return writers.keys()
+
+def calcul_discord_prop_and_parse(LOCA_PROGRAMS, CHR, SAM, TYPE, SORT, LISTE_TYPE, OUT_INS, OUT_DEL, OUT_FR, OUT_RF, OUT_FF, OUT_RR, OUT_CHR_FR, OUT_CHR_RF, OUT_CHR_FF, OUT_CHR_RR, OUT_DISCARDED, DISCORD_PROP, OR, EXCLUDE, THREAD = 1, WINDOWS = [1000]):
 	to_exclude = EXCLUDE.split("=")
-	LISTE_FILTERED = LISTE_TYPE+'.filtered'
-	file = open(LISTE_TYPE)
-	outfile = open(LISTE_FILTERED,'w')
-	for line in file:
-		data = line.split()
-		if data:
-			absent = 1
-			for n in to_exclude:
-				if n in data:
-					absent = 0
-			if absent:
-				outfile.write(line)
-	outfile.close()
-	
-	temporary = SAM+'_calcul_discord_prop_and_parse_tmp'
+	CATEGORY = {}
+	if pairlist.isBinary(LISTE_TYPE):
+		#only the rows of the discordant categories are read
+		liste = pairlist.openList(LISTE_TYPE)
+		excluded = numpy.array([n in to_exclude for n in liste['chroms']], dtype=bool)
+		for label in liste['labels']:
+			for discard in [0, 1]:
+				if label == 'ok' and not discard:
+					continue
+				rows = pairlist.categoryRows(liste, label, discard)
+				rows = rows[~(excluded[liste['columns']['chr1'][rows]] | excluded[liste['columns']['chr2'][rows]])]
+				if discard:
+					category = 'discard'
+				else:
+					category = label
+				for n in pairlist.pairNames(liste, rows):
+					CATEGORY[n] = category
+		liste = None
+	else:
+		file = open(LISTE_TYPE)
+		for line in file:
+			data = line.split()
+			if data:
+				absent = 1
+				for n in to_exclude:
+					if n in data:
+						absent = 0
+				if absent and data[5] != 'ok':
+					CATEGORY[data[0]] = data[5]
+		file.close()
 	
-	############################################
-	#Calculating discordant proportions
-	############################################
-	liste_discord = os.path.basename((tempfile.NamedTemporaryFile().name)+'.list')
-	grep(LISTE_FILTERED, liste_discord, 'ok', 'rm', [5])
-	read_discord = os.path.basename((tempfile.NamedTemporaryFile().name)+'.sam')
-	read_non_discord = os.path.basename((tempfile.NamedTemporaryFile().name)+'.sam')
-	filter1 = '%s -XX:ParallelGCThreads=1 -jar %s FilterSamReads INPUT=%s OUTPUT=%s SORT_ORDER=coordinate QUIET=true FILTER=includeReadList READ_LIST_FILE=%s WRITE_READS_FILES=false MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), SAM, read_discord, liste_discord, temporary)
-	filter2 = '%s -XX:ParallelGCThreads=1 -jar %s FilterSamReads INPUT=%s OUTPUT=%s SORT_ORDER=coordinate QUIET=true FILTER=excludeReadList READ_LIST_FILE=%s WRITE_READS_FILES=false MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), SAM, read_non_discord, liste_discord, temporary)
-	run_job (filter1, 'Error in FilterSamReads.jar:')
-	run_job (filter2, 'Error in FilterSamReads.jar:')
-
-	discord_count = os.path.basename((tempfile.NamedTemporaryFile().name)+'.count')
-	non_discord_count = os.path.basename((tempfile.NamedTemporaryFile().name)+'.count')
-	calcul_prop(discord_count, read_discord, 1000, CHR)
-	calcul_prop(non_discord_count, read_non_discord, 1000, CHR)
-	prop_dis(non_discord_count, discord_count, DISCORD_PROP, CHR)
-
-
-	# print liste_discord
-	# print discord_count
-	# print non_discord_count
-	os.remove(discord_count)
-	os.remove(non_discord_count)
-	os.remove(liste_discord)
-
-	############################################
-	#Parsing bam file
-	############################################
-
-	LISTE_EMPTY = []
-
+	OUTPUTS = {'ins':OUT_INS, 'del':OUT_DEL, 'fr':OUT_FR, 'rf':OUT_RF, 'ff':OUT_FF, 'rr':OUT_RR, 'chr_fr':OUT_CHR_FR, 'chr_rf':OUT_CHR_RF, 'chr_ff':OUT_CHR_FF, 'chr_rr':OUT_CHR_RR, 'discard':OUT_DISCARDED}
 	if OR == 'rf':
-		sam2bam = '%s view -bS %s > %s' % (LOCA_PROGRAMS.get('Programs','samtools'), read_non_discord ,OUT_RF)
-		liste_discord_orient = os.path.basename((tempfile.NamedTemporaryFile().name)+'orient.list')
-		nb_dis = grep(LISTE_FILTERED, liste_discord_orient, 'fr', 'keep', [5])
-		filter1 = '%s -XX:ParallelGCThreads=1 -jar %s FilterSamReads INPUT=%s OUTPUT=%s SORT_ORDER=coordinate QUIET=true FILTER=includeReadList READ_LIST_FILE=%s WRITE_READS_FILES=false MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), SAM, OUT_FR, liste_discord_orient, temporary)
+		OUTPUTS['ok'] = OUT_RF
 	elif OR == 'fr':
-		sam2bam = '%s view -bS %s > %s' % (LOCA_PROGRAMS.get('Programs','samtools'), read_non_discord ,OUT_FR)
-		liste_discord_orient = os.path.basename((tempfile.NamedTemporaryFile().name)+'orient.list')
-		nb_dis = grep(LISTE_FILTERED, liste_discord_orient, 'rf', 'keep', [5])
-		filter1 = '%s -XX:ParallelGCThreads=1 -jar %s FilterSamReads INPUT=%s OUTPUT=%s SORT_ORDER=coordinate QUIET=true FILTER=includeReadList READ_LIST_FILE=%s WRITE_READS_FILES=false MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), SAM, OUT_RF, liste_discord_orient, temporary)
+		OUTPUTS['ok'] = OUT_FR
 	else:
 		mot = 'Unrecognized --orient option : '+OR
 		sys.exit(mot)
-
-	run_job (sam2bam, 'Error in samtools view:')
-
-	if nb_dis > 0:
-		run_job (filter1, 'Error in FilterSamReads.jar:')
+	
+	############################################
+	#Parsing bam file
+	############################################
+	#the bam files are written in the order of the input, which is sorted on coordinate if needed
+	tmp = os.path.basename((tempfile.NamedTemporaryFile().name)+'.bam')
+	coord = utils.convertOrder(LOCA_PROGRAMS, SAM, SORT, 'coordinate', tmp, 'bam', THREAD)
+	counter = WindowCounter(CHR, WINDOWS)
+	if coord[1]:
+		written = split_categories(LOCA_PROGRAMS, tmp, 'bam', CATEGORY, to_exclude, OUTPUTS, counter)
+		os.remove(tmp)
 	else:
-		if OR == 'rf':
-			outfile=open(OUT_FR,'w')
-			outfile.close()
-			LISTE_EMPTY.append(OUT_FR)
-		elif OR == 'fr':
-			outfile=open(OUT_RF,'w')
+		written = split_categories(LOCA_PROGRAMS, SAM, TYPE, CATEGORY, to_exclude, OUTPUTS, counter)
+	CATEGORY = {}
+	
+	LISTE_EMPTY = []
+	for n in set(OUTPUTS.values()):
+		if not(n in written):
+			outfile=open(n,'w')
 			outfile.close()
-			LISTE_EMPTY.append(OUT_RF)
-
-	liste_discord_ins = os.path.basename((tempfile.NamedTemporaryFile().name)+'ins.list')
-	nb_ins = grep(LISTE_FILTERED, liste_discord_ins, 'ins', 'keep', [5])
-	filter_ins = '%s -XX:ParallelGCThreads=1 -jar %s FilterSamReads INPUT=%s OUTPUT=%s SORT_ORDER=coordinate QUIET=true FILTER=includeReadList READ_LIST_FILE=%s WRITE_READS_FILES=false MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), SAM, OUT_INS, liste_discord_ins, temporary)
-
-	liste_discord_del = os.path.basename((tempfile.NamedTemporaryFile().name)+'del.list')
-	nb_del = grep(LISTE_FILTERED, liste_discord_del, 'del', 'keep', [5])
-	filter_del = '%s -XX:ParallelGCThreads=1 -jar %s FilterSamReads INPUT=%s OUTPUT=%s SORT_ORDER=coordinate QUIET=true FILTER=includeReadList READ_LIST_FILE=%s WRITE_READS_FILES=false MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), SAM, OUT_DEL, liste_discord_del, temporary)
-
-	liste_discord_ff = os.path.basename((tempfile.NamedTemporaryFile().name)+'ff.list')
-	nb_ff = grep(LISTE_FILTERED, liste_discord_ff, 'ff', 'keep', [5])
-	filter_ff = '%s -XX:ParallelGCThreads=1 -jar %s FilterSamReads INPUT=%s OUTPUT=%s SORT_ORDER=coordinate QUIET=true FILTER=includeReadList READ_LIST_FILE=%s WRITE_READS_FILES=false MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), SAM, OUT_FF, liste_discord_ff, temporary)
-
-	liste_discord_rr = os.path.basename((tempfile.NamedTemporaryFile().name)+'rr.list')
-	nb_rr = grep(LISTE_FILTERED, liste_discord_rr, 'rr', 'keep', [5])
-	filter_rr = '%s -XX:ParallelGCThreads=1 -jar %s FilterSamReads INPUT=%s OUTPUT=%s SORT_ORDER=coordinate QUIET=true FILTER=includeReadList READ_LIST_FILE=%s WRITE_READS_FILES=false MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), SAM, OUT_RR, liste_discord_rr, temporary)
-
-	liste_discord_chr_ff = os.path.basename((tempfile.NamedTemporaryFile().name)+'chr_ff.list')
-	nb_chr_ff = grep(LISTE_FILTERED, liste_discord_chr_ff, 'chr_ff', 'keep', [5])
-	filter_chr_ff = '%s -XX:ParallelGCThreads=1 -jar %s FilterSamReads INPUT=%s OUTPUT=%s SORT_ORDER=coordinate QUIET=true FILTER=includeReadList READ_LIST_FILE=%s WRITE_READS_FILES=false MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), SAM, OUT_CHR_FF, liste_discord_chr_ff, temporary)
-
-	liste_discord_chr_rr = os.path.basename((tempfile.NamedTemporaryFile().name)+'chr_rr.list')
-	nb_chr_rr = grep(LISTE_FILTERED, liste_discord_chr_rr, 'chr_rr', 'keep', [5])
-	filter_chr_rr = '%s -XX:ParallelGCThreads=1 -jar %s FilterSamReads INPUT=%s OUTPUT=%s SORT_ORDER=coordinate QUIET=true FILTER=includeReadList READ_LIST_FILE=%s WRITE_READS_FILES=false MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), SAM, OUT_CHR_RR, liste_discord_chr_rr, temporary)
-
-	liste_discord_chr_fr = os.path.basename((tempfile.NamedTemporaryFile().name)+'chr_fr.list')
-	nb_chr_fr = grep(LISTE_FILTERED, liste_discord_chr_fr, 'chr_fr', 'keep', [5])
-	filter_chr_fr = '%s -XX:ParallelGCThreads=1 -jar %s FilterSamReads INPUT=%s OUTPUT=%s SORT_ORDER=coordinate QUIET=true FILTER=includeReadList READ_LIST_FILE=%s WRITE_READS_FILES=false MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), SAM, OUT_CHR_FR, liste_discord_chr_fr, temporary)
+			LISTE_EMPTY.append(n)
 
-	liste_discord_chr_rf = os.path.basename((tempfile.NamedTemporaryFile().name)+'chr_rf.list')
-	nb_chr_rf = grep(LISTE_FILTERED, liste_discord_chr_rf, 'chr_rf', 'keep', [5])
-	filter_chr_rf = '%s -XX:ParallelGCThreads=1 -jar %s FilterSamReads INPUT=%s OUTPUT=%s SORT_ORDER=coordinate QUIET=true FILTER=includeReadList READ_LIST_FILE=%s WRITE_READS_FILES=false MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), SAM, OUT_CHR_RF, liste_discord_chr_rf, temporary)
-
-	liste_discord_discarded = os.path.basename((tempfile.NamedTemporaryFile().name)+'discarded.list')
-	nb_discarded = grep(LISTE_FILTERED, liste_discord_discarded, 'discard', 'keep', [5])
-	filter_discarded = '%s -XX:ParallelGCThreads=1 -jar %s FilterSamReads INPUT=%s OUTPUT=%s SORT_ORDER=coordinate QUIET=true FILTER=includeReadList READ_LIST_FILE=%s WRITE_READS_FILES=false MAX_RECORDS_IN_RAM=5000000 VERBOSITY=WARNING VALIDATION_STRINGENCY=SILENT TMP_DIR=%s' % (LOCA_PROGRAMS.get('Programs','java'), LOCA_PROGRAMS.get('Programs','picard-tool'), SAM, OUT_DISCARDED, liste_discord_discarded, temporary)
-
-	if nb_ins > 0:
-		run_job (filter_ins, 'Error in FilterSamReads.jar:')
-	else:
-		outfile=open(OUT_INS,'w')
-		outfile.close()
-		LISTE_EMPTY.append(OUT_INS)
-
-	if nb_del > 0:
-		run_job (filter_del, 'Error in FilterSamReads.jar:')
-	else:
-		outfile=open(OUT_DEL,'w')
-		outfile.close()
-		LISTE_EMPTY.append(OUT_DEL)
-
-	if nb_ff > 0:
-		run_job (filter_ff, 'Error in FilterSamReads.jar:')
-	else:
-		outfile=open(OUT_FF,'w')
-		outfile.close()
-		LISTE_EMPTY.append(OUT_FF)
-
-	if nb_rr > 0:
-		run_job (filter_rr, 'Error in FilterSamReads.jar:')
-	else:
-		outfile=open(OUT_RR,'w')
-		outfile.close()
-		LISTE_EMPTY.append(OUT_RR)
-
-	if nb_chr_ff > 0:
-		run_job (filter_chr_ff, 'Error in FilterSamReads.jar:')
-	else:
-		outfile=open(OUT_CHR_FF,'w')
-		outfile.close()
-		LISTE_EMPTY.append(OUT_CHR_FF)
-
-	if nb_chr_rr > 0:
-		run_job (filter_chr_rr, 'Error in FilterSamReads.jar:')
-	else:
-		outfile=open(OUT_CHR_RR,'w')
-		outfile.close()
-		LISTE_EMPTY.append(OUT_CHR_RR)
-
-	if nb_chr_fr > 0:
-		run_job (filter_chr_fr, 'Error in FilterSamReads.jar:')
-	else:
-		outfile=open(OUT_CHR_FR,'w')
-		outfile.close()
-		LISTE_EMPTY.append(OUT_CHR_FR)
-
-	if nb_chr_rf > 0:
-		run_job (filter_chr_rf, 'Error in FilterSamReads.jar:')
-	else:
-		outfile=open(OUT_CHR_RF,'w')
-		outfile.close()
-		LISTE_EMPTY.append(OUT_CHR_RF)
-
-	if nb_discarded > 0:
-		run_job (filter_discarded, 'Error in FilterSamReads.jar:')
-	else:
-		outfile=open(OUT_DISCARDED,'w')
-		outfile.close()
-		LISTE_EMPTY.append(OUT_DISCARDED)
-
-	# print read_discord
-	# print read_non_discord
-	# print liste_discord_orient
-	# print liste_discord_ins
-	# print liste_discord_del
-	# print liste_discord_ff
-	# print liste_discord_rr
-	# print liste_discord_chr_ff
-	# print liste_discord_chr_rr
-	# print liste_discord_chr_fr
-	# print liste_discord_chr_rf
-	os.remove(read_discord)
-	os.remove(read_non_discord)
-	os.remove(liste_discord_orient)
-	os.remove(liste_discord_ins)
-	os.remove(liste_discord_del)
-	os.remove(liste_discord_ff)
-	os.remove(liste_discord_rr)
-	os.remove(liste_discord_chr_ff)
-	os.remove(liste_discord_chr_rr)
-	os.remove(liste_discord_chr_fr)
-	os.remove(liste_discord_chr_rf)
-	os.remove(liste_discord_discarded)
-	shutil.rmtree(temporary)
+	############################################
+	#Calculating discordant proportions
+	############################################
+	for W in WINDOWS:
+		counter.write(W, prop_file(DISCORD_PROP, WINDOWS, W))
 	return LISTE_EMPTY
 
 
@@ -677,12 +422,12 @@ def calcul_discord_prop_and_parse(LOCA_PROGRAMS, CHR, SAM, LISTE_TYPE, OUT_INS,
 def __main__():
 	#Parse Command Line
 	parser = optparse.OptionParser(usage="python %prog [options]\n\nProgram designed by Guillaume MARTIN : guillaume.martin@cirad.fr\n\nThis program take in input a sam/bam file,"
-	" calculate proportion of discordant reads on 1kb window size and parse the sam/bam file in several bam files corresponding to the different discordant types")
+	" calculate proportion of discordant reads on windows of several sizes and parse the sam/bam file in several bam files corresponding to the different discordant types")
 
 	# Wrapper options.
 	parser.add_option( '', '--sam', dest='sam', default='not_filled', help='Paired sam/bam file')
 	parser.add_option( '', '--chr', dest='chr', default='not_filled', help='The tabulated file containing in col 1 : chromosome name, col 2: chromosome length. A line for each chromosomes')
-	parser.add_option( '', '--sort', dest='sort', default='unsorted', help='The sort order of the sam/bam input: coordinate, queryname, unsorted')
+	parser.add_option( '', '--sort', dest='sort', default='unsorted', help='The sort order of the sam/bam input: coordinate, queryname, grouped (mates on consecutive lines), unsorted')
 	parser.add_option( '', '--type', dest='type', default='sam', help='Input type : sam or bam, [default: %default]')
 	parser.add_option( '', '--rminput', dest='rminput', default='n', help='remove sam/bam input file: y or n, [default: %default]')
 	parser.add_option( '', '--orient', dest='orient', default='rf', help='The expected orientation: rf or fr, [default: %default]')
@@ -701,7 +446,10 @@ def __main__():
 	parser.add_option( '', '--out_chr_rr', dest='out_chr_rr', default='discord_chr_rr.bam', help='Output bam file mapping in chr_rr, [default: %default]')
 	parser.add_option( '', '--out_discarded', dest='out_discarded', default='discarded.bam', help='Output bam file discarded by mini_dis parameter, [default: %default]')
 	parser.add_option( '', '--liste_type', dest='liste_type', default='liste_type.txt', help='Output of liste of col 1: reads, col2: their discordant type, col3: position of mate1, col4: position of mate2, [default: %default]')
-	parser.add_option( '', '--discord_prop', dest='discord_prop', default='discord_prop.txt', help='Output discordant read proportion on window of 1kb, [default: %default]')
+	parser.add_option( '', '--list_format', dest='list_format', default='text', help='Format of the liste: text or binary (columns with a category index, see utilsSR/pairlist.py), [default: %default]')
+	parser.add_option( '', '--liste_txt', dest='liste_txt', default='not_filled', help='Also write a binary liste in the text format in this file')
+	parser.add_option( '', '--discord_prop', dest='discord_prop', default='discord_prop.txt', help='Output discordant read proportion on windows of the first size of --prop_windows, the other sizes being written in files suffixed by "_size", [default: %default]')
+	parser.add_option( '', '--prop_windows', dest='prop_windows', default='1000', help='Window sizes of the discordant read proportion tracks, separated by "=", [default: %default]')
 	parser.add_option( '', '--exclude_chrom', dest='exclude_chrom', default='no_exclude', help='Exclude chromosomes from analysis. "no_exclude" or chromosomes names separated by "=", [default: %default]')
 	parser.add_option( '', '--config', dest='config', default=None)
 	(options, args) = parser.parse_args()
@@ -716,13 +464,30 @@ def __main__():
 	if options.config:
 		config = ConfigParser.RawConfigParser()
 		config.read(options.config)
+		if config.has_option('General','list_format'):
+			list_format = config.get('General','list_format')
+		else:
+			list_format = options.list_format
+		if config.has_option('General','prop_windows'):
+			prop_windows = map(int, config.get('General','prop_windows').split('='))
+		else:
+			prop_windows = map(int, options.prop_windows.split('='))
+		#pairs are read in the grouped copy written by 4_filter_sam.py when there is one
+		if config.has_option('Remove_dup','out_grouped') and config.get('Remove_dup','out_grouped') != 'not_filled':
+			pairs = [config.get('Remove_dup','out_grouped'), 'bam', 'grouped']
+		else:
+			pairs = [config.get('Remove_dup','out'), config.get('Remove_dup','type'), utils.getFileSort(config, 'Remove_dup')]
 		if config.get('General','restimate') == 'n':
-			trie2discord_pair(loca_programs, config.get('Remove_dup','out'), config.get('Remove_dup','type'), config.get('Remove_dup','sort'), float(config.get('General','mini_dis')), float(config.get('General','mini')), float(config.get('General','maxi')), config.get('General','orient'), config.get('General','chr'), options.liste_type)
+			trie2discord_pair(loca_programs, pairs[0], pairs[1], pairs[2], float(config.get('General','mini_dis')), float(config.get('General','mini')), float(config.get('General','maxi')), config.get('General','orient'), config.get('General','chr'), options.liste_type, list_format)
 		else:
-			trie2discord_pair(loca_programs, config.get('Remove_dup','out'), config.get('Remove_dup','type'), config.get('Remove_dup','sort'), float(config.get('General','mini_dis')), float(config.get('Calc_coverage','mini')), float(config.get('Calc_coverage','maxi')), config.get('General','orient'), config.get('General','chr'), options.liste_type)
-		empty = calcul_discord_prop_and_parse(loca_programs, config.get('General','chr'), config.get('Remove_dup','out'), options.liste_type, options.out_ins, options.out_del, options.out_fr, options.out_rf, options.out_ff, options.out_rr, options.out_chr_fr, options.out_chr_rf, options.out_chr_ff, options.out_chr_rr, options.out_discarded, options.discord_prop, config.get('General','orient'), config.get('General','exclude_chrom'))
+			trie2discord_pair(loca_programs, pairs[0], pairs[1], pairs[2], float(config.get('General','mini_dis')), float(config.get('Calc_coverage','mini')), float(config.get('Calc_coverage','maxi')), config.get('General','orient'), config.get('General','chr'), options.liste_type, list_format)
+		empty = calcul_discord_prop_and_parse(loca_programs, config.get('General','chr'), config.get('Remove_dup','out'), config.get('Remove_dup','type'), utils.getFileSort(config, 'Remove_dup'), options.liste_type, options.out_ins, options.out_del, options.out_fr, options.out_rf, options.out_ff, options.out_rr, options.out_chr_fr, options.out_chr_rf, options.out_chr_ff, options.out_chr_rr, options.out_discarded, options.discord_prop, config.get('General','orient'), config.get('General','exclude_chrom'), config.get('General','thread'), prop_windows)
 		if config.get('Trie_discord','rminput') == 'y':
 			os.remove(config.get('Remove_dup','out'))
+		if pairs[2] == 'grouped' and pairs[0] != config.get('Remove_dup','out'):
+			#the grouped copy is only read here
+			os.remove(pairs[0])
+			config.set('Remove_dup', 'out_grouped', 'not_filled')
 		if options.out_ins in empty:
 			config.set('Trie_discord', 'out_ins', 'empty')
 		else:
@@ -768,8 +533,12 @@ def __main__():
 		else:
 			config.set('Trie_discord', 'out_discarded', options.out_discarded)
 		config.set('Trie_discord', 'liste_type', options.liste_type)
+		config.set('Trie_discord', 'list_format', list_format)
 		config.set('Trie_discord', 'discord_prop', options.discord_prop)
+		config.set('Trie_discord', 'prop_windows', '='.join(map(str, prop_windows)))
 		config.set('Trie_discord', 'type', 'bam')
+		#the bams are written in the coordinate order of the input
+		utils.setFileState(config, 'Trie_discord', 'coordinate', 'n')
 		with open(options.config, 'wb') as configfile:
 			config.write(configfile)
 	else:
@@ -788,9 +557,11 @@ def __main__():
 		if options.maxi == 'not_filled':
 			mot = 'Please provide an argument for --maxi'
 			sys.exit(mot)
-		trie2discord_pair(loca_programs, options.sam, options.type, options.sort, float(options.mini_dis), float(options.mini), float(options.maxi), options.orient, options.chr, options.liste_type)
-		calcul_discord_prop_and_parse(loca_programs, options.chr, options.sam, options.liste_type, options.out_ins, options.out_del, options.out_fr, options.out_rf, options.out_ff, options.out_rr, options.out_chr_fr, options.out_chr_rf, options.out_chr_ff, options.out_chr_rr, options.out_discarded, options.discord_prop, options.orient, options.exclude_chrom)
+		trie2discord_pair(loca_programs, options.sam, options.type, options.sort, float(options.mini_dis), float(options.mini), float(options.maxi), options.orient, options.chr, options.liste_type, options.list_format)
+		calcul_discord_prop_and_parse(loca_programs, options.chr, options.sam, options.type, options.sort, options.liste_type, options.out_ins, options.out_del, options.out_fr, options.out_rf, options.out_ff, options.out_rr, options.out_chr_fr, options.out_chr_rf, options.out_chr_ff, options.out_chr_rr, options.out_discarded, options.discord_prop, options.orient, options.exclude_chrom, 1, map(int, options.prop_windows.split('=')))
 		if options.rminput == 'y':
 			os.remove(options.sam)
-	os.remove(options.liste_type+".filtered")
+		list_format = options.list_format
+	if options.liste_txt != 'not_filled' and list_format == 'binary':
+		pairlist.exportText(options.liste_type, options.liste_txt)
 if __name__ == "__main__": __main__()
@@ -23,8 +23,10 @@
 #
 #
 
-import optparse, os, shutil, subprocess, sys, tempfile, fileinput, ConfigParser, operator, time, math, glob, datetime
+import optparse, os, shutil, subprocess, sys, tempfile, fileinput, ConfigParser, operator, time, math, glob, datetime, multiprocessing, heapq
 from inspect import currentframe, getframeinfo
+import utilsSR.coverage as coverage
+import array, numpy, pysam
 
 def stop_err( msg ):
 	raise ValueError(msg)
@@ -128,13 +130,13 @@ def extractSamFromPosition(LOCA_PROGRAMS, SAM, TYPE, CHR, START, END, OUT):
 		bam2subbam = '%s view -bh %s %s:%s-%s -o %s' % (LOCA_PROGRAMS.get('Programs','samtools'), SAM, CHR, START, END, OUT)
 		run_job_silent(getframeinfo(currentframe()), bam2subbam, 'Error in bam2subbam:\n')
 	elif TYPE == 'sam':
-		outbed = open('outbed_tmp', 'w')
+		outbed = open(OUT+'_bed', 'w')
 		outbed.write(CHR+'\t'+START+'\t'+END)
 		outbed.close()
 
-		bam2subbam = '%s view -Sh -L %s -o %s %s' % (LOCA_PROGRAMS.get('Programs','samtools'), 'outbed_tmp', SAM, OUT)
+		bam2subbam = '%s view -Sh -L %s -o %s %s' % (LOCA_PROGRAMS.get('Programs','samtools'), OUT+'_bed', SAM, OUT)
 		run_job_silent(getframeinfo(currentframe()), bam2subbam, 'Error in bam2subbam:\n')
-		os.remove('outbed_tmp')
+		os.remove(OUT+'_bed')
 	else:
 		raise ValueError('File type is invalid.')
 
@@ -238,35 +240,34 @@ def sort_sam(SAM, OUT, CHR):
 	aval.close()
 	return total/2
 
-def trie_sam(SAM, OUT, CHR):
-	outfile1 = open(OUT+'_amont','w')
-	outfile2 = open(OUT+'_aval','w')
-	outfile3 = open(OUT+'_chr','w')
-	file = open(SAM)
-	total = 0
-	# amont = 0
-	# aval = 0
-	for line in file:
-		data = line.split()
-		if data:
-			if data[0][0] == '@':
-				outfile1.write(line)
-				outfile2.write(line)
-				outfile3.write(line)
-			else:
-				if data[2] != CHR:
-					total += 1
-					outfile3.write(line)
-				elif int(data[3]) < int(data[7]):
-					total += 1
-					outfile1.write(line)
-				elif int(data[3]) > int(data[7]):
-					total += 1
-					outfile2.write(line)
-	outfile1.close()
-	outfile2.close()
-	outfile3.close()
-	return total/2
+def trie_reads(ENGINE, READS, CHR):
+	"""
+		Sort the alignments of a zone and their mates as upstream, downstream or on another chromosome
+
+		:param ENGINE: The ZoneEngine the alignments come from
+		:type ENGINE: ZoneEngine
+		:param READS: The alignments given by ZoneEngine.zoneReads()
+		:type READS: list
+		:param CHR: The chromosome of the zone
+		:type CHR: str
+		:return: The [sam line, alignment] lists of the alignments on CHR before their mate, on CHR after their mate and on another chromosome, and the number of pairs
+		:rtype: list
+
+		.. seealso:: look_4_mate()
+	"""
+
+	amont = []
+	aval = []
+	other = []
+	for read in READS:
+		line = ENGINE.samLine(read)
+		if read.reference_name != CHR:
+			other.append([line, read])
+		elif read.reference_start < read.next_reference_start:
+			amont.append([line, read])
+		elif read.reference_start > read.next_reference_start:
+			aval.append([line, read])
+	return [amont, aval, other, (len(amont)+len(aval)+len(other))/2]
 
 
 def triZonesAmontAval(zonesFile, CHR, OUT):
@@ -329,21 +330,14 @@ def calcul_cov(LOCA_PROGRAMS, SAM, TYPE, OUT):
 		:return: void
 	"""
 
-	if TYPE == 'sam':
-		#Convert the sam file to the bam format
-		sam2bam = '%s view -bSh %s -o %s' % (LOCA_PROGRAMS.get('Programs','samtools'), SAM, SAM+'_BAM.bam')
-		run_job_silent(getframeinfo(currentframe()), sam2bam, 'Error in sam2bam (calcul_cov):\n')
-		SAM = SAM+'_BAM.bam'
-	elif TYPE != 'bam':
+	if TYPE != 'bam' and TYPE != 'sam':
 		mot = TYPE+' argument passed in --type is not recognized'
 		raise ValueError(mot)
 
-	cal_cov = ('%s depth %s > %s') % (LOCA_PROGRAMS.get('Programs','samtools'), SAM, OUT)
-	run_job_silent(getframeinfo(currentframe()), cal_cov, 'Error in calculating coverage:\n')
-
-	#remove the intermediate bam file.
-	if TYPE == 'sam':
-		os.remove(SAM)
+	outfile = open(OUT, 'w')
+	for n in coverage.fileCoverage(SAM):
+		coverage.writeDepth(outfile, n[0], n[1], n[2])
+	outfile.close()
 
 
 ####################################################################################################
@@ -356,8 +350,8 @@ def select_sur_couv(COV, ZCOV, MAXCOV, MINCOV, NCOV, OUT):
 	"""
 		Detect zones according to the coverage and the contiguous non covered site
 
-		:param COV: a tabular file with the coverage of each site
-		:type COV: str
+		:param COV: a tabular file with the coverage of each site, or the (chromosome, position, coverage) tuples of each site as given by coverage.iterDepth()
+		:type COV: str | iterable
 		:param ZCOV: The minimal number of covered site by zone
 		:type ZCOV:
 		:param MAXCOV: The maximum median coverage allowed
@@ -378,10 +372,12 @@ def select_sur_couv(COV, ZCOV, MAXCOV, MINCOV, NCOV, OUT):
 	liste = []
 	longerZone = 0
 	outfile = open(OUT,'w')
-	file = open(COV)
+	if isinstance(COV, str):
+		sites = (line.split() for line in open(COV))
+	else:
+		sites = COV
 	i = 0
-	for line in file:
-		data = line.split()
+	for data in sites:
 		if data:
 			POS = int(data[1])
 			COV = int(data[2])
@@ -450,16 +446,24 @@ def calculCovFromMateZones(LOCA_PROGRAMS, bamAmont, bamAval, TYPE, CHR_Amont, ST
 		:rtype: list
 	"""
 
+	#the files of the zones are written in a directory of their own, several processes running in the same directory
+	scratch = tempfile.mkdtemp(dir=os.getcwd())
+	bam_amont = os.path.join(scratch, 'bam_amont')
+	bam_aval = os.path.join(scratch, 'bam_aval')
+	common = os.path.join(scratch, 'commonReadsInMateZones')
+	sam_amont = os.path.join(scratch, 'sam_amont_selected')
+	sam_aval = os.path.join(scratch, 'sam_aval_selected')
+
 	#create sam and bam files for each zones
-	extractSamFromPosition(LOCA_PROGRAMS, bamAmont, TYPE, CHR_Amont, START_Amont, END_amont, 'bam_amont_tmp')
-	extractSamFromPosition(LOCA_PROGRAMS, bamAval, TYPE, CHR_Aval, START_Aval, END_Aval, 'bam_aval_tmp')
+	extractSamFromPosition(LOCA_PROGRAMS, bamAmont, TYPE, CHR_Amont, START_Amont, END_amont, bam_amont)
+	extractSamFromPosition(LOCA_PROGRAMS, bamAval, TYPE, CHR_Aval, START_Aval, END_Aval, bam_aval)
 
 	#extract the reads in each zones
-	extractReadsFromZones = '%s view %s | cut -f1' % (LOCA_PROGRAMS.get('Programs','samtools'), 'bam_amont_tmp')
+	extractReadsFromZones = '%s view %s | cut -f1' % (LOCA_PROGRAMS.get('Programs','samtools'), bam_amont)
 	p = subprocess.Popen(extractReadsFromZones,stdout=subprocess.PIPE,stderr=subprocess.PIPE, shell=True)
 	readsAmont, errors = p.communicate()
 
-	extractReadsFromZones = '%s view %s | cut -f1' % (LOCA_PROGRAMS.get('Programs','samtools'), 'bam_aval_tmp')
+	extractReadsFromZones = '%s view %s | cut -f1' % (LOCA_PROGRAMS.get('Programs','samtools'), bam_aval)
 	p = subprocess.Popen(extractReadsFromZones,stdout=subprocess.PIPE,stderr=subprocess.PIPE, shell=True)
 	readsAval, errors = p.communicate()
 
@@ -468,49 +472,36 @@ def calculCovFromMateZones(LOCA_PROGRAMS, bamAmont, bamAval, TYPE, CHR_Amont, ST
 	readsAval = filter(None, readsAval.split('\n'))
 	commonReads = list(set(readsAmont) & set(readsAval))
 
-	fcommonReads = open('commonReadsInMateZones_tmp', 'w')
+	fcommonReads = open(common, 'w')
 	for item in commonReads:
 		fcommonReads.write("%s\n" % item)
 	fcommonReads.close()
 
 	#create two sam files for each zones with only the common reads
-	recupHeader = '%s view -H %s -o %s' % (LOCA_PROGRAMS.get('Programs','samtools'), 'bam_amont_tmp', 'sam_amont_selected_tmp')
+	recupHeader = '%s view -H %s -o %s' % (LOCA_PROGRAMS.get('Programs','samtools'), bam_amont, sam_amont)
 	run_job_silent(getframeinfo(currentframe()), recupHeader, 'Error in recupHeader:\n')
-	extractReads = '%s -R %s %s >> %s' % (LOCA_PROGRAMS.get('Programs','bamgrepreads'), 'commonReadsInMateZones_tmp', 'bam_amont_tmp', 'sam_amont_selected_tmp')
+	extractReads = '%s -R %s %s >> %s' % (LOCA_PROGRAMS.get('Programs','bamgrepreads'), common, bam_amont, sam_amont)
 	run_job_silent(getframeinfo(currentframe()), extractReads, 'Error in extractReads:\n')
 
-	recupHeader = '%s view -H %s -o %s' % (LOCA_PROGRAMS.get('Programs','samtools'), 'bam_aval_tmp', 'sam_aval_selected_tmp')
+	recupHeader = '%s view -H %s -o %s' % (LOCA_PROGRAMS.get('Programs','samtools'), bam_aval, sam_aval)
 	run_job_silent(getframeinfo(currentframe()), recupHeader, 'Error in recupHeader:\n')
-	extractReads = '%s -R %s %s >> %s' % (LOCA_PROGRAMS.get('Programs','bamgrepreads'), 'commonReadsInMateZones_tmp', 'bam_aval_tmp', 'sam_aval_selected_tmp')
+	extractReads = '%s -R %s %s >> %s' % (LOCA_PROGRAMS.get('Programs','bamgrepreads'), common, bam_aval, sam_aval)
 	run_job_silent(getframeinfo(currentframe()), extractReads, 'Error in extractReads:\n')
 
 	# calcul of the coverage of this two sam file
-	calcul_cov(LOCA_PROGRAMS, 'sam_amont_selected_tmp', 'sam', 'cov_amont_tmp')
-
-	zoneCov = open('cov_amont_tmp', 'r')
-	listeCov = []
-
-	for line in zoneCov:
-		cols = line.split()
-		listeCov.append(int(cols[2]))
-	zoneCov.close()
-
-	medianCovAmont = mediane(listeCov)
-
-	calcul_cov(LOCA_PROGRAMS, 'sam_aval_selected_tmp', 'sam', 'cov_aval_tmp')
-
-	zoneCov = open('cov_aval_tmp', 'r')
-	listeCov = []
-
-	for line in zoneCov:
-		cols = line.split()
-		listeCov.append(int(cols[2]))
-	zoneCov.close()
+	zoneCov = coverage.zoneDepth(sam_amont)
+	if zoneCov:
+		medianCovAmont = mediane(zoneCov[3])
+	else:
+		medianCovAmont = 0
 
-	medianCovAval = mediane(listeCov)
+	zoneCov = coverage.zoneDepth(sam_aval)
+	if zoneCov:
+		medianCovAval = mediane(zoneCov[3])
+	else:
+		medianCovAval = 0
 
-	for filename in glob.glob('*_tmp'):
-		os.remove(filename)
+	shutil.rmtree(scratch)
 
 	return [medianCovAmont, medianCovAval, len(commonReads)]
 
@@ -518,93 +509,6 @@ def calculCovFromMateZones(LOCA_PROGRAMS, bamAmont, bamAval, TYPE, CHR_Amont, ST
 ####################################################################################################
 #				For mate zone identification
 ####################################################################################################
-def decoup_chr_bam(LOCA_PROGRAMS, BAM, CHR, OUT, TYPE, overlap):
-	"""
-		Split a bam file by chromosome and with 1Mb windows, covered by 500kb.
-
-		chr01 : 		 1Mb				   1Mb
-				<-------------------><-------------------->
-				          <--------------------><-------------------->
-								    1Mb				      1Mb
-
-		:param LOCA_PROGRAMS: From the Configparser module. Contains the path of each programs
-		:param BAM: The bam file to split
-		:type BAM: str
-		:param CHR: File containing col1: chromosome name and col2: chromsome size
-		:type CHR: str
-		:param TYPE: The type of input file
-		:type TYPE: str ("bam" | "sam")
-		:param OUT: The output file name
-		:type OUT: str
-		:param longerZone: The length of the longer zone identified
-		:type longerZone: int
-		:param overlap: The overlap between two bam file.
-		:type overlap: int
-		:return: void
-	"""
-
-	file = open(CHR)
-	liste_to_remove = []
-
-	for line in file:
-		data = line.split()
-		if data:
-			debut = 1
-			while debut <= int(data[1]):
-				tempo2 = tempfile.NamedTemporaryFile()
-
-				if (debut + 999999) < int(data[1]):
-					fin = debut + 999999
-				else:
-					fin = int(data[1])
-
-				if TYPE == 'bam':
-					bam2subbam = '%s view %s %s:%s-%s | cut -f 1 > %s' %(LOCA_PROGRAMS.get('Programs','samtools'), BAM, data[0], debut, fin, tempo2.name)
-				elif TYPE == 'sam':
-
-					# create a bed file
-					tempo1 = tempfile.NamedTemporaryFile()
-					tempo1.write(data[0]+'\t'+debut+'\t'+fin+'\n')
-					tempo1.flush()
-
-					bam2subbam = '%s view -S -L %s %s | cut -f 1 > %s' % (LOCA_PROGRAMS.get('Programs','samtools'), tempo1.name, BAM, tempo2)
-
-					# Convert the sam file to the bam format
-					sam2bam = '%s view -bSh %s -o %s' % (LOCA_PROGRAMS.get('Programs','samtools'), BAM, BAM+'_BAM.bam')
-					run_job_silent(getframeinfo(currentframe()), sam2bam, 'Error in sam2bam :\n')
-
-					# Remove the SAM file converted
-					os.remove(BAM)
-					BAM = BAM+'_BAM.bam'
-				else:
-					mot = TYPE+' argument passed in --type is not recognized'
-					raise ValueError(mot)
-				run_job_silent(getframeinfo(currentframe()), bam2subbam, 'Error in decoup_chr_bam:\n')
-				tempo2.flush()
-
-				# Here we have read mapping in the zone but we need the second mate...
-				if os.path.getsize(tempo2.name) != 0:
-					recupHeader = '%s view -H %s -o %s' % (LOCA_PROGRAMS.get('Programs','samtools'), BAM, OUT+'_'+data[0]+'_'+str(debut)+'-'+str(fin)+'.sam')
-					run_job_silent(getframeinfo(currentframe()), recupHeader, 'Error in recupHeader:\n')
-					extractReads = '%s -R %s %s >> %s' % (LOCA_PROGRAMS.get('Programs','bamgrepreads'), tempo2.name, BAM, OUT+'_'+data[0]+'_'+str(debut)+'-'+str(fin)+'.sam')
-					run_job_silent(getframeinfo(currentframe()), extractReads, 'Error in extractReads:\n')
-
-					# Convert the sam file to the bam format for Samtools and bamgrepreads
-					sam2bam = '%s view -bSh %s -o %s' % (LOCA_PROGRAMS.get('Programs','samtools'), OUT+'_'+data[0]+'_'+str(debut)+'-'+str(fin)+'.sam', OUT+'_'+data[0]+'_'+str(debut)+'-'+str(fin)+'.bam')
-					run_job_silent(getframeinfo(currentframe()), sam2bam, 'Error in sam2bam :\n')
-
-					# Remove the SAM file converted
-					os.remove(OUT+'_'+data[0]+'_'+str(debut)+'-'+str(fin)+'.sam')
-
-					# Indexation of the bam file
-					index_bam_file(LOCA_PROGRAMS, OUT+'_'+data[0]+'_'+str(debut)+'-'+str(fin)+'.bam')
-
-				liste_to_remove.append(BAM+'_'+data[0]+'.bam')
-				tempo2.close()
-				debut = debut + 1000000-overlap
-
-	return liste_to_remove
-
 def index_bam_file(LOCA_PROGRAMS, BAM):
 	"""
 		Index a bam file.
@@ -628,38 +532,111 @@ def bam2sam(LOCA_PROGRAMS, BAM, OUT):
 	bam2sam = '%s view -h %s -o %s' % (LOCA_PROGRAMS.get('Programs','samtools'), BAM, OUT)
 	run_job_silent(getframeinfo(currentframe()), bam2sam, 'Error in bam conversion to sam:\n')
 
-def create_sub_sam(outLog, LOCA_PROGRAMS, BAM, CHR, START, END, OUT):
-
-	tempo2 = tempfile.NamedTemporaryFile()
-	bam2subbam = '%s view %s %s:%s-%s | cut -f 1 > %s' % (LOCA_PROGRAMS.get('Programs','samtools'), BAM, CHR, START, END, tempo2.name)
-	run_job_silent(getframeinfo(currentframe()), bam2subbam, 'Error in create_sub_sam:\n')
+class ZoneEngine:
+	"""
+		Answer the queries of look_4_mate() on an indexed bam file kept open: the alignments of a zone with their mates, as sam lines or alignments
 
-	if os.path.getsize(tempo2.name) != 0:
-		recupHeader = '%s view -H %s -o %s' % (LOCA_PROGRAMS.get('Programs','samtools'), BAM, OUT)
-		run_job_silent(getframeinfo(currentframe()), recupHeader, 'Error in recupHeader:\n')
-		extractReads = '%s -R %s %s >> %s' % (LOCA_PROGRAMS.get('Programs','bamgrepreads'), tempo2.name, BAM, OUT)
-		run_job_silent(getframeinfo(currentframe()), extractReads, 'Error in extractReads:\n')
-	else:
-		logOutput = open(outLog, 'a')
-		logOutput.write("\ntempo2.name : "+str(tempo2.name))
-		logOutput.write("\nbam file : "+str(BAM))
-		logOutput.write("\nCHR : "+str(CHR))
-		logOutput.write("\nSTART : "+str(START))
-		logOutput.write("\nEND : "+str(END))
-		logOutput.write("\nwarning there is a bug in create_sub_sam")
-		logOutput.close()
+		The read names of the bam file are indexed once, the hash of the name of each alignment being kept with its virtual offset in the file.
+	"""
 
-def search_dest(LOCA_PROGRAMS, TARGET, DEST, DEST_CHR, ECART, CHR, START, END, ZCOV, MAXCOV, MINCOV, OUT, TOTAL):
+	def __init__(self, BAM):
+		"""
+			:param BAM: The indexed bam file
+			:type BAM: str
+		"""
+
+		self.name = BAM
+		self.bam = pysam.AlignmentFile(BAM, 'rb')
+		hashes = array.array('l')
+		offsets = array.array('l')
+		offset = self.bam.tell()
+		for read in self.bam.fetch(until_eof=True):
+			hashes.append(hash(read.query_name))
+			offsets.append(offset)
+			offset = self.bam.tell()
+		hashes = numpy.frombuffer(hashes, dtype=numpy.int_)
+		order = numpy.argsort(hashes, kind='mergesort')
+		self.hashes = hashes[order]
+		self.offsets = numpy.frombuffer(offsets, dtype=numpy.int_)[order]
+
+	def readsOf(self, NAMES):
+		"""
+			Give all the alignments of a set of reads
+
+			:param NAMES: The read names
+			:type NAMES: set
+			:return: The alignments, in the order of the bam file
+			:rtype: list
+		"""
+
+		if not NAMES:
+			return []
+		hashes = numpy.array([hash(n) for n in NAMES], dtype=numpy.int_)
+		first = numpy.searchsorted(self.hashes, hashes, 'left')
+		last = numpy.searchsorted(self.hashes, hashes, 'right')
+		offsets = numpy.unique(numpy.concatenate([self.offsets[n[0]:n[1]] for n in zip(first.tolist(), last.tolist())]))
+		result = []
+		for offset in offsets.tolist():
+			self.bam.seek(offset)
+			read = next(self.bam)
+			#names sharing a hash are told apart here
+			if read.query_name in NAMES:
+				result.append(read)
+		return result
+
+	def zoneReads(self, CHR, START, END):
+		"""
+			Give all the alignments of the reads having an alignment overlapping a zone (samtools view CHR:START-END), mates included
+
+			:param CHR: The chromosome of the zone
+			:type CHR: str
+			:param START: The start position of the zone (1-based)
+			:type START: int
+			:param END: The end position of the zone (1-based, included)
+			:type END: int
+			:return: The alignments, in the order of the bam file
+			:rtype: list
+		"""
+
+		return self.readsOf(set([n.query_name for n in self.bam.fetch(CHR, START-1, END)]))
+
+	def samLine(self, READ):
+		"""
+			Give the sam line of an alignment, as written by samtools view
+
+			:param READ: The alignment
+			:type READ: pysam.AlignedSegment
+			:return: The line, with its end of line
+			:rtype: str
+		"""
+
+		return READ.tostring(self.bam)+'\n'
+
+	def reopen(self):
+		"""
+			Open the bam file again, for a process forked after the engine was made: the read name index is shared, not the file
+
+			:return: void
+		"""
+
+		self.bam = pysam.AlignmentFile(self.name, 'rb')
+
+	def close(self):
+		self.bam.close()
+
+def search_dest(TARGET, DEST, DEST_CHR, ECART, CHR, START, END, ZCOV, MAXCOV, MINCOV, TOTAL):
 	"""
 		Search destination zone from a first discordant zone
 
 		From a discordant zone identified, this function search for mate zones according to the coverture
-
-		:param LOCA_PROGRAMS: From the Configparser module. Contains the path of each programs
-		:param TARGET: A sam file containing the alignments of a discordant zone
-		:type TARGET: str
-		:param DEST: A sam file containing the alignments of a mate discordant zone
-		:type SAM: str
+		The reads are clustered on their mate position in a single sweep, the clusters being given in the order of their mate chromosome and position.
+
+		:param TARGET: The [sam line, alignment] list of the alignments of a discordant zone, as given by trie_reads()
+		:type TARGET: list
+		:param DEST: The [sam line, alignment] list of the alignments of a mate discordant zone on the same chromosome
+		:type DEST: list
+		:param DEST_CHR: The [sam line, alignment] list of the alignments of a mate discordant zone on another chromosome
+		:type DEST_CHR: list
 		:param ECART: The value that will be added or substracted to keep a read as the same destination.
 		:type ECART: int
 		:param CHR: File containing col1: chromosome name and col2: chromsome size
@@ -674,94 +651,68 @@ def search_dest(LOCA_PROGRAMS, TARGET, DEST, DEST_CHR, ECART, CHR, START, END, Z
 		:param MAXCOV: float
 		:param MINCOV: The minimal median coverage accepted
 		:param MINCOV: float
-		:param OUT: The name of the output file
-		:param OUT: int
 		:param TOTAL: The number of common reads in
 		:param TOTAL: int
-		:return: void
+		:return: The lines of the couples of mate zones found (chr1 start_pos1 end_pos1 chr2 start_pos2 end_pos2)
+		:rtype: list
 
 		.. seealso:: amont_aval() look_4_mate() recal_border()
 	"""
 
-	outfile = open(OUT, 'a')
-	#loading TARGET information
-	file = open(TARGET)
-	dico = set()
+	result = []
+	value = (((END - START) + 1) + ECART)
+	#the reads of TARGET in the zone, parsed once: (chromosome of the mate, position of the mate, read name), sorted by mate chromosome and position
+	records = set()
+	for n in TARGET:
+		decoupe = n[0].split()
+		if int(decoupe[3]) <= END and int(decoupe[3]) >= START and decoupe[2] == CHR:
+			records.add((decoupe[6], int(decoupe[7]), decoupe[0]))
+	records = sorted(records)
+
+	#sweep: a cluster starts at the first read left and takes the following reads of the same mate chromosome while their mate is at most value
+	#after the median of the mate positions of the cluster
+	i = 0
+	while i < len(records):
+		chr_dest = records[i][0]
+		L_dest = [records[i][1]]
+		liste = [records[i]]
+		i += 1
+		med_val = L_dest[0]
+		while i < len(records) and records[i][0] == chr_dest and records[i][1] <= med_val + value:
+			L_dest.append(records[i][1])
+			liste.append(records[i])
+			i += 1
+			#L_dest is sorted, its median (as given by mediane()) being read from its middle
+			N = len(L_dest)
+			if N == 2:
+				med_val = L_dest[0]
+			elif N % 2:
+				med_val = L_dest[N/2]
+			else:
+				med_val = (L_dest[N/2-1]+L_dest[N/2])/2.0
 
-	for line in file:
-		data = line.split()
-		if data:
-			if data[0][0] != '@':
-				dico.add(line)
-	file.close()
+		names = set([n[2] for n in liste])
 
-	while dico:
-		size_liste = 0
-		liste = []
-		# Verification si le read est dans la zone de depart
-		while size_liste == 0 and dico:
-			line1 = dico.pop()
-			decoupe = line1.split()
-			if int(decoupe[3]) <= END and int(decoupe[3]) >= START and decoupe[2] == CHR:
-				liste.append(line1)
-				center = int(decoupe[7])
-				L_dest = [center]
-				chr_dest = decoupe[6]
-				chr_target = decoupe[2]
-				value = (((END - START) + 1) + ECART)
-				deb_zone = (center - value)
-				fin_zone = (center + value)
-			size_liste = len(liste)
-		size_liste = 0  # To initlsialise the loop
-
-		while size_liste != len(liste):
-			size_liste = len(liste)
-			for n in dico:
-				decoupe = n.split()
-				if decoupe[6] == chr_dest and int(decoupe[3]) <= END and int(decoupe[3]) >= START and decoupe[2] == CHR:  # The read is in the target zone and the destination is on the same chromosome
-
-					if int(decoupe[7]) >= deb_zone and int(decoupe[7]) <= fin_zone:  # The read has a similar destination
-						L_dest.append(int(decoupe[7]))
-						med_val = mediane(L_dest)
-						value = (((END - START) + 1) + ECART)
-						deb_zone = (med_val - value)
-						fin_zone = (med_val + value)
-						liste.append(n)
-			for n in liste:
-				if n in dico:
-					dico.remove(n)
-
-		if liste:
-			tempo = tempfile.NamedTemporaryFile()
-
-			for n in liste:
-				data = n.split()
-				tempo.write(data[0]+'\n')
-			tempo.flush()
-
-			info_target = recalc_border(LOCA_PROGRAMS, tempo.name, TARGET, ZCOV, MAXCOV, MINCOV)
-
-			if chr_dest == '=':
-				info_dest = recalc_border(LOCA_PROGRAMS, tempo.name, DEST, ZCOV, MAXCOV, MINCOV)
-			else:
-				info_dest = recalc_border(LOCA_PROGRAMS, tempo.name, DEST_CHR, ZCOV, MAXCOV, MINCOV)
+		info_target = recalc_border(names, TARGET, ZCOV, MAXCOV, MINCOV)
 
-			tempo.close()
+		if chr_dest == '=':
+			info_dest = recalc_border(names, DEST, ZCOV, MAXCOV, MINCOV)
+		else:
+			info_dest = recalc_border(names, DEST_CHR, ZCOV, MAXCOV, MINCOV)
 
-			if info_target[4] == 'PASS' and info_dest[4] == 'PASS':
-				outfile.write('\t'.join([info_target[0], info_target[1], info_target[2], info_dest[0], info_dest[1], info_dest[2]])+'\n')
+		if info_target[4] == 'PASS' and info_dest[4] == 'PASS':
+			result.append('\t'.join([info_target[0], info_target[1], info_target[2], info_dest[0], info_dest[1], info_dest[2]])+'\n')
 
-	outfile.close()
+	return result
 
-def recalc_border(LOCA_PROGRAMS, LISTE, SAM, ZCOV, MAXCOV, MINCOV):
+def recalc_border(NAMES, READS, ZCOV, MAXCOV, MINCOV):
 	"""
 		Calculate the borders of a zone, based on the coverture
 
-		:param LOCA_PROGRAMS: From the Configparser module. Contains the path of each programs
-		:param LISTE: A one column file with le list of the common reads of a zone
-		:type LISTE: str
-		:param SAM: A sam file containing the alignments of a discordant zone
-		:type SAM: str
+		:param NAMES: The names of the common reads of a zone
+		:type NAMES: set
+		:param READS: The [sam line, alignment] list of the alignments of a discordant zone
+		:type READS: list
 		:param ZCOV: Minimal number of covered sites in the zone
 		:param ZCOV: int
 		:param MAXCOV: The maximal median coverage accepted
@@ -774,43 +725,20 @@ def recalc_border(LOCA_PROGRAMS, LISTE, SAM, ZCOV, MAXCOV, MINCOV):
 		.. seealso:: search_dest() look_4_mate()
 	"""
 
-	#Convert the sam file to the bam format for Samtools and bamgrepreads
-	sam2bam(LOCA_PROGRAMS, SAM, SAM+'_bam')
-
-	#extract the header of the bam file
-	recupHeader = '%s view -H %s -o %s' % (LOCA_PROGRAMS.get('Programs','samtools'), SAM+'_bam', SAM+'_sub.sam')
-	run_job_silent(getframeinfo(currentframe()), recupHeader, 'Error in (recalc_border) recupHeader :\n')
-
-	#concatenate the alignments specified to the header
-	extractReads = '%s -R %s %s >> %s' % (LOCA_PROGRAMS.get('Programs','bamgrepreads'), LISTE, SAM+'_bam', SAM+'_sub.sam')
-	run_job_silent(getframeinfo(currentframe()), extractReads, 'Error in extractReads:\n')
+	#the alignments of the common reads
+	reads = [n[1] for n in READS if n[1].query_name in NAMES]
 
-	#Verify if the sam file contains alignments
-	grepNbAlignments = 'grep -c -v -m 1 "^@" '+SAM+'_sub.sam'
-	p = subprocess.Popen(grepNbAlignments,stdout=subprocess.PIPE,stderr=subprocess.PIPE, shell=True)
-	nbAlignments, errors = p.communicate()
-
-	if int(nbAlignments) > 0:
-		#convert the sam file to bam file
-		sam2bam(LOCA_PROGRAMS, SAM+'_sub.sam', SAM+'_sub.bam')
-		calcul_cov(LOCA_PROGRAMS, SAM+'_sub.bam', 'bam', SAM+'_sub_cov')
-
-		chr = ""
-		file = open(SAM+'_sub_cov')
-		liste_cov = []
-
-		for line in file:
-			data = line.split()
-			if data != []:
-				liste_cov.append(int(data[2]))
-				if chr == "":
-					chr = data[0]
-					min = data[1]
-					max = data[1]
-				elif chr == data[0]:
-					max = data[1]
-				else:
-					raise ValueError('There is a bug in recalc_border : several chromosomes are found in the cov file')
+	zoneCov = None
+	if reads:
+		try:
+			zoneCov = coverage.alignmentsDepth(reads)
+		except ValueError:
+			raise ValueError('There is a bug in recalc_border : several chromosomes are found in the cov file')
+	if zoneCov:
+		chr = zoneCov[0]
+		min = str(zoneCov[1])
+		max = str(zoneCov[2])
+		liste_cov = zoneCov[3]
 		MEDIAN = mediane(liste_cov)
 		if len(liste_cov) >= ZCOV and MEDIAN >= MINCOV and MEDIAN <= MAXCOV:
 			return [chr, min, max, MEDIAN, 'PASS']
@@ -819,7 +747,12 @@ def recalc_border(LOCA_PROGRAMS, LISTE, SAM, ZCOV, MAXCOV, MINCOV):
 	else:
 		return [0,0,0,0,'NO_PASS']
 
-def look_4_mate(outLog, LOCA_PROGRAMS, TYPE, BAM, CHR, OUT, ZONE, ECART, ZCOV, MAXCOV, MINCOV, MINGAP, NB_ZONE, longerZone, medianInsert):
+#Number of zones checked by a job of look_4_mate()
+ZONE_CHUNK = 100
+#The ZoneEngine of the bam file of look_4_mate(), used by check_zones()
+zoneEngine = None
+
+def look_4_mate(outLog, LOCA_PROGRAMS, TYPE, BAM, CHR, OUT, ZONE, ECART, ZCOV, MAXCOV, MINCOV, MINGAP, NB_ZONE, THREAD = 1):
 	"""
 		From a discordant zone identified, search for a mate zone
 
@@ -844,83 +777,89 @@ def look_4_mate(outLog, LOCA_PROGRAMS, TYPE, BAM, CHR, OUT, ZONE, ECART, ZCOV, M
 		:type MINGAP: int
 		:param NB_ZONE: The total number of discordant zones identified
 		:type NB_ZONE: int
-		:param longerZone: The length of the longer zone
-		:type longerZone: int
-		:param medianInsert: The median length of the insert
-		:type medianInsert: int
+		:param THREAD: The number of processes checking the zones in parallel, the mate zones being written in the order of the zones whatever THREAD
+		:type THREAD: int
 		:return: void
 
 		.. seealso:: calcul_cov(), select_sur_couv(), search_dest(), recal_border(), calcul_cov(), select_sur_couv()
 	"""
-	#loading chromosome informations in a dictionnary
-	dico_chr_info = {}
-	file = open(CHR)
-	for line in file:
-		data = line.split()
-		if data:
-			dico_chr_info[data[0]] = int(data[1])
-	file.close()
-	#for speed increase creation of a sub_bam file for each chromosome
-	tmp = tempfile.NamedTemporaryFile().name
-	current_dir_path = os.getcwd()
-	out_tmp = current_dir_path+'/'+tmp.split('/')[-1]
-
-	#calculate the overlap between two bam file
-	overlap = int(max(longerZone*2, medianInsert*3))
-
+	if TYPE != 'bam':
+		mot = TYPE+' argument passed in --type is not recognized, an indexed bam file is needed'
+		raise ValueError(mot)
+	#the alignments of the zones and their mates are read in BAM through its index, the read names being indexed once here
+	global zoneEngine
 	t0 = datetime.datetime.now()
-	decoup_chr_bam(LOCA_PROGRAMS, BAM, CHR, out_tmp, TYPE, overlap)
+	zoneEngine = ZoneEngine(BAM)
 	logOutput = open(outLog, 'a')
-	logOutput.write("\nsplit the bam file : "+str(datetime.datetime.now()-t0))
+	logOutput.write("\nindex the read names of the bam file : "+str(datetime.datetime.now()-t0))
 	logOutput.close()
-	#Now it's time to work on each zone
-	outfile = open(OUT,'w')
-	outfile.close()
+	#Now it's time to work on each zone, by jobs of at most ZONE_CHUNK zones
 	file = open(ZONE)
-	i = 0
-	t_look4mate = datetime.datetime.now()
-	####This part to manage the sub_bam files
-	chromosome = ""
+	liste_job = []
 	for line in file:
 		data = line.split()
 		if data != []:
-			pos_zone_debut = int(data[1])
-			pos_zone_fin = int(data[2])
-			if chromosome != data[0]:
-				chromosome = data[0]
-				pos_debut = 1
-				pos_fin = pos_debut + 999999
-				if pos_fin > dico_chr_info[data[0]]:
-					pos_fin = dico_chr_info[data[0]]
-
-				while not((pos_debut <= pos_zone_debut) and (pos_zone_fin <= pos_fin)):
-					pos_debut = pos_debut + 1000000-overlap
-					pos_fin = pos_debut + 999999
-					if pos_fin > dico_chr_info[data[0]]:
-						pos_fin = dico_chr_info[data[0]]
-			else:
-				while not((pos_debut <= pos_zone_debut) and (pos_zone_fin <= pos_fin)):
-					pos_debut = pos_debut + 1000000-overlap
-					pos_fin = pos_debut + 999999
-					if pos_fin > dico_chr_info[data[0]]:
-						pos_fin = dico_chr_info[data[0]]
-
-			#creation of a sub bam containing read mapping in each putative discordant zone and their mate
-			create_sub_sam(outLog, LOCA_PROGRAMS, out_tmp+'_'+data[0]+'_'+str(pos_debut)+'-'+str(pos_fin)+'.bam', data[0], data[1], data[2], out_tmp+'_tempo_liste_'+data[0]+'.sam')
-
-			total = trie_sam(out_tmp+'_tempo_liste_'+data[0]+'.sam', out_tmp+'_sam_'+data[0], data[0])
-
-			#search for destination of second mate and perform selection
-			search_dest(LOCA_PROGRAMS, out_tmp+'_sam_'+data[0]+'_amont', out_tmp+'_sam_'+data[0]+'_aval', out_tmp+'_sam_'+data[0]+'_chr', float(ECART), data[0], int(data[1]), int(data[2]), ZCOV, MAXCOV, MINCOV, OUT, total)
-			search_dest(LOCA_PROGRAMS, out_tmp+'_sam_'+data[0]+'_aval', out_tmp+'_sam_'+data[0]+'_amont', out_tmp+'_sam_'+data[0]+'_chr', float(ECART), data[0], int(data[1]), int(data[2]), ZCOV, MAXCOV, MINCOV, OUT, total)
+			if not liste_job or len(liste_job[-1][0]) == ZONE_CHUNK:
+				liste_job.append([[], float(ECART), ZCOV, MAXCOV, MINCOV])
+			liste_job[-1][0].append(data[:3])
+	file.close()
 
-			logOutput = open(outLog, 'a')
+	if int(THREAD) > 1:
+		#the processes share the read name index of the engine, each opening the bam file
+		pool = multiprocessing.Pool(processes=int(THREAD), initializer=reopen_engine)
+		results = pool.imap(check_zones, liste_job)
+	else:
+		results = (check_zones(n) for n in liste_job)
+	outfile = open(OUT,'w')
+	i = 0
+	t_look4mate = datetime.datetime.now()
+	#the jobs results come in the order of the jobs
+	for result in results:
+		logOutput = open(outLog, 'a')
+		for zone in result:
+			outfile.write(''.join(zone[0]))
+			if zone[1]:
+				logOutput.write(zone[1])
 			i += 1
 			if i % 100 == 0:
 				logOutput.write("\nEstimation for 7_step_remaining time for"+str( BAM)+ " : "+str( i) +"done in"+str( datetime.datetime.now() - t_look4mate)+ ","+str(  NB_ZONE-i)+ "remaining")
-			logOutput.close()
-	for filename in glob.glob(out_tmp+'_*'):
-		os.remove(filename)
+		logOutput.close()
+	outfile.close()
+	if int(THREAD) > 1:
+		pool.close()
+		pool.join()
+	zoneEngine.close()
+
+def reopen_engine():
+	zoneEngine.reopen()
+
+def check_zones(job):
+	"""
+		Search the mate zones of a list of zones with zoneEngine, for look_4_mate()
+
+		:param job: The [chromosome, start, end] list of the zones, and the ECART, ZCOV, MAXCOV and MINCOV arguments of search_dest()
+		:type job: list
+		:return: For each zone, the lines of the couples of mate zones found and a warning for the log ('' if none)
+		:rtype: list
+
+		.. seealso:: look_4_mate()
+	"""
+
+	result = []
+	for zone in job[0]:
+		#reads mapping in the putative discordant zone and their mate
+		reads = zoneEngine.zoneReads(zone[0], int(zone[1]), int(zone[2]))
+		warning = ''
+		if not reads:
+			warning = "\nwarning no read found in the zone "+zone[0]+":"+zone[1]+"-"+zone[2]
+
+		sets = trie_reads(zoneEngine, reads, zone[0])
+
+		#search for destination of second mate and perform selection
+		lines = search_dest(sets[0], sets[1], sets[2], job[1], zone[0], int(zone[1]), int(zone[2]), job[2], job[3], job[4], sets[3])
+		lines += search_dest(sets[1], sets[0], sets[2], job[1], zone[0], int(zone[1]), int(zone[2]), job[2], job[3], job[4], sets[3])
+		result.append([lines, warning])
+	return result
 
 ####################################################################################################
 #				Merging identical and similar zones
@@ -1000,6 +939,62 @@ def regroupe_filtre(DATA, DATA_prec, MAX):
 	else:
 		return [DATA_prec, 'not_found']
 
+def index_zones(ZONES):
+	"""
+		Index couples of mate zones by chromosomes and start position, for merge_zone()
+
+		Each couple is indexed in both orientations: under (chr1, chr2) with start_pos1 and under (chr2, chr1) with start_pos2.
+
+		:param ZONES: The couples of mate zones (chr1 start_pos1 end_pos1 chr2 start_pos2 end_pos2)
+		:type ZONES: list
+		:return: For each (orientation, chromosome, mate chromosome), the rows of the couples sorted by start position, their start positions and the longest zone length
+		:rtype: dict
+		.. seealso:: merge_zone() zone_candidates()
+	"""
+
+	starts = numpy.array([[int(n[1]), int(n[4])] for n in ZONES], dtype=numpy.int64).reshape(-1, 2)
+	ends = numpy.array([[int(n[2]), int(n[5])] for n in ZONES], dtype=numpy.int64).reshape(-1, 2)
+	index = {}
+	for orientation in [0, 1]:
+		groups = {}
+		for row in xrange(len(ZONES)):
+			groups.setdefault((orientation, ZONES[row][3*orientation], ZONES[row][3-3*orientation]), []).append(row)
+		for key in groups:
+			rows = numpy.array(groups[key], dtype=numpy.int64)
+			rows = rows[numpy.argsort(starts[rows, orientation], kind='mergesort')]
+			index[key] = [rows, starts[rows, orientation], max(0, int((ends[rows, orientation] - starts[rows, orientation]).max()))]
+	return index
+
+def zone_candidates(INDEX, DATA, MAX):
+	"""
+		Give the couples of mate zones that regroupe_filtre() may merge with a couple of mate zones, in either orientation
+
+		:param INDEX: The index given by index_zones()
+		:type INDEX: dict
+		:param DATA: The couple of mate zones (chr1 start_pos1 end_pos1 chr2 start_pos2 end_pos2)
+		:type DATA: list
+		:param MAX: Maximal distance between two discordant zone to merge
+		:type MAX: int
+		:return: The rows of the couples, sorted
+		:rtype: list
+		.. seealso:: merge_zone() index_zones()
+	"""
+
+	start = int(DATA[1])
+	end = int(DATA[2])
+	result = []
+	for orientation in [0, 1]:
+		key = (orientation, DATA[0], DATA[3])
+		if key in INDEX:
+			rows, starts, longer = INDEX[key]
+			#the first zones must be at less than MAX: a zone starting before start must end after start-MAX
+			first = numpy.searchsorted(starts, start - MAX - longer, 'left')
+			last = numpy.searchsorted(starts, max(start, end + MAX), 'right')
+			result.append(rows[first:last])
+	if not result:
+		return []
+	return numpy.unique(numpy.concatenate(result)).tolist()
+
 def merge_zone(LOCA_PROGRAMS, CHR, FILE, MAX, bamAmont, bamAval, TYPE, OUT):
 
 	"""
@@ -1026,50 +1021,52 @@ def merge_zone(LOCA_PROGRAMS, CHR, FILE, MAX, bamAmont, bamAval, TYPE, OUT):
 	#Sort the zone file like : first 5 cols corresponds to the uphill zone, and the 5 cols following corresponds to the downhill zone
 	triZonesAmontAval(FILE, CHR, FILE+'_sorted')
 
-	#recording each zone in a dictionary
-	data_prec = ''
+	#the zones are read once and indexed, a zone being checked against the merged zone only if the index tells it may be merged
+	zones = []
 	file = open(FILE+'_sorted')
-	outfile = open(OUT,'w')
-	dic = set()
-	i = 0
-	len_dic = 0
-
 	for line in file:
 		data = line.split()
 		if data:
-			i = i + 1
-			if not(i in dic):
-				data_prec = line.split()
-				data_prec.append(i)
-				dic.add(i)
-				while len(dic) != len_dic:
-					len_dic = len(dic)
-					file2 = open(FILE+'_sorted')
-					j = 0
-					for line2 in file2:
-						data_check = line2.split()
-						if data_check:
-							j = j + 1
-							if not(j in dic):
-								data2 = line2.split()
-								data2.append(j)
-
-								found = regroupe_filtre(data2, data_prec, MAX)
-								data_prec = found[0]
-
-								#We try the other order of zone 'amont and aval exchange places'
-								if found[1] == 'not_found':
-									new_data2 = [data2[3],data2[4],data2[5],data2[0],data2[1],data2[2],data2[6]]
-
-									found = regroupe_filtre(new_data2, data_prec, MAX)
-									data_prec = found[0]
-								elif found[1] != 'found':
-									raise ValueError('bug')
-								dic.add(data_prec[6])
-
-				covs = calculCovFromMateZones(LOCA_PROGRAMS, bamAmont, bamAval, TYPE, data_prec[0], data_prec[1], data_prec[2], data_prec[3], data_prec[4], data_prec[5])
-
-				outfile.write(str(data_prec[0])+' '+str(data_prec[1])+' '+str(data_prec[2])+' '+str(int(data_prec[2])-int(data_prec[1]))+' '+str(covs[0])+' '+str(data_prec[3])+' '+str(data_prec[4])+' '+str(data_prec[5])+' '+str(int(data_prec[5])-int(data_prec[4]))+' '+str(covs[1])+' - '+str(covs[2])+'\n')
+			zones.append(data)
+	file.close()
+	index = index_zones(zones)
+	merged = numpy.zeros(len(zones), dtype=bool)
+	outfile = open(OUT,'w')
+
+	for i in xrange(len(zones)):
+		if not merged[i]:
+			data_prec = zones[i] + [i]
+			merged[i] = True
+			found_zone = True
+			while found_zone:
+				#a pass checks the zones not merged in the order of the file, the merged zone growing on the way: a zone before the last zone
+				#merged, that the merged zone can now reach, waits for the next pass
+				found_zone = False
+				queue = [n for n in zone_candidates(index, data_prec, MAX) if not merged[n]]
+				queued = set(queue)
+				while queue:
+					j = heapq.heappop(queue)
+					data2 = zones[j] + [j]
+
+					found = regroupe_filtre(data2, data_prec, MAX)
+
+					#We try the other order of zone 'amont and aval exchange places'
+					if found[1] == 'not_found':
+						new_data2 = [data2[3],data2[4],data2[5],data2[0],data2[1],data2[2],data2[6]]
+
+						found = regroupe_filtre(new_data2, data_prec, MAX)
+					if found[1] == 'found':
+						data_prec = found[0]
+						merged[j] = True
+						found_zone = True
+						for n in zone_candidates(index, data_prec, MAX):
+							if n > j and not merged[n] and not(n in queued):
+								heapq.heappush(queue, n)
+								queued.add(n)
+
+			covs = calculCovFromMateZones(LOCA_PROGRAMS, bamAmont, bamAval, TYPE, data_prec[0], data_prec[1], data_prec[2], data_prec[3], data_prec[4], data_prec[5])
+
+			outfile.write(str(data_prec[0])+' '+str(data_prec[1])+' '+str(data_prec[2])+' '+str(int(data_prec[2])-int(data_prec[1]))+' '+str(covs[0])+' '+str(data_prec[3])+' '+str(data_prec[4])+' '+str(data_prec[5])+' '+str(int(data_prec[5])-int(data_prec[4]))+' '+str(covs[1])+' - '+str(covs[2])+'\n')
 	outfile.close()
 
 #########################################################################################################################################################
@@ -1185,6 +1182,7 @@ def __main__():
 	parser.add_option( '', '--YiC', dest='YiC', default=0, help='The Y-intercept of the linear function for coverage that will give the second component of product giving the score (integer), [default: %default]')
 	parser.add_option( '', '--MiC', dest='MiC', default=25, help='The minimal zone coverage for which the second component of product giving the score will be maximal (integer), [default: %default]')
 	parser.add_option( '', '--min_score', dest='min_score', default=70, help='The minimal score for a discordant zone to be identified as passed, [default: %default]')
+	parser.add_option( '', '--zone_thread', dest='zone_thread', default='1', help='Number of processes checking the discordant zones in parallel, [default: %default]')
 	parser.add_option( '', '--out', dest='out', default='not_filled', help='Output file')
 	parser.add_option( '', '--config', dest='config', default=None)
 	(options, args) = parser.parse_args()
@@ -1209,7 +1207,6 @@ def __main__():
 	else:
 		tmp_name = tempfile.NamedTemporaryFile().name
 		# tmp_name = 'toto'
-		tmp_cov = tmp_name+'.cov'
 		tmp_zone = tmp_name+'.zone'
 		tmp_mate_zone = tmp_name+'_mate.zone'
 		tmp_merge = tmp_name+'.merge'
@@ -1219,6 +1216,10 @@ def __main__():
 		if options.config:
 			config = ConfigParser.RawConfigParser()
 			config.read(options.config)
+			if config.has_option('General','zone_thread'):
+				zone_thread = config.getint('General','zone_thread')
+			else:
+				zone_thread = int(options.zone_thread)
 
 			# Index bam file
 			logOutput.write("\nstarting date : "+str(datetime.datetime.now()))
@@ -1235,11 +1236,6 @@ def __main__():
 			index_bam_file(loca_programs, tmp_name+'Bam_aval')
 			logOutput.write("\nSort and index amont/aval  : "+str(datetime.datetime.now() - t0))
 			logOutput.flush()
-			# Calcul the coverture site by site
-			t0 = datetime.datetime.now()
-			calcul_cov(loca_programs, options.sam, config.get('Trie_discord','type'), tmp_cov)
-			logOutput.write('\ncalcul coverture : '+str(datetime.datetime.now() - t0))
-			logOutput.flush()
 			maxcov = config.getfloat('Calc_coverage','median_coverage')*config.getfloat('General','mult_max_cov')
 			mincov = config.getfloat('Calc_coverage','median_coverage')*config.getfloat('General','mult_min_cov')
 			minzone =  config.getint('General','min_zone')
@@ -1248,16 +1244,15 @@ def __main__():
 			logOutput.write('\nMaximal accepted coverage:'+str(maxcov))
 			logOutput.flush()
 
-			# Find zones from the coverture
+			# Find zones from the coverture, computed site by site while the zones are read
 			t0 = datetime.datetime.now()
-			statCovs = select_sur_couv(tmp_cov, config.getint('General','min_zone'), maxcov, mincov, config.getint('General','min_gap'), tmp_zone)
+			statCovs = select_sur_couv(coverage.iterDepth(options.sam), config.getint('General','min_zone'), maxcov, mincov, config.getint('General','min_gap'), tmp_zone)
 			nb_zone = statCovs[0]
 			longerZone = statCovs[1]
 			logOutput.write("\ntotal number of discordant zones : "+str(nb_zone))
 			logOutput.write("\nlength of the longer zone : "+str(longerZone))
 			logOutput.write('\nselect zones on coverture : '+str(datetime.datetime.now() - t0))
 			logOutput.flush()
-			os.remove(tmp_cov)
 			ecart = config.getfloat('Calc_coverage','standard_deviation_insert')*3.0
 			logOutput = open(logNameFile, 'a')
 			logOutput.write('\nMargin:'+str(ecart))
@@ -1266,7 +1261,7 @@ def __main__():
 
 			# Try to identify mate zones
 			t0 = datetime.datetime.now()
-			look_4_mate(logNameFile, loca_programs, config.get('Trie_discord','type'), options.sam, config.get('General','chr'), tmp_mate_zone, tmp_zone, ecart, config.getint('General','min_zone'), maxcov, mincov, mingap, nb_zone, longerZone, config.getfloat('Calc_coverage','median_insert'))
+			look_4_mate(logNameFile, loca_programs, config.get('Trie_discord','type'), options.sam, config.get('General','chr'), tmp_mate_zone, tmp_zone, ecart, config.getint('General','min_zone'), maxcov, mincov, mingap, nb_zone, zone_thread)
 			logOutput.write('\nlook for mate zones : '+str(datetime.datetime.now() - t0))
 			logOutput.flush()
 			os.remove(tmp_zone)
@@ -1307,11 +1302,6 @@ def __main__():
 			logOutput.write("\nSort and index amont/aval  : "+str(datetime.datetime.now() - t0))
 			logOutput.flush()
 
-			# Calcul the coverture site by site
-			t0 = datetime.datetime.now()
-			calcul_cov(loca_programs, options.sam, options.type, tmp_cov)
-			logOutput.write('\ncalcul coverture : '+str(datetime.datetime.now() - t0))
-			logOutput.flush()
 			maxcov = int(options.median_coverage)*int(options.mult_max_cov)
 			mincov = int(options.median_coverage)*int(mult_min_cov)
 			minzone =  options.min_zone
@@ -1320,16 +1310,15 @@ def __main__():
 			logOutput.write('\nMaximal accepted coverage:'+str(maxcov))
 			logOutput.flush()
 
-			# Find zones from the coverture
+			# Find zones from the coverture, computed site by site while the zones are read
 			t0 = datetime.datetime.now()
-			statCovs = select_sur_couv(tmp_cov, int(options.min_zone), float(options.maxcov), float(options.mincov), int(options.min_gap), tmp_zone)
+			statCovs = select_sur_couv(coverage.iterDepth(options.sam), int(options.min_zone), float(options.maxcov), float(options.mincov), int(options.min_gap), tmp_zone)
 			nb_zone = statCovs[0]
 			longerZone = statCovs[1]
 			logOutput.write("\ntotal number of discordant zones : "+str(nb_zone))
 			logOutput.write("\nlength of the longer zone : "+str(longerZone))
 			logOutput.write('\nselect zones on coverture : '+str(datetime.datetime.now() - t0))
 			logOutput.flush()
-			os.remove(tmp_cov)
 			ecart = options.ecart
 			logOutput.write('\nMargin:'+str(ecart))
 			logOutput.write('\nNumber of zone to test:'+str(nb_zone))
@@ -1337,7 +1326,7 @@ def __main__():
 
 			# Try to identify mate zones
 			t0 = datetime.datetime.now()
-			look_4_mate(logNameFile, loca_programs,  options.type, options.sam, options.chr, tmp_mate_zone, tmp_zone, float(options.ecart), int(options.min_zone), float(options.maxcov), float(options.mincov), int(options.min_gap), nb_zone, longerZone, int(options.med_insert))
+			look_4_mate(logNameFile, loca_programs,  options.type, options.sam, options.chr, tmp_mate_zone, tmp_zone, float(options.ecart), int(options.min_zone), float(options.maxcov), float(options.mincov), int(options.min_gap), nb_zone, int(options.zone_thread))
 			logOutput.write('\nlook for mate zones : '+str(datetime.datetime.now() - t0))
 			logOutput.flush()
 			os.remove(tmp_zone)
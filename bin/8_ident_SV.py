@@ -38,6 +38,7 @@ import datetime
 import ctypes
 import multiprocessing as mp
 from multiprocessing.sharedctypes import Value, Array
+import utilsSR.covstore as covstore
 
 # Global variables
 covChr = {}  # contains the coverture of each site by chromosome
@@ -92,22 +93,11 @@ def readChrLenght(chrFile):
 def readCov(chrFile, covFile):
 	"""
 		fill a global dict with the coverage of the chromosome for each site
+
+		The arrays are mapped from the binary store of the coverage file (written by 5_calc_stat.py, or from the coverage file the first time),
+		so the processes of the pool share them.
 	"""
-	chrSize = readChrLenght(chrFile)
-	chr = ""
-	f = open(covFile, 'r')
-	for line in f:
-		if line.strip():
-			cols = line.split()
-			if cols[0] != chr:  # new chromosome
-				if chr:  # not the first line
-					covChr[chr] = test
-				test = mp.sharedctypes.RawArray(ctypes.c_int, chrSize[cols[0]])
-				test[int(cols[1])-1] = int(cols[2])
-				chr = cols[0]
-			else:
-				test[int(cols[1])-1] = int(cols[2])
-	covChr[chr] = test
+	covChr.update(covstore.loadCoverage(covFile, chrFile))
 
 
 def indent_discord(FF, FR, RR, INS, DEL, CHR_rr, CHR_fr, CHR_rf, CHR_ff, INSERT, OUT, EXP_COV, PLOID, ORIENT, TYPE):
@@ -714,10 +704,8 @@ def couv_med_reg(deb, fin, chr):
 		:param end: The end position
 		:type end: int
 	"""
-	subListNoGap = []
-	for site in covChr[chr][deb-1:fin]:
-		if site:
-			subListNoGap.append(site)
+	sites = covChr[chr][deb-1:fin]
+	subListNoGap = sites[sites > 0].tolist()
 	if len(subListNoGap) == 0:
 		return 0
 	else:
@@ -733,11 +721,9 @@ def couv_med_reg_del(deb, fin, chr):
 		:param end: The end position
 		:type end: int
 	"""
-	subListNoGap = []
 	if deb < fin:
-		for site in covChr[chr][deb-1:fin]:
-			if site:
-				subListNoGap.append(site)
+		sites = covChr[chr][deb-1:fin]
+		subListNoGap = sites[sites > 0].tolist()
 		if len(subListNoGap) <= 0.5*(fin-deb):
 			return 0
 		else:
@@ -28,6 +28,8 @@ from Bio.Alphabet import generic_dna
 from Bio import SeqIO
 from Bio.SeqRecord import SeqRecord
 from operator import itemgetter
+import utilsSR.covstore as covstore
+import utilsSR.pairlist as pairlist
 
 def stop_err( msg ):
 	sys.stderr.write( "%s\n" % msg )
@@ -386,8 +388,18 @@ def create_discord_link(scoreFile, outFile, intervalNbAcc, filterZone, filterDra
 
 ##########################################################################################################################################################
 #fonction that create paired-read link file based on .list file of ApMap
+#(a binary .list is read through its category index, only the pairs of TYPE being read)
 def create_read_link(FILE, OUT, TYPE):
 	#create_read_link(options.liste_read, options.prefix+'_read_rf.link', 'ok')
+	if pairlist.isBinary(FILE):
+		liste = pairlist.openList(FILE)
+		rows = pairlist.categoryRows(liste, TYPE)
+		chroms = liste['chroms']
+		outfile = open(OUT,'w')
+		for n in zip(liste['columns']['chr1'][rows].tolist(), liste['columns']['pos1'][rows].tolist(), liste['columns']['chr2'][rows].tolist(), liste['columns']['pos2'][rows].tolist()):
+			outfile.write(chroms[n[0]]+' '+str(n[1])+' '+str(n[1])+' '+chroms[n[2]]+' '+str(n[3])+' '+str(n[3])+'\n')
+		outfile.close()
+		return 0
 	outfile = open(OUT,'w')
 	i = 1
 	file = open(FILE)
@@ -436,6 +448,10 @@ def moyenne(L):
 def calcul_couv_moy(covFile, chrFile, window, output):
 	"""
 		Calculate the median and the mean coverage per window
+
+		The coverage is mapped from the binary store of the coverage file (written by 5_calc_stat.py, or from the coverage file the first time).
+		Windows are the same as when the coverage file was read line by line: each chromosome is cut from its start to its end,
+		except the last one which stops at its last covered site.
 	"""
 	chrSize = {}
 	with open(chrFile, 'r') as f:
@@ -443,88 +459,25 @@ def calcul_couv_moy(covFile, chrFile, window, output):
 			if line.strip():
 				cols = line.split()
 				chrSize[cols[0]] = int(cols[1])
-	i = 0
 	covPerWin = []
 	listWindows = []
-	chr = ""
-	coverage = 0.0
-	index = 0
 	window = int(window)
-	f = open(covFile, 'r')
-	for line in f:
-		if line.strip():
-			i += 1
-			cols = line.split()
-			if not chr:  # first line
-				chr = cols[0]
-				while i < int(cols[1]):
-					index += 1
-					if index == window:
-						covPerWin.append(coverage/float(index))
-						listWindows.append([chr, i-index, i, coverage/float(index)])
-						index = 0
-						coverage = 0.0
-					i += 1
-				coverage = float(cols[2])
-				index += 1
-				if index == window:
-					covPerWin.append(coverage/float(index))
-					listWindows.append([chr, i-index, i, coverage/float(index)])
-					coverage = 0.0
-					index = 0
-			elif chr == cols[0]:  # same chromosome
-				while i < int(cols[1]):
-					index += 1
-					if index == window:
-						covPerWin.append(coverage/float(index))
-						listWindows.append([chr, i-index, i, coverage/float(index)])
-						index = 0
-						coverage = 0.0
-					i += 1
-				coverage += float(cols[2])
-				index += 1
-				if index == window:
-					covPerWin.append(coverage/float(index))
-					listWindows.append([chr, i-index, i, coverage/float(index)])
-					coverage = 0.0
-					index = 0
-			else:  # new chromosome
-				while i <= chrSize[chr]:
-					index += 1
-					if index == window:
-						covPerWin.append(coverage/float(index))
-						listWindows.append([chr, i-index, i, coverage/float(index)])
-						coverage = 0.0
-						index = 0
-					i += 1
-				if index > 1:
-					print ('index restant 1 :'+str(index))
-					covPerWin.append(coverage/float(index-1))
-					listWindows.append([chr, i-index, i, coverage/float(index)])
-					coverage = 0.0
-					index = 0
-				else:
-					coverage = 0.0
-					index = 0
-				i = 1
-				chr = cols[0]
-				while i < int(cols[1]):
-					index += 1
-					if index == window:
-						covPerWin.append(coverage/float(index))
-						listWindows.append([chr, i-index, i, coverage/float(index)])
-						coverage = 0.0
-						index = 0
-					i += 1
-				coverage += float(cols[2])
-				index += 1
-				if index == window:
-					covPerWin.append(coverage/float(index))
-					listWindows.append([chr, i-index, i, coverage/float(index)])
-					coverage = 0.0
-					index = 0
-				chr = cols[0]
-	f.close()
+	covChr = covstore.loadCoverage(covFile, chrFile)
+	chrNames = covChr.keys()
+	for chr in chrNames:
+		if chr == chrNames[-1]:
+			size = int(covChr[chr].nonzero()[0][-1]) + 1
+		else:
+			size = chrSize[chr]
+		sums = covstore.windowSums(covChr[chr], size, window)
+		for i in range(len(sums[0])):
+			covPerWin.append(sums[0][i]/float(window))
+			listWindows.append([chr, i*window, (i+1)*window, sums[0][i]/float(window)])
+		index = size - len(sums[0])*window
+		if chr != chrNames[-1] and index > 1:
+			print ('index restant 1 :'+str(index))
+			covPerWin.append(sums[1]/float(index-1))
+			listWindows.append([chr, size+1-index, size+1, sums[1]/float(index)])
 
 	# try:
 	# 	med = mediane(covPerWin)
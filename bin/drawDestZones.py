@@ -32,36 +32,25 @@ import traceback
 import shutil
 import multiprocessing as mp
 import utilsSR.utilsSR as utils
+import utilsSR.coverage as coverage
 import subprocess
 from inspect import currentframe, getframeinfo
 from operator import itemgetter
 
-def identOnCov(COV):
+def identOnCov(SAM):
 	"""
 		Calculate start and end of a zone with coverage information
 
-		:param COV: The coverage file
-		:type COV: str
+		:param SAM: The sam file containing the alignments of the zone
+		:type SAM: str
 		:return: A list containing chromosome, start and end
 		:rtype: list
 	"""
-	chr = ""
-	file = open(COV)
-	liste_cov = []
-
-	for line in file:
-		if line.strip():
-			data = line.split()
-			liste_cov.append(int(data[2]))
-			if chr == "":
-				chr = data[0]
-				min = data[1]
-				max = data[1]
-			elif chr == data[0]:
-				max = data[1]
-			else:
-				raise ValueError('There is a bug in recalc_border : several chromosomes are found in the cov file')
-	return [chr, min, max]
+	try:
+		zoneCov = coverage.zoneDepth(SAM)
+	except ValueError:
+		raise ValueError('There is a bug in recalc_border : several chromosomes are found in the cov file')
+	return [zoneCov[0], str(zoneCov[1]), str(zoneCov[2])]
 
 
 def extract_function_name():
@@ -272,23 +261,10 @@ def clusterizeReads(allReadsFile, minReads, chrom, start, end, maxgap, loca_prog
 								TargetSam.write('\n'.join(samHeader+TargetForSam))
 								TargetSam.close()
 								
-								# converting sam to bam
-								utils.sam2bam(loca_programs, 'QuerySam.sam', 'QuerySam.bam')
-								utils.sam2bam(loca_programs, 'TargetSam.sam', 'TargetSam.bam')
-								
-								# sorting bam
-								utils.sortBam(loca_programs, 'QuerySam.bam', 'QuerySam_sorted.bam')
-								utils.sortBam(loca_programs, 'TargetSam.bam', 'TargetSam_sorted.bam')
-								
-								# calculating Query coverage
-								utils.calcul_cov(loca_programs, 'QuerySam_sorted.bam', 'bam', 'QuerySam.cov')
-								# calculating Target coverage
-								utils.calcul_cov(loca_programs, 'TargetSam_sorted.bam', 'bam', 'TargetSam.cov')
-								
 								# calculating start and end of Query zone
-								QueryZone = identOnCov('QuerySam.cov')
+								QueryZone = identOnCov('QuerySam.sam')
 								# calculating start and end of Target zone
-								TargetZone = identOnCov('TargetSam.cov')
+								TargetZone = identOnCov('TargetSam.sam')
 								
 								print(TargetZone)
 					
@@ -313,23 +289,10 @@ def clusterizeReads(allReadsFile, minReads, chrom, start, end, maxgap, loca_prog
 							TargetSam.write('\n'.join(samHeader+TargetForSam))
 							TargetSam.close()
 							
-							# converting sam to bam
-							utils.sam2bam(loca_programs, 'QuerySam.sam', 'QuerySam.bam')
-							utils.sam2bam(loca_programs, 'TargetSam.sam', 'TargetSam.bam')
-							
-							# sorting bam
-							utils.sortBam(loca_programs, 'QuerySam.bam', 'QuerySam_sorted.bam')
-							utils.sortBam(loca_programs, 'TargetSam.bam', 'TargetSam_sorted.bam')
-							
-							# calculating Query coverage
-							utils.calcul_cov(loca_programs, 'QuerySam_sorted.bam', 'bam', 'QuerySam.cov')
-							# calculating Target coverage
-							utils.calcul_cov(loca_programs, 'TargetSam_sorted.bam', 'bam', 'TargetSam.cov')
-							
 							# calculating start and end of Query zone
-							QueryZone = identOnCov('QuerySam.cov')
+							QueryZone = identOnCov('QuerySam.sam')
 							# calculating start and end of Target zone
-							TargetZone = identOnCov('TargetSam.cov')
+							TargetZone = identOnCov('TargetSam.sam')
 							
 							print(TargetZone)
 				
@@ -377,23 +340,10 @@ def clusterizeReads(allReadsFile, minReads, chrom, start, end, maxgap, loca_prog
 							TargetSam.write('\n'.join(samHeader+TargetForSam))
 							TargetSam.close()
 							
-							# converting sam to bam
-							utils.sam2bam(loca_programs, 'QuerySam.sam', 'QuerySam.bam')
-							utils.sam2bam(loca_programs, 'TargetSam.sam', 'TargetSam.bam')
-							
-							# sorting bam
-							utils.sortBam(loca_programs, 'QuerySam.bam', 'QuerySam_sorted.bam')
-							utils.sortBam(loca_programs, 'TargetSam.bam', 'TargetSam_sorted.bam')
-							
-							# calculating Query coverage
-							utils.calcul_cov(loca_programs, 'QuerySam_sorted.bam', 'bam', 'QuerySam.cov')
-							# calculating Target coverage
-							utils.calcul_cov(loca_programs, 'TargetSam_sorted.bam', 'bam', 'TargetSam.cov')
-							
 							# calculating start and end of Query zone
-							QueryZone = identOnCov('QuerySam.cov')
+							QueryZone = identOnCov('QuerySam.sam')
 							# calculating start and end of Target zone
-							TargetZone = identOnCov('TargetSam.cov')
+							TargetZone = identOnCov('TargetSam.sam')
 							
 							print(TargetZone)
 				
@@ -418,23 +368,10 @@ def clusterizeReads(allReadsFile, minReads, chrom, start, end, maxgap, loca_prog
 						TargetSam.write('\n'.join(samHeader+TargetForSam))
 						TargetSam.close()
 						
-						# converting sam to bam
-						utils.sam2bam(loca_programs, 'QuerySam.sam', 'QuerySam.bam')
-						utils.sam2bam(loca_programs, 'TargetSam.sam', 'TargetSam.bam')
-						
-						# sorting bam
-						utils.sortBam(loca_programs, 'QuerySam.bam', 'QuerySam_sorted.bam')
-						utils.sortBam(loca_programs, 'TargetSam.bam', 'TargetSam_sorted.bam')
-						
-						# calculating Query coverage
-						utils.calcul_cov(loca_programs, 'QuerySam_sorted.bam', 'bam', 'QuerySam.cov')
-						# calculating Target coverage
-						utils.calcul_cov(loca_programs, 'TargetSam_sorted.bam', 'bam', 'TargetSam.cov')
-						
 						# calculating start and end of Query zone
-						QueryZone = identOnCov('QuerySam.cov')
+						QueryZone = identOnCov('QuerySam.sam')
 						# calculating start and end of Target zone
-						TargetZone = identOnCov('TargetSam.cov')
+						TargetZone = identOnCov('TargetSam.sam')
 						
 						print(TargetZone)
 			
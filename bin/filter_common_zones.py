@@ -39,6 +39,7 @@ import sys
 import tempfile
 import time
 import utilsSR.utilsSR as utils
+import utilsSR.coverage as coverage
 from inspect import currentframe, getframeinfo
 from operator import itemgetter
 
@@ -603,30 +604,13 @@ def calculBorder(locaPrograms, sam, TMP):
 		:rtype: list
 	"""
 
-	tmp_sub_cov = TMP+'_tmp_sub_cov'
-	utils.calcul_cov(locaPrograms, sam, 'sam', tmp_sub_cov)
-
-	cov = open(tmp_sub_cov, 'r')
-	chrName = ""
-	posStart = ""
-	posEnd = ""
-	listCovPos = []
-	for line in cov:
-		if line.strip():
-			elments = line.split()
-			if chrName == "":
-				chrName = elments[0]
-				posStart = elments[1]
-				posEnd = elments[1]
-				listCovPos.append(int(elments[2]))
-			elif elments[0] == chrName:
-				chrName = elments[0]
-				posEnd = elments[1]
-				listCovPos.append(int(elments[2]))
-			else:
-				raise ValueError("Error in calculBorder() : More than one chromosome found in a zone.")
-	covMedian = utils.mediane(listCovPos)
-	return [chrName, posStart, posEnd, covMedian]
+	try:
+		zoneCov = coverage.zoneDepth(sam)
+	except ValueError:
+		raise ValueError("Error in calculBorder() : More than one chromosome found in a zone.")
+	if zoneCov is None:
+		return ["", "", "", utils.mediane([])]
+	return [zoneCov[0], str(zoneCov[1]), str(zoneCov[2]), utils.mediane(zoneCov[3])]
 
 def calcAllZonesFromBam(locaPrograms, genomesList, listZones):
 	"""
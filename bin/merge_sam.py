@@ -24,176 +24,230 @@
 #
 
 import optparse, os, shutil, subprocess, sys, tempfile, fileinput, ConfigParser, operator, time, random
-
-def CIGAR(mot, debut):
-	if 'N' in mot:
-		sys.exit('N in mot')
-	elif 'P' in mot:
-		sys.exit('P in mot')
-	elif '=' in mot:
-		sys.exit('= in mot')
-	elif 'X' in mot:
-		sys.exit('X in mot')
-	else:
-		mot_split = mot.replace('M',' M ').replace('D',' D ').replace('I',' I ').replace('S',' S ').replace('H',' H ').split()
-	total = 0
-	while mot_split:
-		if mot_split[1] == 'M' or mot_split[1] == 'D':
-			total = total + int(mot_split[0])
-		del mot_split[0]
-		del mot_split[0]
-	return debut + (total-1)
+import utilsSR.utilsSR as utils
 
 def find_info(LINE, YT):
-	mot = []
-	for n in LINE:
-		liste = n.split(':')
-		if liste[0] == 'AS':
-			mot.append(n)
-		elif liste[0] == 'XS':
-			mot.append(n)
+	mot = [n for n in LINE if n[:3] == 'AS:' or n[:3] == 'XS:' or n == 'AS' or n == 'XS']
 	mot.append(YT)
 	return mot
 
+#Flags and YT tag of the two output lines when at most one mate is mapped, the mapped mate being written first
+SINGLE_TABLE = {
+	('4', '4'): ('77', '141', 'YT:Z:UP'),
+	('0', '4'): ('73', '133', 'YT:Z:UP'),
+	('16', '4'): ('89', '165', 'YT:Z:UP'),
+	('4', '0'): ('69', '137', 'YT:Z:UP'),
+	('4', '16'): ('101', '153', 'YT:Z:UP')
+}
+
+#Return the table giving flags and YT tag of the mate1 and mate2 output lines of a pair where both mates are mapped.
+#Keys: (flag1, flag2, same chromosome, order of the mate1 and mate2 positions (-1, 0 or 1), insert size within [MIN,MAX])
+def pairing_table(OR):
+	table = {}
+	#mate1 and mate2 strand flags: discordant flags, concordant flags, position order expected for a concordant pair in rf and fr libraries
+	strands = [
+		('0', '0', ('65', '129'), None, None, None),
+		('16', '16', ('113', '177'), None, None, None),
+		('16', '0', ('81', '161'), ('83', '163'), -1, 1),
+		('0', '16', ('97', '145'), ('99', '147'), 1, -1)
+	]
+	for n in strands:
+		for order in [-1, 0, 1]:
+			for insert_ok in [True, False]:
+				table[(n[0], n[1], False, order, insert_ok)] = n[2] + ('YT:Z:DP',)
+				if n[3] is None:
+					table[(n[0], n[1], True, order, insert_ok)] = n[2] + ('YT:Z:DP',)
+				elif OR == 'rf' or OR == 'fr':
+					if insert_ok and ((OR == 'rf' and order == n[4]) or (OR == 'fr' and order == n[5])):
+						table[(n[0], n[1], True, order, insert_ok)] = n[3] + ('YT:Z:CP',)
+					else:
+						table[(n[0], n[1], True, order, insert_ok)] = n[2] + ('YT:Z:DP',)
+	return table
+
+#Return the thresholds [minimal AS-XS difference, minimal mapping quality] of the multi-hit filter (None for an unused threshold), or None if no filter is asked
+def pair_filter(ASXS, QUAL):
+	if ASXS == 'not_filled' and QUAL == 'not_filled':
+		return None
+	FILTER = [None, None]
+	if ASXS != 'not_filled':
+		FILTER[0] = int(ASXS)
+	if QUAL != 'not_filled':
+		FILTER[1] = int(QUAL)
+	return FILTER
+
+#Return True if both mates pass the multi-hit filter: the AS-XS difference of mates having a second hit should reach MIN_DIF and both mapping qualities should reach MIN_QUAL
+def filter_pair(data1, data2, MIN_DIF, MIN_QUAL):
+	if MIN_DIF is not None:
+		for data in [data1, data2]:
+			AS = None
+			XS = None
+			for n in data[11:]:
+				if n[:3] == 'AS:':
+					AS = n.split(':')[2]
+				elif n[:3] == 'XS:':
+					XS = n.split(':')[2]
+			if XS is not None and abs(int(AS)-int(XS)) < MIN_DIF:
+				return False
+	if MIN_QUAL is not None:
+		if int(data1[4]) < MIN_QUAL or int(data2[4]) < MIN_QUAL:
+			return False
+	return True
 
-def merge2sam(FILE1, FILE2, OUT, MIN, MAX, OR):
+def print_filter(COUNTS):
+	print('Mapped pairs: %s' % COUNTS[0])
+	print('Mapped pairs kept: %s' % COUNTS[1])
+	print('Mapped pairs proportion kept: %s' % str(float(COUNTS[1])/float(COUNTS[0])))
+	sys.stdout.flush()
+
+#Write the pairs of a paired sam stream (mates on consecutive lines) passing the multi-hit filter and return [pair number, pair kept number]
+def filter_stream(infile, outfile, FILTER):
+	nb_input = 0
+	nb_kept = 0
+	buffer = []
+	line1 = infile.readline()
+	while line1 and line1[0] == '@':
+		buffer.append(line1)
+		line1 = infile.readline()
+	while line1:
+		line2 = infile.readline()
+		data1 = line1.split()
+		data2 = line2.split()
+		nb_input += 1
+		if data1[0] != data2[0]:
+			sys.exit('Read should be sorted by query name in the sam file')
+		if filter_pair(data1, data2, FILTER[0], FILTER[1]):
+			nb_kept += 1
+			buffer.append(line1)
+			buffer.append(line2)
+			if len(buffer) >= 20000:
+				outfile.writelines(buffer)
+				buffer = []
+		line1 = infile.readline()
+	outfile.writelines(buffer)
+	outfile.flush()
+	return [nb_input, nb_kept]
+
+def merge2sam(LOCA_PROGRAMS, FILE1, FILE2, OUT, TYPE, THREAD, MIN, MAX, OR, FILTER=None):
+	file1 = open(FILE1)
+	file2 = open(FILE2)
+	writer = utils.openSamWriter(LOCA_PROGRAMS, OUT, TYPE, THREAD)
+	counts = merge_stream(file1, file2, writer[0], MIN, MAX, OR, FILTER)
+	file1.close()
+	file2.close()
+	utils.closeSamWriter(writer)
+	return counts
+
+#Pair the records of two single-end sam streams sharing the same read order (queryname sorted files or mapper outputs in input order).
+#If FILTER is given (see pair_filter), only the pairs passing the multi-hit filter are written and [pair number, pair kept number] is returned.
+def merge_stream(file1, file2, outfile, MIN, MAX, OR, FILTER=None):
 	mapped_pair = 0
 	mapped_single = 0
 	unmapped = 0
-	file1 = open(FILE1)
-	file2 = open(FILE2)
-	boucle = 1
-	outfile = open(OUT, 'w')
+	nb_input = 0
+	nb_kept = 0
+	table = pairing_table(OR)
+	buffer = []
 	line1 = file1.readline()
 	line2 = file2.readline()
 	while line1:
 		data1 = line1.split()
 		data2 = line2.split()
 		if data1[0][0] == '@':
-			outfile.write(line1)
+			buffer.append(line1)
 		else:
-			while data1[1] == '256' or data1[1] == '272':
+			while data1 and (data1[1] == '256' or data1[1] == '272'):
 				line1 = file1.readline()
 				data1 = line1.split()
-			while data2[1] == '256' or data2[1] == '272':
+			while data2 and (data2[1] == '256' or data2[1] == '272'):
 				line2 = file2.readline()
 				data2 = line2.split()
-			if data1[0].replace('/1','').replace('/2','') != data2[0].replace('/1','').replace('/2','') and data1[0].replace('_1','').replace('_2','') != data2[0].replace('_1','').replace('_2',''):
+			if not data1 and not data2:
+				break
+			if not data1 or not data2:
+				sys.exit('Probleme in the mapping : one of the mate sam files ends before the other')
+			name1 = data1[0].replace('/1','').replace('/2','')
+			name2 = data2[0].replace('/1','').replace('/2','')
+			if name1 != name2 and data1[0].replace('_1','').replace('_2','') != data2[0].replace('_1','').replace('_2',''):
 				mot = 'Probleme in the mapping : '+data1[0]+' and '+data2[0]+' are different. Read mates should be identified with /1 and /2'
 				sys.exit(mot)
-			else:
-				if data1[1] == '4' and data2[1] == '4': #reads unmapped
-					unmapped += 1
-					outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t77\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t'+data1[6]+'\t'+data1[7]+'\t'+data1[8]+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:UP'))+'\n')
-					outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t141\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t'+data2[6]+'\t'+data2[7]+'\t'+data2[8]+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:UP'))+'\n')
-				elif data1[1] == '0' and data2[1] == '4': #mate 1 mappant en F
-					mapped_single += 1
-					outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t73\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data1[3]+'\t0\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:UP'))+'\n')
-					outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t133\t'+data1[2]+'\t'+data1[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t0\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:UP'))+'\n')
-				elif data1[1] == '16' and data2[1] == '4': #mate 1 mappant en R
-					mapped_single += 1
-					outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t89\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data1[3]+'\t0\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:UP'))+'\n')
-					outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t165\t'+data1[2]+'\t'+data1[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t0\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:UP'))+'\n')
-				elif data1[1] == '4' and data2[1] == '0':#mate 2 mappant en F
-					mapped_single += 1
-					outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t137\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data2[3]+'\t0\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:UP'))+'\n')
-					outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t69\t'+data2[2]+'\t'+data2[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t0\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:UP'))+'\n')
-				elif data1[1] == '4' and data2[1] == '16':#mate 2 mappant en R
+			name1 = name1.replace('_1','').replace('_2','')
+			name2 = name2.replace('_1','').replace('_2','')
+			flag1 = data1[1]
+			flag2 = data2[1]
+			mark = len(buffer)
+			if flag1 == '4' or flag2 == '4':
+				if (flag1, flag2) not in SINGLE_TABLE:
+					os.system('echo "'+flag1+' '+flag2+'"')
+					sys.exit('Probleme in the formating of mapping file')
+				out = SINGLE_TABLE[(flag1, flag2)]
+				if flag2 == '4':
+					if flag1 == '4':#reads unmapped
+						unmapped += 1
+						buffer.append('\t'.join([name1, out[0]] + data1[2:11] + find_info(data1[11:], out[2]))+'\n')
+						buffer.append('\t'.join([name2, out[1]] + data2[2:11] + find_info(data2[11:], out[2]))+'\n')
+					else:#mate 1 mapped
+						mapped_single += 1
+						buffer.append('\t'.join([name1, out[0], data1[2], data1[3], data1[4], data1[5], '=', data1[3], '0', data1[9], data1[10]] + find_info(data1[11:], out[2]))+'\n')
+						buffer.append('\t'.join([name2, out[1], data1[2], data1[3], data2[4], data2[5], '=', data1[3], '0', data2[9], data2[10]] + find_info(data2[11:], out[2]))+'\n')
+				else:#mate 2 mapped
 					mapped_single += 1
-					outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t153\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data2[3]+'\t0\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:UP'))+'\n')
-					outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t101\t'+data2[2]+'\t'+data2[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t0\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:UP'))+'\n')
-				elif data1[1] == '0' and data2[1] == '0':#mate FF
-					mapped_pair += 1
-					if data1[2] != data2[2]:#sur des chromosomes differents
-						outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t65\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t'+data2[2]+'\t'+data2[3]+'\t0\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:DP'))+'\n')
-						outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t129\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t'+data1[2]+'\t'+data1[3]+'\t0\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:DP'))+'\n')
-					else:
-						if int(data1[3]) < int(data2[3]):
-							outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t65\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t'+str((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1)+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:DP'))+'\n')
-							outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t129\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t-'+str((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1)+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:DP'))+'\n')
-						else:
-							outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t65\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t-'+str((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1)+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:DP'))+'\n')
-							outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t129\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t'+str((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1)+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:DP'))+'\n')
-				elif data1[1] == '16' and data2[1] == '16':#mate RR
-					mapped_pair += 1
-					if data1[2] != data2[2]:#sur des chromosomes differents
-						outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t113\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t'+data2[2]+'\t'+data2[3]+'\t0\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:DP'))+'\n')
-						outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t177\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t'+data1[2]+'\t'+data1[3]+'\t0\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:DP'))+'\n')
-					else:
-						if int(data1[3]) < int(data2[3]):
-							outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t113\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t'+str((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1)+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:DP'))+'\n')
-							outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t177\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t-'+str((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1)+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:DP'))+'\n')
-						else:
-							outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t113\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t-'+str((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1)+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:DP'))+'\n')
-							outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t177\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t'+str((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1)+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:DP'))+'\n')
-				elif data1[1] == '16' and data2[1] == '0':#mate1 R, mate2 F
-					mapped_pair += 1
-					if data1[2] != data2[2]:#sur des chromosomes differents
-						outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t81\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t'+data2[2]+'\t'+data2[3]+'\t0\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:DP'))+'\n')
-						outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t161\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t'+data1[2]+'\t'+data1[3]+'\t0\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:DP'))+'\n')
-					elif OR == 'rf':#pour une bonne orientation RF
-						if int(data1[3]) < int(data2[3]) and ((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1) >= MIN and ((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1) <= MAX:#well mapped
-							outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t83\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t'+str((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1)+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:CP'))+'\n')
-							outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t163\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t-'+str((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1)+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:CP'))+'\n')
-						else:
-							if int(data1[3]) < int(data2[3]):#wrong insert size
-								outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t81\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t'+str((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1)+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:DP'))+'\n')
-								outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t161\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t-'+str((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1)+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:DP'))+'\n')
-							else:#read FR
-								outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t81\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t-'+str((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1)+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:DP'))+'\n')
-								outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t161\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t'+str((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1)+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:DP'))+'\n')
-					elif OR == 'fr':#pour une bonne orientation FR
-						if int(data1[3]) > int(data2[3]) and ((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1) >= MIN and ((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1) <= MAX:
-							outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t83\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t-'+str((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1)+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:CP'))+'\n')
-							outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t163\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t'+str((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1)+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:CP'))+'\n')
-						else:
-							if int(data1[3]) < int(data2[3]):
-								outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t81\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t'+str((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1)+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:DP'))+'\n')
-								outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t161\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t-'+str((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1)+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:DP'))+'\n')
-							else:
-								outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t81\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t-'+str((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1)+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:DP'))+'\n')
-								outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t161\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t'+str((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1)+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:DP'))+'\n')
-					else:
-						sys.exit('bug')
-				elif data1[1] == '0' and data2[1] == '16':#mate1 F, mate2 R
-					mapped_pair += 1
-					if data1[2] != data2[2]:#sur des chromosomes differents
-						outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t97\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t'+data2[2]+'\t'+data2[3]+'\t0\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:DP'))+'\n')
-						outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t145\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t'+data1[2]+'\t'+data1[3]+'\t0\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:DP'))+'\n')
-					elif OR == 'rf':#pour une bonne orientation RF
-						if int(data1[3]) > int(data2[3]) and ((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1) >= MIN and ((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1) <= MAX:
-							outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t99\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t-'+str((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1)+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:CP'))+'\n')
-							outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t147\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t'+str((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1)+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:CP'))+'\n')
-						else:
-							if int(data1[3]) < int(data2[3]):
-								outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t97\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t'+str((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1)+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:DP'))+'\n')
-								outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t145\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t-'+str((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1)+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:DP'))+'\n')
-							else:
-								outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t97\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t-'+str((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1)+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:DP'))+'\n')
-								outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t145\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t'+str((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1)+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:DP'))+'\n')
-					elif OR == 'fr':#pour une bonne orientation FR
-						if int(data1[3]) < int(data2[3]) and ((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1) >= MIN and ((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1) <= MAX:
-							outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t99\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t'+str((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1)+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:CP'))+'\n')
-							outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t147\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t-'+str((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1)+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:CP'))+'\n')
-						else:
-							if int(data1[3]) < int(data2[3]):
-								outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t97\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t'+str((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1)+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:DP'))+'\n')
-								outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t145\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t-'+str((CIGAR(data2[5],int(data2[3]))-int(data1[3]))+1)+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:DP'))+'\n')
-							else:
-								outfile.write(data1[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t97\t'+data1[2]+'\t'+data1[3]+'\t'+data1[4]+'\t'+data1[5]+'\t=\t'+data2[3]+'\t-'+str((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1)+'\t'+data1[9]+'\t'+data1[10]+'\t'+'\t'.join(find_info(data1[11:],'YT:Z:DP'))+'\n')
-								outfile.write(data2[0].replace('/1','').replace('/2','').replace('_1','').replace('_2','')+'\t145\t'+data2[2]+'\t'+data2[3]+'\t'+data2[4]+'\t'+data2[5]+'\t=\t'+data1[3]+'\t'+str((CIGAR(data1[5],int(data1[3]))-int(data2[3]))+1)+'\t'+data2[9]+'\t'+data2[10]+'\t'+'\t'.join(find_info(data2[11:],'YT:Z:DP'))+'\n')
-					else:
-						sys.exit('bug')
+					buffer.append('\t'.join([name2, out[1], data2[2], data2[3], data2[4], data2[5], '=', data2[3], '0', data2[9], data2[10]] + find_info(data2[11:], out[2]))+'\n')
+					buffer.append('\t'.join([name1, out[0], data2[2], data2[3], data1[4], data1[5], '=', data2[3], '0', data1[9], data1[10]] + find_info(data1[11:], out[2]))+'\n')
+			elif data1[2] != data2[2]:#sur des chromosomes differents
+				out = table.get((flag1, flag2, False, 0, False))
+				if out is None:
+					os.system('echo "'+flag1+' '+flag2+'"')
+					sys.exit('Probleme in the formating of mapping file')
+				mapped_pair += 1
+				buffer.append('\t'.join([name1, out[0], data1[2], data1[3], data1[4], data1[5], data2[2], data2[3], '0', data1[9], data1[10]] + find_info(data1[11:], out[2]))+'\n')
+				buffer.append('\t'.join([name2, out[1], data2[2], data2[3], data2[4], data2[5], data1[2], data1[3], '0', data2[9], data2[10]] + find_info(data2[11:], out[2]))+'\n')
+			else:
+				pos1 = int(data1[3])
+				pos2 = int(data2[3])
+				#the span of the pair is computed once, from the leftmost start to the end of the other mate
+				if pos1 < pos2:
+					span = (utils.alignmentEnd(data2[5], pos2)-pos1)+1
+					tlen1 = str(span)
+					tlen2 = '-'+tlen1
+					order = -1
 				else:
-					os.system('echo "'+data1[1]+' '+data2[1]+'"')
+					span = (utils.alignmentEnd(data1[5], pos1)-pos2)+1
+					tlen2 = str(span)
+					tlen1 = '-'+tlen2
+					order = cmp(pos1, pos2)
+				out = table.get((flag1, flag2, True, order, MIN <= span <= MAX))
+				if out is None:
+					if (flag1, flag2) in [('16', '0'), ('0', '16')]:
+						sys.exit('bug')
+					os.system('echo "'+flag1+' '+flag2+'"')
 					sys.exit('Probleme in the formating of mapping file')
+				mapped_pair += 1
+				buffer.append('\t'.join([name1, out[0], data1[2], data1[3], data1[4], data1[5], '=', data2[3], tlen1, data1[9], data1[10]] + find_info(data1[11:], out[2]))+'\n')
+				buffer.append('\t'.join([name2, out[1], data2[2], data2[3], data2[4], data2[5], '=', data1[3], tlen2, data2[9], data2[10]] + find_info(data2[11:], out[2]))+'\n')
+			if FILTER is not None:
+				#the filter only reads MAPQ and AS/XS tags, which are the same in the input and output lines
+				nb_input += 1
+				if filter_pair(data1, data2, FILTER[0], FILTER[1]):
+					nb_kept += 1
+				else:
+					del buffer[mark:]
+		if len(buffer) >= 20000:
+			outfile.writelines(buffer)
+			buffer = []
 		line1 = file1.readline()
 		line2 = file2.readline()
-	outfile.close()
+	while line2 and line2.split()[1] in ['256', '272']:
+		line2 = file2.readline()
+	if line2:
+		sys.exit('Probleme in the mapping : one of the mate sam files ends before the other')
+	outfile.writelines(buffer)
+	outfile.flush()
 	os.system('echo "Mapped pair: '+str(mapped_pair)+'"')
 	os.system('echo "Mapped single (mate1 or mate2): '+str(mapped_single)+'"')
 	os.system('echo "Unmapped (mate1 and mate2): '+str(unmapped)+'"')
-	
+	if FILTER is not None:
+		print_filter([nb_input, nb_kept])
+		return [nb_input, nb_kept]
 
 
 def __main__():
@@ -206,9 +260,18 @@ def __main__():
 	parser.add_option( '', '--min', dest='min', help='minimal insert size to accept the pair as properly mapped')
 	parser.add_option( '', '--max', dest='max', help='maximal insert size to accept the pair as properly mapped')
 	parser.add_option( '', '--orient', dest='orient', help='Expected orientation of paired reads')
+	parser.add_option( '', '--out_format', dest='out_format', default='sam', help='Output format: sam or bam, [default: %default]')
+	parser.add_option( '', '--thread', dest='thread', default='1', help='The thread number used for bam compression (integer), [default: %default]')
+	parser.add_option( '', '--asxs', dest='asxs', default='not_filled', help='Keep only pairs whose mates have a difference between the best and second hit (AS/XS tags) reaching this value')
+	parser.add_option( '', '--qual', dest='qual', default='not_filled', help='Keep only pairs whose mates have a mapping quality reaching this value')
 	(options, args) = parser.parse_args()
 	
 	
-	merge2sam(options.file1, options.file2, options.out, int(options.min), int(options.max), options.orient)
+	pathname = os.path.dirname(sys.argv[0])
+	
+	loca_programs = ConfigParser.RawConfigParser()
+	loca_programs.read(pathname+'/loca_programs.conf')
+	
+	merge2sam(loca_programs, options.file1, options.file2, options.out, options.out_format, options.thread, int(options.min), int(options.max), options.orient, pair_filter(options.asxs, options.qual))
 	
 if __name__ == "__main__": __main__()
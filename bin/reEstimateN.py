@@ -29,6 +29,7 @@ from Bio.Seq import Seq
 from Bio.Alphabet import generic_dna
 from Bio import SeqIO
 from Bio.SeqRecord import SeqRecord
+import utilsSR.insertsize as insertsize
 
 def stop_err( msg ):
     sys.stderr.write( "%s\n" % msg )
@@ -61,23 +62,12 @@ def run_job (cmd_line, ERROR, ID):
 		stop_err( ERROR + str( e ) )
 
 
-def recal_ins(FILE):
-	LIST = []
-	fichier = open(FILE)
-	i = 0
-	for line in fichier:
-		data = line.split()
-		if data != []:
-			if line[0] != '@':
-				if i == 0:
-					i = 1
-					LIST.append(abs(int(data[8])))
-				else:
-					i = 0
-	if LIST == []:
+def recal_ins(FILE, CHROMS):
+	HISTO = insertsize.insertHisto(FILE, 0, CHROMS)
+	if HISTO == {}:
 		return 'NA'
 	else:
-		return sum(LIST)/len(LIST)
+		return sum([n*HISTO[n] for n in HISTO])/sum(HISTO.values())
 	
 def estimateN(chromosome, debut, fin, OR, sam, debut_rec, fin_rec, MIN_READ):
 	LIST = []
@@ -212,22 +202,14 @@ def __main__():
 	#Calculation of chromosomes size
 	#1)Loading sequences
 	record_dict = SeqIO.index(config.get('General','ref'), "fasta")
-	#2)Recording informations in a temporary file
-	f = tempfile.NamedTemporaryFile()
+	#2)Recording the chromosomes kept
 	liste_id = []
 	for n in record_dict:
 		if not(n in CHR):
-			f.write(n+'\t1'+'\t'+str(len(str(record_dict[n].seq)))+'\n')
 			liste_id.append(n)
-			f.flush()
-	#3)Generating a filtered sam from which insertsize will be estimated (on well mapped reads)
-	tempo = tempfile.NamedTemporaryFile().name
-	parse1 = '%s view -uf 2 -L %s %s | %s view -h -o %s - ' % (loca_programs.get('Programs','samtools'), f.name, config.get('Remove_dup','out'), loca_programs.get('Programs','samtools'), tempo+'_reEstimateN_mapped.sam')
-	run_job(parse1, 'bug in parsing 1', "sam")
-	f.close()
-	INSERT = recal_ins(tempo+'_reEstimateN_mapped.sam')
+	#3)Estimating insertsize on well mapped reads of the chromosomes kept
+	INSERT = recal_ins(config.get('Remove_dup','out'), liste_id)
 	os.system('echo "Estimated insert size : '+str(INSERT)+'"')
-	os.remove(tempo+'_reEstimateN_mapped.sam')
 	# INSERT = 5400
 	
 	outseq = open(options.out,'w')
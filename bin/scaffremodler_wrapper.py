@@ -59,6 +59,20 @@ def run_job (cmd_line, ERROR):
 		return returncode
 
 
+#Choose the sort orders written by step 4 from the steps run after it. Step 5 needs a coordinate sorted bam, and step 6 reads pairs, needing the mates on consecutive lines,
+#and writes its category bams in coordinate order for step 7: step 4 always writes a coordinate sorted bam, and when step 6 is run it also writes the grouped order in its single pass
+#instead of step 6 sorting the bam again.
+def plan_orders(CONFIG, STEP):
+	config = ConfigParser.RawConfigParser()
+	config.read(CONFIG)
+	config.set('Remove_dup', 'sort', 'coordinate')
+	if '6' in STEP:
+		config.set('Remove_dup', 'grouped', 'y')
+	else:
+		config.set('Remove_dup', 'grouped', 'n')
+	with open(CONFIG, 'wb') as configfile:
+		config.write(configfile)
+
 def main(job):
 
 	try:
@@ -117,6 +131,8 @@ def __main__():
 	parser.add_option( '', '--qual', dest='qual', default='33', help='Fastq quality encoding: 33 or 64, [default: %default]')
 	parser.add_option( '', '--index', dest='index', default='y', help='Build reference index : y or n,  [default: %default]')
 	parser.add_option( '', '--rmindex', dest='rmindex', default='y', help='Remove reference index at the end of calculation: y or n, [default: %default]')
+	parser.add_option( '', '--index_cache', dest='index_cache', default='not_filled', help='Directory of reference indexes shared between runs. If filled, --index and --rmindex are ignored and the index is built only if not already in this directory')
+	parser.add_option( '', '--index_cache_size', dest='index_cache_size', default='50', help='Maximal size (in Go) of the index cache directory, least recently used indexes being removed first, [default: %default]')
 	parser.add_option( '', '--filter_multi', dest='filter_multi', default='y', help='Filter reads with multiple locations : y or n,  [default: %default]')
 	parser.add_option( '', '--mini_dis', dest='mini_dis', default='10000', help='The minimal insert size to keep the discordant read for structural variation search (integer), [default: %default]')
 	parser.add_option( '', '--mult_max_cov', dest='mult_max_cov', default='10', help='multiplicator of median coverage for maximal median coverage to keep a zone (float), [default: %default]')
@@ -124,6 +140,16 @@ def __main__():
 	parser.add_option( '', '--min_zone', dest='min_zone', default='500', help='Minimal number of covered sites in a zone to be considered (integer),  [default: %default]')
 	parser.add_option( '', '--min_gap', dest='min_gap', default='300', help='Maximal number of contiguous uncovered sites in a zone to be considered as a single zone (integer),  [default: %default]')
 	parser.add_option( '', '--thread', dest='thread', default='1', help='The thread number used for mapping (integer), [default: %default]')
+	parser.add_option( '', '--stream', dest='stream', default='n', help='Pair mate1 and mate2 alignments on the fly without intermediate sam and sorting (bowtie, bowtie2_single and bwa_mem only): y or n, [default: %default]')
+	parser.add_option( '', '--concurrent', dest='concurrent', default='n', help='Map mate1 and mate2 at the same time, sharing the --thread number between them (bowtie, bowtie2_single, bwa and bwa_mem only): y or n, [default: %default]')
+	parser.add_option( '', '--shard', dest='shard', default='1', help='Number of chunks the fastq files are split in to be mapped in parallel, the --thread number being shared between them (integer), [default: %default]')
+	parser.add_option( '', '--shard_retry', dest='shard_retry', default='1', help='Number of times a failed chunk is mapped again (integer), [default: %default]')
+	parser.add_option( '', '--out_format', dest='out_format', default='sam', help='Format of the mapping and single pair filter outputs: sam or bam, [default: %default]')
+	parser.add_option( '', '--fuse_filter', dest='fuse_filter', default='n', help='Apply the multi-hit filter of step 3 while the mapped pairs are written in step 2, step 3 then only reports the filter counts: y or n, [default: %default]')
+	parser.add_option( '', '--ins_sample', dest='ins_sample', default='0', help='Number of proper pairs sampled to estimate the insert size in step 5, 0 to use all of them (integer), [default: %default]')
+	parser.add_option( '', '--prop_windows', dest='prop_windows', default='1000', help='Window sizes of the discordant read proportion tracks of step 6, separated by "=", [default: %default]')
+	parser.add_option( '', '--list_format', dest='list_format', default='text', help='Format of the .list file of the read pairs written in step 6: text or binary (columns with a category index, read by step 6 and conf4circos.py), [default: %default]')
+	parser.add_option( '', '--zone_thread', dest='zone_thread', default='1', help='Number of processes checking the discordant zones of each discordant type in parallel in step 7, [default: %default]')
 	parser.add_option( '', '--msd', dest='msd', default='3', help='Multiplicator of standard deviation for discordant zone identification (integer), [default: %default]')
 	parser.add_option( '', '--max_dist_merge', dest='max_dist_merge', default=1000, help='Maximal distance between two discordant zone to merge, [default: %default]')
 	parser.add_option( '', '--YiS', dest='YiS', default=0, help='The Y-intercept of the linear function for zone size that will give the first component of product giving the score (integer), [default: %default]')
@@ -156,7 +182,7 @@ def __main__():
 		t0 = datetime.datetime.now()
 		print("Step 1 'create_conf' in progress")
 		sys.stdout.flush()
-		conf_commande = '%s %s/1_create_conf.py --tool %s --ref %s --q1 %s --q2 %s --orient %s --mini %s --maxi %s --qual %s --index %s --rmindex %s --mini_dis %s --mult_max_cov %s --mult_min_cov %s --min_zone %s --min_gap %s --thread %s --msd %s --max_dist_merge %s --YiS %s --MiS %s --YiC %s --MiC %s --min_score %s --ploid %s --restimate %s --output %s.conf --chr %s.chrom --rm_intermediate %s --exclude_chrom %s' % (loca_programs.get('Programs','python'), pathname, options.tool, options.ref, options.q1, options.q2, options.orient, options.mini, options.maxi, options.qual, options.index, options.rmindex, options.mini_dis, options.mult_max_cov, options.mult_min_cov, options.min_zone, options.min_gap, options.thread, options.msd, options.max_dist_merge, options.YiS, options.MiS, options.YiC, options.MiC, options.min_score, options.ploid, options.restimate, options.prefix, options.prefix, options.rm_intermediate, options.exclude_chrom)
+		conf_commande = '%s %s/1_create_conf.py --tool %s --ref %s --q1 %s --q2 %s --orient %s --mini %s --maxi %s --qual %s --index %s --rmindex %s --mini_dis %s --mult_max_cov %s --mult_min_cov %s --min_zone %s --min_gap %s --thread %s --msd %s --max_dist_merge %s --YiS %s --MiS %s --YiC %s --MiC %s --min_score %s --ploid %s --restimate %s --output %s.conf --chr %s.chrom --rm_intermediate %s --exclude_chrom %s --stream %s --concurrent %s --index_cache %s --index_cache_size %s --shard %s --shard_retry %s --out_format %s --fuse_filter %s --ins_sample %s --prop_windows %s --list_format %s --zone_thread %s' % (loca_programs.get('Programs','python'), pathname, options.tool, options.ref, options.q1, options.q2, options.orient, options.mini, options.maxi, options.qual, options.index, options.rmindex, options.mini_dis, options.mult_max_cov, options.mult_min_cov, options.min_zone, options.min_gap, options.thread, options.msd, options.max_dist_merge, options.YiS, options.MiS, options.YiC, options.MiC, options.min_score, options.ploid, options.restimate, options.prefix, options.prefix, options.rm_intermediate, options.exclude_chrom, options.stream, options.concurrent, options.index_cache, options.index_cache_size, options.shard, options.shard_retry, options.out_format, options.fuse_filter, options.ins_sample, options.prop_windows, options.list_format, options.zone_thread)
 		# print conf_commande
 		run_job( conf_commande, 'bug')
 		print("Step 1 is finished (time : "+str(datetime.datetime.now()-t0)+")")
@@ -165,7 +191,7 @@ def __main__():
 		t0 = datetime.datetime.now()
 		print("Step 2 'map' in progress")
 		sys.stdout.flush()
-		mapping = '%s %s/2_map.py --config %s.conf --out %s.sam' % (loca_programs.get('Programs','python'), pathname, options.prefix, options.prefix)
+		mapping = '%s %s/2_map.py --config %s.conf --out %s.%s' % (loca_programs.get('Programs','python'), pathname, options.prefix, options.prefix, options.out_format)
 		# print mapping
 		run_job( mapping, 'bug')
 		print("Step 2 is finished (time : "+str(datetime.datetime.now()-t0)+")")
@@ -174,7 +200,7 @@ def __main__():
 		t0 = datetime.datetime.now()
 		print("Step 3 'filter_single_pair' in progress")
 		sys.stdout.flush()
-		filter1 = '%s %s/3_filter_single_pair.py --config %s.conf --out %s_fltr1.sam' % (loca_programs.get('Programs','python'), pathname, options.prefix, options.prefix)
+		filter1 = '%s %s/3_filter_single_pair.py --config %s.conf --out %s_fltr1.%s' % (loca_programs.get('Programs','python'), pathname, options.prefix, options.prefix, options.out_format)
 		# print filter1
 		run_job( filter1, 'bug')
 		print("Step 3 is finished (time : "+str(datetime.datetime.now()-t0)+")")
@@ -183,6 +209,7 @@ def __main__():
 		t0 = datetime.datetime.now()
 		print("Step 4 'filter_sam' in progress")
 		sys.stdout.flush()
+		plan_orders(options.prefix+'.conf', options.step)
 		filter2 = '%s %s/4_filter_sam.py --config %s.conf --out %s_fltr2.bam' % (loca_programs.get('Programs','python'), pathname, options.prefix, options.prefix)
 		# print filter2
 		run_job( filter2, 'bug')
@@ -192,7 +219,7 @@ def __main__():
 		t0 = datetime.datetime.now()
 		print("Step 5 'calc_stat' in progress")
 		sys.stdout.flush()
-		stat = '%s %s/5_calc_stat.py --config %s.conf --out %s.cov --stat %s_stat.txt --outconf %s_stat.conf' % (loca_programs.get('Programs','python'), pathname, options.prefix, options.prefix, options.prefix, options.prefix)
+		stat = '%s %s/5_calc_stat.py --config %s.conf --out %s.cov --stat %s_stat.txt --ins_histo %s_insert.histo --outconf %s_stat.conf' % (loca_programs.get('Programs','python'), pathname, options.prefix, options.prefix, options.prefix, options.prefix, options.prefix)
 		# print stat
 		run_job( stat, 'bug')
 		print("Step 5 is finished (time : "+str(datetime.datetime.now()-t0)+")")
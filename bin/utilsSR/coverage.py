@@ -0,0 +1,300 @@
+import os, array, multiprocessing
+import numpy, pysam
+
+#Alignments not counted, as in samtools depth: unmapped, secondary, QC fail and duplicate
+SKIP_FLAG = 0x704
+#Number of alignment blocks added to the depth arrays at once
+CHUNK_SIZE = 1000000
+
+
+def _depth(STARTS, ENDS):
+	"""
+		Give the depth of the sites covered by a set of alignment blocks
+
+		The start and end of each block are added as +1/-1 deltas, the depth being their cumulative sum.
+
+		:param STARTS: The 0-based start of each block
+		:type STARTS: numpy.ndarray
+		:param ENDS: The 0-based end (excluded) of each block
+		:type ENDS: numpy.ndarray
+		:return: The 0-based position of the first site of the array and the depth of each site from it
+		:rtype: list
+	"""
+
+	offset = int(STARTS.min())
+	size = int(ENDS.max()) - offset
+	delta = numpy.bincount(STARTS - offset, minlength=size+1) - numpy.bincount(ENDS - offset, minlength=size+1)
+	return [offset, numpy.cumsum(delta[:size]).astype(numpy.int32)]
+
+
+def _add_blocks(BLOCKS, READ):
+	for n in READ.get_blocks():
+		BLOCKS[0].append(n[0])
+		BLOCKS[1].append(n[1])
+
+
+def _merge(DEPTH, PART):
+	"""
+		Add a depth array to another one, the result covering both
+
+		:param DEPTH: The offset and depth array given by _depth, or None
+		:type DEPTH: list
+		:param PART: The offset and depth array given by _depth
+		:type PART: list
+		:return: The offset and depth array of the sum
+		:rtype: list
+	"""
+
+	if DEPTH is None:
+		return PART
+	offset = min(DEPTH[0], PART[0])
+	end = max(DEPTH[0]+len(DEPTH[1]), PART[0]+len(PART[1]))
+	if offset == DEPTH[0] and end == DEPTH[0]+len(DEPTH[1]):
+		depth = DEPTH[1]
+	else:
+		depth = numpy.zeros(end - offset, dtype=numpy.int32)
+		depth[DEPTH[0]-offset:DEPTH[0]-offset+len(DEPTH[1])] = DEPTH[1]
+	depth[PART[0]-offset:PART[0]-offset+len(PART[1])] += PART[1]
+	return [offset, depth]
+
+
+def _reduce(DEPTH, BLOCKS):
+	return _merge(DEPTH, _depth(numpy.frombuffer(BLOCKS[0], dtype=numpy.int_), numpy.frombuffer(BLOCKS[1], dtype=numpy.int_)))
+
+
+def _collect(READS):
+	"""
+		Give the depth of the sites covered by alignments of a single chromosome
+
+		:param READS: An iterator of pysam alignments
+		:return: The offset and depth array given by _depth, or None if no site is covered
+		:rtype: list
+	"""
+
+	blocks = [array.array('l'), array.array('l')]
+	depth = None
+	for read in READS:
+		if read.flag & SKIP_FLAG:
+			continue
+		_add_blocks(blocks, read)
+		if len(blocks[0]) >= CHUNK_SIZE:
+			#blocks are reduced to a depth array by chunks to bound memory
+			depth = _reduce(depth, blocks)
+			blocks = [array.array('l'), array.array('l')]
+	if blocks[0]:
+		depth = _reduce(depth, blocks)
+	return depth
+
+
+def bamCoverage(BAM, CHROM):
+	"""
+		Give the depth of the sites of a chromosome covered by the alignments of an indexed bam file
+
+		:param BAM: The indexed bam file
+		:type BAM: str
+		:param CHROM: The chromosome name
+		:type CHROM: str
+		:return: The 0-based position of the first covered site and the depth of each site from it, or None if no site is covered
+		:rtype: list
+	"""
+
+	bam = pysam.AlignmentFile(BAM, 'rb')
+	result = _collect(bam.fetch(CHROM))
+	bam.close()
+	return result
+
+
+def fileCoverage(SAM):
+	"""
+		Give the depth of the covered sites of a sam or bam file, chromosome by chromosome in the header order
+
+		The file is read once whatever its sort order, no index being needed, the blocks of each chromosome being reduced to its depth array every CHUNK_SIZE blocks.
+
+		:param SAM: The sam or bam file
+		:type SAM: str
+		:return: A generator of [chromosome, offset, depth array] lists, offset being the 0-based position of the first element of the depth array
+		:rtype: generator
+	"""
+
+	sam = pysam.AlignmentFile(SAM, 'r')
+	names = sam.references
+	blocks = {}
+	depth = {}
+	for read in sam.fetch(until_eof=True):
+		if read.flag & SKIP_FLAG:
+			continue
+		if read.reference_id not in blocks:
+			blocks[read.reference_id] = [array.array('l'), array.array('l')]
+			depth[read.reference_id] = None
+		_add_blocks(blocks[read.reference_id], read)
+		if len(blocks[read.reference_id][0]) >= CHUNK_SIZE:
+			#the blocks of each chromosome are reduced to its depth array by chunks to bound memory
+			depth[read.reference_id] = _reduce(depth[read.reference_id], blocks[read.reference_id])
+			blocks[read.reference_id] = [array.array('l'), array.array('l')]
+	sam.close()
+	for n in sorted(blocks):
+		if blocks[n][0]:
+			depth[n] = _reduce(depth[n], blocks[n])
+		del blocks[n]
+		result = depth.pop(n)
+		yield [names[n], result[0], result[1]]
+
+
+def referenceLengths(SAM):
+	"""
+		Give the length of the reference sequences of a sam or bam file, from its header
+
+		:param SAM: The sam or bam file
+		:type SAM: str
+		:return: The length of each reference sequence
+		:rtype: dict
+	"""
+
+	sam = pysam.AlignmentFile(SAM, 'r')
+	result = dict(zip(sam.references, sam.lengths))
+	sam.close()
+	return result
+
+
+def _map_worker(job):
+	result = bamCoverage(job[0], job[1])
+	if result is None:
+		return None
+	return job[2](job[1], result[0], result[1])
+
+
+def mapCoverage(SAM, FUNCTION, THREAD = 1):
+	"""
+		Apply a function to the depth array of each covered chromosome of a sam or bam file
+
+		Indexed bam files are read chromosome by chromosome through the index, in THREAD parallel processes; other files are read once by fileCoverage.
+
+		:param SAM: The sam or bam file
+		:type SAM: str
+		:param FUNCTION: A module level function taking the chromosome name, the offset and the depth array
+		:type FUNCTION: function
+		:param THREAD: The number of processes
+		:type THREAD: int
+		:return: The results of FUNCTION, in the chromosome order of the header
+		:rtype: list
+	"""
+
+	if os.path.isfile(SAM+'.bai') or os.path.isfile(os.path.splitext(SAM)[0]+'.bai'):
+		bam = pysam.AlignmentFile(SAM, 'rb')
+		liste_job = [[SAM, n, FUNCTION] for n in bam.references]
+		bam.close()
+		if int(THREAD) > 1:
+			pool = multiprocessing.Pool(processes=int(THREAD))
+			results = pool.map(_map_worker, liste_job)
+			pool.close()
+			pool.join()
+		else:
+			results = map(_map_worker, liste_job)
+		return [n for n in results if n is not None]
+	return [FUNCTION(n[0], n[1], n[2]) for n in fileCoverage(SAM)]
+
+
+def coveredSites(OFFSET, DEPTH):
+	"""
+		Give the covered sites of a depth array
+
+		:param OFFSET: The 0-based position of the first element of DEPTH
+		:type OFFSET: int
+		:param DEPTH: The depth array
+		:type DEPTH: numpy.ndarray
+		:return: The 1-based positions of the sites having a depth above 0 and their depth
+		:rtype: list
+	"""
+
+	index = numpy.flatnonzero(DEPTH)
+	return [index + (OFFSET+1), DEPTH[index]]
+
+
+def iterDepth(SAM):
+	"""
+		Give the covered sites of a sam or bam file as the lines of samtools depth, without writing them
+
+		:param SAM: The sam or bam file
+		:type SAM: str
+		:return: A generator of (chromosome, 1-based position, depth) tuples
+		:rtype: generator
+	"""
+
+	for n in fileCoverage(SAM):
+		sites = coveredSites(n[1], n[2])
+		for site in zip(sites[0].tolist(), sites[1].tolist()):
+			yield (n[0], site[0], site[1])
+
+
+def writeDepth(OUTFILE, CHROM, OFFSET, DEPTH):
+	"""
+		Write the covered sites of a depth array in the samtools depth format (chromosome, 1-based position, depth)
+
+		:param OUTFILE: The output file
+		:type OUTFILE: file
+		:param CHROM: The chromosome name
+		:type CHROM: str
+		:param OFFSET: The 0-based position of the first element of DEPTH
+		:type OFFSET: int
+		:param DEPTH: The depth array
+		:type DEPTH: numpy.ndarray
+		:return: void
+	"""
+
+	sites = coveredSites(OFFSET, DEPTH)
+	if len(sites[0]):
+		numpy.savetxt(OUTFILE, numpy.column_stack(sites), fmt=CHROM.replace('%', '%%')+'\t%d\t%d')
+
+
+def depthHisto(DEPTH):
+	"""
+		Give the histogram of the depth of the covered sites of a depth array
+
+		:param DEPTH: The depth array
+		:type DEPTH: numpy.ndarray
+		:return: The (depth, number of sites) list of the depths above 0, sorted by depth
+		:rtype: list
+	"""
+
+	counts = numpy.bincount(DEPTH)
+	return [(float(n), int(counts[n])) for n in numpy.flatnonzero(counts) if n > 0]
+
+
+def alignmentsDepth(READS):
+	"""
+		Give the covered sites of a set of alignments of a single zone
+
+		:param READS: An iterator of pysam alignments, alignments with a flag of SKIP_FLAG being ignored
+		:return: The chromosome, the first and last covered positions (1-based) and the list of depths of the covered sites, or None if no site is covered
+		:rtype: list
+		:raises ValueError: If the alignments are on several chromosomes
+	"""
+
+	reads = [n for n in READS if not n.flag & SKIP_FLAG]
+	if not reads:
+		return None
+	if len(set([n.reference_id for n in reads])) > 1:
+		raise ValueError('Several chromosomes are found in the zone')
+	depth = _collect(reads)
+	sites = coveredSites(depth[0], depth[1])
+	return [reads[0].reference_name, int(sites[0][0]), int(sites[0][-1]), sites[1].tolist()]
+
+
+def zoneDepth(SAM):
+	"""
+		Give the covered sites of a sam or bam file containing the alignments of a single zone
+
+		:param SAM: The sam or bam file
+		:type SAM: str
+		:return: The chromosome, the first and last covered positions (1-based) and the list of depths of the covered sites, or None if no site is covered
+		:rtype: list
+		:raises ValueError: If the alignments are on several chromosomes
+	"""
+
+	sam = pysam.AlignmentFile(SAM, 'r')
+	try:
+		return alignmentsDepth(sam.fetch(until_eof=True))
+	except ValueError:
+		raise ValueError('Several chromosomes are found in the zone of '+SAM)
+	finally:
+		sam.close()
@@ -0,0 +1,172 @@
+import os, shutil, collections
+import numpy
+
+#Alignment (in bytes) of the chromosome arrays in the store
+ALIGN = 8
+
+
+def storeName(COV):
+	"""
+		Give the name of the binary coverage store kept next to a coverage file
+
+		The store is a binary file holding, chromosome after chromosome, the depth of each site (uint16, or uint32 for chromosomes with a depth above 65535),
+		its index (STORE.idx) giving for each chromosome its name, dtype, byte offset in the store and length.
+
+		:param COV: The coverage file (samtools depth format)
+		:type COV: str
+		:return: The name of the store
+		:rtype: str
+	"""
+
+	return COV+'.bin'
+
+
+def writeChrom(OUT, SIZE, OFFSET, DEPTH):
+	"""
+		Write the depth of all the sites of a chromosome in a chunk of store
+
+		:param OUT: The chunk file
+		:type OUT: str
+		:param SIZE: The chromosome length
+		:type SIZE: int
+		:param OFFSET: The 0-based position of the first element of DEPTH
+		:type OFFSET: int
+		:param DEPTH: The depth array
+		:type DEPTH: numpy.ndarray
+		:return: The dtype name of the chunk
+		:rtype: str
+	"""
+
+	if len(DEPTH) and DEPTH.max() > numpy.iinfo(numpy.uint16).max:
+		dtype = 'uint32'
+	else:
+		dtype = 'uint16'
+	chrom = numpy.zeros(max(SIZE, OFFSET+len(DEPTH)), dtype=dtype)
+	chrom[OFFSET:OFFSET+len(DEPTH)] = DEPTH
+	chrom.tofile(OUT)
+	return dtype
+
+
+def writeStore(STORE, CHUNKS):
+	"""
+		Gather chunks written by writeChrom() in a store and write its index, the chunk files being removed
+
+		:param STORE: The store name
+		:type STORE: str
+		:param CHUNKS: The [chromosome, dtype, chunk file] list of each chromosome, in the order of the store
+		:type CHUNKS: list
+		:return: void
+	"""
+
+	outfile = open(STORE, 'wb')
+	index = open(STORE+'.idx', 'w')
+	offset = 0
+	for n in CHUNKS:
+		length = os.path.getsize(n[2])/numpy.dtype(n[1]).itemsize
+		index.write('\t'.join([n[0], n[1], str(offset), str(length)])+'\n')
+		chunk = open(n[2], 'rb')
+		shutil.copyfileobj(chunk, outfile, 1048576)
+		chunk.close()
+		os.remove(n[2])
+		offset += length*numpy.dtype(n[1]).itemsize
+		if offset % ALIGN:
+			outfile.write('\0'*(ALIGN - offset % ALIGN))
+			offset += ALIGN - offset % ALIGN
+	index.close()
+	outfile.close()
+
+
+def storeFromDepth(COV, CHR, STORE):
+	"""
+		Write the store of a coverage file in the samtools depth format, chromosome by chromosome
+
+		:param COV: The coverage file, the sites of a chromosome being on consecutive lines
+		:type COV: str
+		:param CHR: A file with the chromosome names in the first column and their lengths in the second
+		:type CHR: str
+		:param STORE: The store name
+		:type STORE: str
+		:return: void
+	"""
+
+	chrSize = {}
+	for line in open(CHR):
+		cols = line.split()
+		if cols:
+			chrSize[cols[0]] = int(cols[1])
+	chunks = []
+	chrom = None
+	for line in open(COV):
+		cols = line.split()
+		if not cols:
+			continue
+		if chrom is None or cols[0] != chrom:
+			if chrom is not None:
+				chunk = STORE+'_'+str(len(chunks))+'_tmp'
+				chunks.append([chrom, writeChrom(chunk, chrSize[chrom], 0, depth), chunk])
+			chrom = cols[0]
+			depth = numpy.zeros(chrSize[chrom], dtype=numpy.uint32)
+		depth[int(cols[1])-1] = int(cols[2])
+	if chrom is not None:
+		chunk = STORE+'_'+str(len(chunks))+'_tmp'
+		chunks.append([chrom, writeChrom(chunk, chrSize[chrom], 0, depth), chunk])
+	writeStore(STORE, chunks)
+
+
+def openStore(STORE):
+	"""
+		Map the chromosome arrays of a store read only, without reading them: processes forked after share the pages of the arrays
+
+		:param STORE: The store name
+		:type STORE: str
+		:return: The depth array of each site of each chromosome (site at 1-based position p at index p-1), in the order of the store
+		:rtype: collections.OrderedDict
+	"""
+
+	result = collections.OrderedDict()
+	for line in open(STORE+'.idx'):
+		cols = line.split('\t')
+		if int(cols[3]):
+			result[cols[0]] = numpy.memmap(STORE, dtype=cols[1], mode='r', offset=int(cols[2]), shape=(int(cols[3]),))
+		else:
+			result[cols[0]] = numpy.zeros(0, dtype=cols[1])
+	return result
+
+
+def loadCoverage(COV, CHR):
+	"""
+		Map the store of a coverage file, writing it first from the coverage file if it is missing or older
+
+		:param COV: The coverage file (samtools depth format)
+		:type COV: str
+		:param CHR: A file with the chromosome names in the first column and their lengths in the second
+		:type CHR: str
+		:return: The depth arrays given by openStore()
+		:rtype: collections.OrderedDict
+	"""
+
+	store = storeName(COV)
+	if not os.path.isfile(store+'.idx') or os.path.getmtime(store+'.idx') < os.path.getmtime(COV):
+		storeFromDepth(COV, CHR, store)
+	return openStore(store)
+
+
+def windowSums(DEPTH, SIZE, WINDOW):
+	"""
+		Give the sum of the depth of the sites of consecutive windows of a chromosome
+
+		:param DEPTH: The depth array of each site of the chromosome, as given by openStore()
+		:type DEPTH: numpy.ndarray
+		:param SIZE: The number of sites from the chromosome start to sum (sites beyond DEPTH having a depth of 0)
+		:type SIZE: int
+		:param WINDOW: The window length
+		:type WINDOW: int
+		:return: The list of the sums of each full window and the sum of the last partial window
+		:rtype: list
+	"""
+
+	nb = SIZE/WINDOW
+	if len(DEPTH) < SIZE:
+		DEPTH = numpy.concatenate([DEPTH, numpy.zeros(SIZE - len(DEPTH), dtype=DEPTH.dtype)])
+	#reshaping the mapped array gives a view: the sites are summed without being copied
+	return [DEPTH[:nb*WINDOW].reshape(nb, WINDOW).sum(axis=1, dtype=numpy.float64).tolist(), float(DEPTH[nb*WINDOW:SIZE].sum(dtype=numpy.float64))]
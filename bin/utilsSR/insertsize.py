@@ -0,0 +1,99 @@
+import random
+import pysam
+
+#Alignments not used: unmapped, secondary, QC fail, duplicate and supplementary
+SKIP_FLAG = 0xF04
+
+
+def insertHisto(SAM, SAMPLE = 0, CHROMS = None, SEED = 0):
+	"""
+		Give the histogram of the insert size of the proper pairs of a sam or bam file, read in a single pass
+
+		Each pair is counted once, from its first mate. With SAMPLE, the histogram is made of SAMPLE pairs drawn by reservoir sampling
+		with a fixed seed, so the same file always gives the same histogram.
+
+		:param SAM: The sam or bam file
+		:type SAM: str
+		:param SAMPLE: The number of pairs sampled, 0 to use all the pairs
+		:type SAMPLE: int
+		:param CHROMS: The names of the chromosomes where the pairs are taken, None for all
+		:type CHROMS: list
+		:param SEED: The seed of the sampling
+		:type SEED: int
+		:return: The number of pairs of each insert size
+		:rtype: dict
+	"""
+
+	sam = pysam.AlignmentFile(SAM, 'r')
+	if CHROMS is not None:
+		keep = set([sam.get_tid(n) for n in CHROMS])
+	histo = {}
+	reservoir = []
+	rand = random.Random(SEED)
+	nb = 0
+	for read in sam.fetch(until_eof=True):
+		if read.flag & SKIP_FLAG or not read.is_proper_pair or not read.is_read1:
+			continue
+		if CHROMS is not None and read.reference_id not in keep:
+			continue
+		insert = abs(read.template_length)
+		if not SAMPLE:
+			histo[insert] = histo.get(insert, 0) + 1
+		elif nb < SAMPLE:
+			reservoir.append(insert)
+		else:
+			k = rand.randint(0, nb)
+			if k < SAMPLE:
+				reservoir[k] = insert
+		nb += 1
+	sam.close()
+	for insert in reservoir:
+		histo[insert] = histo.get(insert, 0) + 1
+	return histo
+
+
+def histoStats(HISTO):
+	"""
+		Give the median, mean and standard deviation of the insert size from its histogram
+
+		:param HISTO: The number of pairs of each insert size, as given by insertHisto()
+		:type HISTO: dict
+		:return: The median, the mean and the standard deviation, 0 for each if the histogram is empty
+		:rtype: list
+	"""
+
+	items = sorted(HISTO.items())
+	N = sum([n[1] for n in items])
+	if N == 0:
+		return [0, 0, 0]
+	#values at the (N-1)/2 and N/2 indexes (0-based) of the sorted insert sizes, the same if N is odd
+	median = []
+	cumul = 0
+	for n in items:
+		cumul += n[1]
+		while len(median) < 2 and [(N-1)/2, N/2][len(median)] < cumul:
+			median.append(n[0])
+	if N % 2:
+		median = median[0]
+	else:
+		median = (median[0]+median[1])/2.0
+	mean = sum([n[0]*n[1] for n in items])/float(N)
+	variance = sum([n[1]*(n[0]-mean)**2 for n in items])/float(N)
+	return [median, mean, variance**0.5]
+
+
+def writeHisto(HISTO, OUT):
+	"""
+		Write the histogram of the insert size, one "insert size<TAB>number of pairs" line per insert size
+
+		:param HISTO: The number of pairs of each insert size, as given by insertHisto()
+		:type HISTO: dict
+		:param OUT: The output file name
+		:type OUT: str
+		:return: void
+	"""
+
+	outfile = open(OUT, 'w')
+	for n in sorted(HISTO.items()):
+		outfile.write(str(n[0])+'\t'+str(n[1])+'\n')
+	outfile.close()
@@ -0,0 +1,259 @@
+import os, shutil
+import numpy
+
+#First bytes of a binary list, telling it from a text list
+MAGIC = 'SRLIST1\n'
+#Alignment (in bytes) of the columns in the list
+ALIGN = 8
+#Columns of a binary list, in the order of the file, and their dtype
+COLUMNS = [['name_offset', 'int64'], ['name', 'uint8'], ['pos1', 'int32'], ['pos2', 'int32'], ['chr1', 'int32'], ['chr2', 'int32'], ['code', 'uint8'], ['discard', 'uint8'], ['rows', 'int64']]
+#Number of pairs written at once by exportText()
+CHUNK_SIZE = 1000000
+
+
+class ListWriter:
+	"""
+		Write the list of the labelled read pairs in the binary format, by batches of pairs
+
+		The list holds one fixed-width column per field (positions, chromosome codes, label code and discard flag of each pair), the read names
+		(concatenated, with the offset of each name), and the category index: the rows of the pairs of each label and discard flag, in the order of the pairs.
+		Its index (LISTE.idx) gives the chromosome and label of each code, the dtype, byte offset and length of each column and the rows of each category.
+		Columns are written in temporary files next to the list as batches come, and gathered on close().
+	"""
+
+	def __init__(self, LISTE, CHR, LABELS):
+		"""
+			:param LISTE: The list file name
+			:type LISTE: str
+			:param CHR: A file with the chromosome names in the first column, the chromosome codes following its order
+			:type CHR: str
+			:param LABELS: The label of each label code
+			:type LABELS: list
+		"""
+
+		self.liste = LISTE
+		self.labels = LABELS
+		self.chroms = []
+		self.index = {}
+		for line in open(CHR):
+			data = line.split()
+			if data and not(data[0] in self.index):
+				self.index[data[0]] = len(self.chroms)
+				self.chroms.append(data[0])
+		self.files = {}
+		for n in COLUMNS:
+			if n[0] != 'rows':
+				self.files[n[0]] = open(self._tmp(n[0]), 'wb')
+		#rows of each category, the category of a pair being discard*len(LABELS)+code
+		self.rows = {}
+		self.nb = 0
+		self.size = 0
+		numpy.zeros(1, dtype='int64').tofile(self.files['name_offset'])
+
+	def _tmp(self, NAME):
+		return self.liste+'_'+NAME+'_tmp'
+
+	def _code(self, CHROM):
+		#chromosomes absent from CHR (such as "*") get the following codes
+		if not(CHROM in self.index):
+			self.index[CHROM] = len(self.chroms)
+			self.chroms.append(CHROM)
+		return self.index[CHROM]
+
+	def add(self, NAMES, POS1, POS2, CHR1, CHR2, CODE, DISCARD):
+		"""
+			Add a batch of pairs to the list
+
+			:param NAMES: The read name of each pair
+			:type NAMES: list
+			:param POS1: The position of mate1 of each pair
+			:type POS1: list
+			:param POS2: The position of mate2 of each pair
+			:type POS2: list
+			:param CHR1: The chromosome of mate1 of each pair
+			:type CHR1: list
+			:param CHR2: The chromosome of mate2 of each pair
+			:type CHR2: list
+			:param CODE: The label code of each pair
+			:type CODE: numpy.ndarray
+			:param DISCARD: Whether each pair is discarded
+			:type DISCARD: numpy.ndarray
+			:return: void
+		"""
+
+		if not len(NAMES):
+			return
+		self.files['name'].write(''.join(NAMES))
+		offset = numpy.cumsum([len(n) for n in NAMES]).astype('int64') + self.size
+		offset.tofile(self.files['name_offset'])
+		self.size = int(offset[-1])
+		numpy.array(POS1).astype('int32').tofile(self.files['pos1'])
+		numpy.array(POS2).astype('int32').tofile(self.files['pos2'])
+		numpy.array([self._code(n) for n in CHR1], dtype='int32').tofile(self.files['chr1'])
+		numpy.array([self._code(n) for n in CHR2], dtype='int32').tofile(self.files['chr2'])
+		code = numpy.asarray(CODE).astype('uint8')
+		discard = numpy.asarray(DISCARD).astype('uint8')
+		code.tofile(self.files['code'])
+		discard.tofile(self.files['discard'])
+		category = discard.astype('int64')*len(self.labels) + code
+		for n in numpy.unique(category).tolist():
+			if not(n in self.rows):
+				self.rows[n] = open(self._tmp('rows_'+str(n)), 'wb')
+			(numpy.flatnonzero(category == n) + self.nb).tofile(self.rows[n])
+		self.nb += len(NAMES)
+
+	def close(self):
+		"""
+			Gather the columns and the category index in the list and write its index, the temporary files being removed
+
+			:return: void
+		"""
+
+		for n in self.files:
+			self.files[n].close()
+		for n in self.rows:
+			self.rows[n].close()
+		outfile = open(self.liste, 'wb')
+		outfile.write(MAGIC)
+		index = open(self.liste+'.idx', 'w')
+		for n in self.chroms:
+			index.write('chrom\t'+n+'\n')
+		for n in self.labels:
+			index.write('label\t'+n+'\n')
+		offset = len(MAGIC)
+		for n in COLUMNS:
+			if n[0] == 'rows':
+				parts = [[m, self._tmp('rows_'+str(m))] for m in sorted(self.rows)]
+			else:
+				parts = [[None, self._tmp(n[0])]]
+			index.write('\t'.join(['column', n[0], n[1], str(offset), str((sum([os.path.getsize(m[1]) for m in parts]))/numpy.dtype(n[1]).itemsize)])+'\n')
+			start = 0
+			for m in parts:
+				chunk = open(m[1], 'rb')
+				shutil.copyfileobj(chunk, outfile, 1048576)
+				chunk.close()
+				nb = os.path.getsize(m[1])/numpy.dtype(n[1]).itemsize
+				offset += nb*numpy.dtype(n[1]).itemsize
+				os.remove(m[1])
+				if m[0] is not None:
+					index.write('\t'.join(['category', self.labels[m[0] % len(self.labels)], str(m[0]/len(self.labels)), str(start), str(nb)])+'\n')
+					start += nb
+			if offset % ALIGN:
+				outfile.write('\0'*(ALIGN - offset % ALIGN))
+				offset += ALIGN - offset % ALIGN
+		index.close()
+		outfile.close()
+
+
+def isBinary(LISTE):
+	"""
+		Tell whether a list is in the binary format written by ListWriter
+
+		:param LISTE: The list file
+		:type LISTE: str
+		:return: True for a binary list, False for a text list
+		:rtype: bool
+	"""
+
+	file = open(LISTE, 'rb')
+	start = file.read(len(MAGIC))
+	file.close()
+	return start == MAGIC
+
+
+def openList(LISTE):
+	"""
+		Map the columns of a binary list read only, without reading them
+
+		:param LISTE: The binary list file
+		:type LISTE: str
+		:return: The "chroms" and "labels" lists (name of each code), the mapped "columns" and the "categories": [start, count] in the "rows" column of each (label, discard) pair
+		:rtype: dict
+	"""
+
+	result = {'chroms':[], 'labels':[], 'columns':{}, 'categories':{}}
+	for line in open(LISTE+'.idx'):
+		cols = line.rstrip('\n').split('\t')
+		if cols[0] == 'chrom':
+			result['chroms'].append(cols[1])
+		elif cols[0] == 'label':
+			result['labels'].append(cols[1])
+		elif cols[0] == 'column':
+			if int(cols[4]):
+				result['columns'][cols[1]] = numpy.memmap(LISTE, dtype=cols[2], mode='r', offset=int(cols[3]), shape=(int(cols[4]),))
+			else:
+				result['columns'][cols[1]] = numpy.zeros(0, dtype=cols[2])
+		elif cols[0] == 'category':
+			result['categories'][(cols[1], int(cols[2]))] = [int(cols[3]), int(cols[4])]
+	return result
+
+
+def categoryRows(LIST, LABEL, DISCARD = None):
+	"""
+		Give the rows of the pairs of a label, only the category index and not the whole list being read
+
+		:param LIST: The list given by openList()
+		:type LIST: dict
+		:param LABEL: The label
+		:type LABEL: str
+		:param DISCARD: 0 or 1 for the pairs not discarded or discarded only, None for both
+		:type DISCARD: int
+		:return: The rows of the pairs, in the order of the list
+		:rtype: numpy.ndarray
+	"""
+
+	parts = []
+	for n in [0, 1]:
+		if (DISCARD is None or DISCARD == n) and (LABEL, n) in LIST['categories']:
+			category = LIST['categories'][(LABEL, n)]
+			parts.append(LIST['columns']['rows'][category[0]:category[0]+category[1]])
+	if not parts:
+		return numpy.zeros(0, dtype='int64')
+	return numpy.sort(numpy.concatenate(parts))
+
+
+def pairNames(LIST, ROWS):
+	"""
+		Give the read names of pairs of a list
+
+		:param LIST: The list given by openList()
+		:type LIST: dict
+		:param ROWS: The rows of the pairs
+		:type ROWS: numpy.ndarray
+		:return: The read name of each pair
+		:rtype: list
+	"""
+
+	offset = LIST['columns']['name_offset']
+	name = LIST['columns']['name']
+	return [name[offset[n]:offset[n+1]].tostring() for n in ROWS.tolist()]
+
+
+def exportText(LISTE, OUT):
+	"""
+		Write a binary list in the text format: read name, position of mate1, position of mate2, chromosome of mate1, chromosome of mate2,
+		"discard" for the discarded pairs, label
+
+		:param LISTE: The binary list file
+		:type LISTE: str
+		:param OUT: The output file name
+		:type OUT: str
+		:return: void
+	"""
+
+	liste = openList(LISTE)
+	columns = liste['columns']
+	outfile = open(OUT, 'w')
+	for start in xrange(0, len(columns['code']), CHUNK_SIZE):
+		rows = numpy.arange(start, min(start+CHUNK_SIZE, len(columns['code'])))
+		names = pairNames(liste, rows)
+		data = zip(names, columns['pos1'][rows].tolist(), columns['pos2'][rows].tolist(), columns['chr1'][rows].tolist(), columns['chr2'][rows].tolist(), columns['code'][rows].tolist(), columns['discard'][rows].tolist())
+		lines = []
+		for n in data:
+			line = [n[0], str(n[1]), str(n[2]), liste['chroms'][n[3]], liste['chroms'][n[4]]]
+			if n[6]:
+				line.append('discard')
+			line.append(liste['labels'][n[5]])
+			lines.append('\t'.join(line)+'\n')
+		outfile.write(''.join(lines))
+	outfile.close()
@@ -1,4 +1,4 @@
-import optparse, os, shutil, subprocess, sys, tempfile, fileinput, ConfigParser, operator, time, math, glob, datetime
+import optparse, os, shutil, subprocess, sys, tempfile, fileinput, ConfigParser, operator, time, math, glob, datetime, re, collections
 from inspect import currentframe, getframeinfo
 
 def stop_err( msg ):
@@ -196,9 +196,185 @@ def extractSamFromReads(locaPrograms, bam, type, READS, OUT):
 		os.remove(FileToExtract)
 
 
+def openSamWriter(LOCA_PROGRAMS, OUT, TYPE, THREAD = 1):
+	"""
+		Open an output alignment file receiving sam lines
+
+		For the bam format, the sam lines are compressed on the fly by samtools with THREAD compression threads.
+
+		:param LOCA_PROGRAMS: From the Configparser module. Contains the path of each programs
+		:param OUT: The name of the output file
+		:type OUT: str
+		:param TYPE: The format of the output file
+		:type TYPE: str ("sam" | "bam")
+		:param THREAD: The number of bam compression threads
+		:type THREAD: int
+		:return: The output file and the samtools process (None for the sam format), to be given to closeSamWriter
+		:rtype: list
+	"""
+
+	if TYPE == 'sam':
+		return [open(OUT, 'w'), None]
+	elif TYPE == 'bam':
+		writer = '%s view -bS -@ %s -o %s -' % (LOCA_PROGRAMS.get('Programs','samtools'), THREAD, OUT)
+		proc = subprocess.Popen( args=writer, shell=True, stdin=subprocess.PIPE, bufsize=-1)
+		return [proc.stdin, proc]
+	else:
+		raise ValueError(TYPE+' format is not recognized')
+
+
+def closeSamWriter(WRITER):
+	"""
+		Close an output alignment file opened by openSamWriter
+
+		:param WRITER: The list returned by openSamWriter
+		:type WRITER: list
+		:return: void
+	"""
+
+	WRITER[0].close()
+	if WRITER[1] is not None and WRITER[1].wait() != 0:
+		sys.exit('Error in bam compression')
+
+
+def openSamReader(LOCA_PROGRAMS, SAM, TYPE, HEADER = False):
+	"""
+		Open an alignment file and give its sam lines, header included
+
+		Bam files are decompressed on the fly by samtools, no sam file is written.
+
+		:param LOCA_PROGRAMS: From the Configparser module. Contains the path of each programs
+		:param SAM: The input sam or bam file
+		:type SAM: str
+		:param TYPE: The format of the input file
+		:type TYPE: str ("sam" | "bam")
+		:param HEADER: Whether only the header lines of a bam file are given
+		:type HEADER: bool
+		:return: A file-like object of sam lines and the samtools process (None for the sam format), to be given to closeSamReader
+		:rtype: list
+	"""
+
+	if TYPE == 'sam':
+		return [open(SAM), None]
+	elif TYPE == 'bam':
+		if HEADER:
+			reader = '%s view -H %s' % (LOCA_PROGRAMS.get('Programs','samtools'), SAM)
+		else:
+			reader = '%s view -h %s' % (LOCA_PROGRAMS.get('Programs','samtools'), SAM)
+		proc = subprocess.Popen( args=reader, shell=True, stdout=subprocess.PIPE, bufsize=-1)
+		return [proc.stdout, proc]
+	else:
+		raise ValueError(TYPE+' format is not recognized')
+
+
+def closeSamReader(READER, ERROR = 'Error in sam reading'):
+	"""
+		Close an alignment file opened by openSamReader once all its lines are read, exiting if its samtools process failed:
+		a reader killed or failing would otherwise look like the end of the file
+
+		:param READER: The list returned by openSamReader (or a [file-like object, process] list)
+		:type READER: list
+		:param ERROR: The error message
+		:type ERROR: str
+		:return: void
+	"""
+
+	READER[0].close()
+	if READER[1] is not None and READER[1].wait() != 0:
+		sys.exit(ERROR+' (exit status '+str(READER[1].returncode)+')')
+
+
+#Sort orders of the alignment files recorded in the run configuration. "grouped" files have the two mates of each pair on consecutive lines (queryname sorted files are grouped).
+SORT_SATISFIES = {
+	'coordinate': ['coordinate'],
+	'queryname': ['queryname'],
+	'grouped': ['grouped', 'queryname'],
+	'unsorted': ['unsorted', 'grouped', 'queryname', 'coordinate']
+}
+
+def orderSatisfies(HAVE, NEED):
+	"""
+		Tell if a file in the HAVE sort order can be used by a step needing the NEED sort order
+
+		:param HAVE: The sort order of the file ("coordinate" | "queryname" | "grouped" | "unsorted")
+		:type HAVE: str
+		:param NEED: The sort order needed
+		:type NEED: str
+		:return: True if no conversion is needed
+		:rtype: bool
+	"""
+
+	return HAVE in SORT_SATISFIES[NEED]
+
+
+def convertOrder(LOCA_PROGRAMS, SAM, HAVE, NEED, OUT, OUT_TYPE, THREAD = 1):
+	"""
+		Give an alignment file in the NEED sort order, sorting it with samtools only if its HAVE sort order does not satisfy NEED
+
+		:param LOCA_PROGRAMS: From the Configparser module. Contains the path of each programs
+		:param SAM: The input sam or bam file
+		:type SAM: str
+		:param HAVE: The sort order of the input file
+		:type HAVE: str
+		:param NEED: The sort order needed
+		:type NEED: str
+		:param OUT: The name of the sorted file written if a conversion is needed
+		:type OUT: str
+		:param OUT_TYPE: The format of the sorted file
+		:type OUT_TYPE: str ("sam" | "bam")
+		:param THREAD: The number of samtools threads
+		:type THREAD: int
+		:return: The file to use (SAM or OUT) and True if OUT has been written
+		:rtype: list
+	"""
+
+	if orderSatisfies(HAVE, NEED):
+		return [SAM, False]
+	if NEED == 'coordinate':
+		sortbam = '%s sort -@ %s -O %s -T %s -o %s %s' % (LOCA_PROGRAMS.get('Programs','samtools'), THREAD, OUT_TYPE, OUT+'_tmp', OUT, SAM)
+	else:
+		sortbam = '%s sort -n -@ %s -O %s -T %s -o %s %s' % (LOCA_PROGRAMS.get('Programs','samtools'), THREAD, OUT_TYPE, OUT+'_tmp', OUT, SAM)
+	run_job(getframeinfo(currentframe()), sortbam, 'Error in convertOrder:\n')
+	return [OUT, True]
+
+
+def setFileState(CONFIG, SECTION, SORT, INDEXED):
+	"""
+		Record in the run configuration the sort order and the index state of the output file of a step
+
+		:param CONFIG: The run configuration (ConfigParser)
+		:param SECTION: The section of the step
+		:type SECTION: str
+		:param SORT: The sort order of the file ("coordinate" | "queryname" | "grouped" | "unsorted")
+		:type SORT: str
+		:param INDEXED: "y" if the file is indexed, "n" otherwise
+		:type INDEXED: str
+		:return: void
+	"""
+
+	CONFIG.set(SECTION, 'sort', SORT)
+	CONFIG.set(SECTION, 'indexed', INDEXED)
+
+
+def getFileSort(CONFIG, SECTION, DEFAULT = 'unsorted'):
+	"""
+		Give the sort order recorded by setFileState for the output file of a step, or DEFAULT for configurations written before it was recorded
+
+		:param CONFIG: The run configuration (ConfigParser)
+		:param SECTION: The section of the step
+		:type SECTION: str
+		:return: The sort order
+		:rtype: str
+	"""
+
+	if CONFIG.has_option(SECTION, 'sort'):
+		return CONFIG.get(SECTION, 'sort')
+	return DEFAULT
+
+
 def calcul_cov(LOCA_PROGRAMS, SAM, TYPE, OUT):
 	"""
-		Calculate the coverage of a sam or bam file, site by site
+		Calculate the coverage of a sam or bam file, site by site, in the samtools depth format
 
 		:param LOCA_PROGRAMS: From the Configparser module. Contains the path of each programs
 		:param SAM: The input sam or bam file.
@@ -210,21 +386,17 @@ def calcul_cov(LOCA_PROGRAMS, SAM, TYPE, OUT):
         :return: void
 	"""
 
-	if TYPE == 'sam':
-		#Convert the sam file to the bam format
-		sam2bam = '%s view -bSh %s -o %s' % (LOCA_PROGRAMS.get('Programs','samtools'), SAM, SAM+'_BAM.bam')
-		run_job(getframeinfo(currentframe()), sam2bam, 'Error in sam2bam (calcul_cov):\n', True)
-		SAM = SAM+'_BAM.bam'
-	elif TYPE != 'bam':
+	#imported here as it needs numpy and pysam, which the other functions of this module do not
+	import coverage
+
+	if TYPE != 'bam' and TYPE != 'sam':
 		mot = TYPE+' argument passed in --type is not recognized'
 		raise ValueError(mot)
 
-	cal_cov = ('%s depth %s > %s') % (LOCA_PROGRAMS.get('Programs','samtools'), SAM, OUT)
-	run_job(getframeinfo(currentframe()), cal_cov, 'Error in calculating coverage:\n', True)
-
-	#remove the intermediate bam file.
-	if TYPE == 'sam':
-		os.remove(SAM)
+	outfile = open(OUT, 'w')
+	for n in coverage.fileCoverage(SAM):
+		coverage.writeDepth(outfile, n[0], n[1], n[2])
+	outfile.close()
 
 
 def mediane(L):
@@ -249,3 +421,107 @@ def mediane(L):
 		return (L[p-1]+L[p])/2.0
 	else:
 		return float(L[p])
+
+
+CIGAR_OPERATION = re.compile('([0-9]+)([MIDNSHP=X])')
+CIGAR_CACHE_SIZE = 10000
+cigarCache = collections.OrderedDict()
+
+def cigarRefLength(CIGAR):
+	"""
+		Give the number of reference bases covered by an alignment (M, D, N, = and X operations)
+
+		The lengths are kept in a least recently used cache of CIGAR_CACHE_SIZE CIGAR strings, libraries having only a few thousand distinct CIGAR strings.
+
+		:param CIGAR: The CIGAR string of the alignment
+		:type CIGAR: str
+		:return: The reference length of the alignment
+		:rtype: int
+	"""
+
+	try:
+		length = cigarCache.pop(CIGAR)
+	except KeyError:
+		length = 0
+		parsed = 0
+		for n in CIGAR_OPERATION.finditer(CIGAR):
+			if n.group(2) in 'MDN=X':
+				length += int(n.group(1))
+			parsed += len(n.group(0))
+		if parsed != len(CIGAR) or parsed == 0:
+			raise ValueError('Unrecognized CIGAR string: '+CIGAR)
+		if len(cigarCache) >= CIGAR_CACHE_SIZE:
+			cigarCache.popitem(last=False)
+	cigarCache[CIGAR] = length
+	return length
+
+
+def alignmentEnd(CIGAR, START):
+	"""
+		Give the last reference position (1-based, included) covered by an alignment
+
+		:param CIGAR: The CIGAR string of the alignment
+		:type CIGAR: str
+		:param START: The first reference position of the alignment (1-based)
+		:type START: int
+		:return: The last reference position of the alignment
+		:rtype: int
+	"""
+
+	return START + cigarRefLength(CIGAR) - 1
+
+
+clipCache = collections.OrderedDict()
+
+def cigarClips(CIGAR):
+	"""
+		Give the number of clipped bases (S and H operations) at the start and at the end of an alignment
+
+		The values are kept in a least recently used cache of CIGAR_CACHE_SIZE CIGAR strings, as for cigarRefLength.
+
+		:param CIGAR: The CIGAR string of the alignment
+		:type CIGAR: str
+		:return: The leading and trailing clipped lengths
+		:rtype: tuple
+	"""
+
+	try:
+		clips = clipCache.pop(CIGAR)
+	except KeyError:
+		operations = CIGAR_OPERATION.findall(CIGAR)
+		if not operations:
+			raise ValueError('Unrecognized CIGAR string: '+CIGAR)
+		start = 0
+		for n in operations:
+			if n[1] not in 'SH':
+				break
+			start += int(n[0])
+		end = 0
+		for n in reversed(operations):
+			if n[1] not in 'SH':
+				break
+			end += int(n[0])
+		clips = (start, end)
+		if len(clipCache) >= CIGAR_CACHE_SIZE:
+			clipCache.popitem(last=False)
+	clipCache[CIGAR] = clips
+	return clips
+
+
+def unclippedFivePrime(CIGAR, START, REVERSE):
+	"""
+		Give the reference position of the 5' end of a read, clipped bases included, as used to identify duplicates
+
+		:param CIGAR: The CIGAR string of the alignment
+		:type CIGAR: str
+		:param START: The first reference position of the alignment (1-based)
+		:type START: int
+		:param REVERSE: True if the read is mapped on the reverse strand
+		:type REVERSE: bool
+		:return: The unclipped 5' position
+		:rtype: int
+	"""
+
+	if REVERSE:
+		return alignmentEnd(CIGAR, START) + cigarClips(CIGAR)[1]
+	return START - cigarClips(CIGAR)[0]
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+#Tests of the pair aligned byte ranges used by 3_filter_single_pair.py to filter a sam file in parallel.
+#Run with: python -m unittest discover tests
+
+import os, sys, imp, tempfile, shutil, unittest
+import pysam
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+sys.path.insert(0, BIN)
+filter_single_pair = imp.load_source('filter_single_pair', os.path.join(BIN, '3_filter_single_pair.py'))
+
+
+def sam_line(NAME, FLAG):
+	return '\t'.join([NAME, FLAG, 'chr1', '100', '60', '10M', '=', '200', '0', 'ACGTACGTAC', 'IIIIIIIIII', 'AS:i:10'])+'\n'
+
+class TestPairStart(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.sam = os.path.join(self.dir, 'in.sam')
+		self.lines = ['@HD\tVN:1.0\tSO:queryname\n']
+		for i in range(3):
+			self.lines.append(sam_line('read'+str(i), '99'))
+			self.lines.append(sam_line('read'+str(i), '147'))
+		outfile = open(self.sam, 'w')
+		outfile.writelines(self.lines)
+		outfile.close()
+		self.size = os.path.getsize(self.sam)
+		#offset of the first and second mate of the last pair
+		self.last_mate1 = self.size - len(self.lines[-1]) - len(self.lines[-2])
+		self.last_mate2 = self.size - len(self.lines[-1])
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+	def pair_start(self, POS):
+		file = open(self.sam)
+		start = filter_single_pair.pair_start(file, POS)
+		file.close()
+		return start
+	def test_boundary_on_pair_start(self):
+		self.assertEqual(self.pair_start(self.last_mate1), self.last_mate1)
+	def test_boundary_inside_first_mate(self):
+		self.assertEqual(self.pair_start(self.last_mate1 - 5), self.last_mate1)
+	def test_boundary_inside_final_pair(self):
+		#the boundary falls inside the first mate of the last pair: the next line is the last mate, so the range ends at the end of the file
+		self.assertEqual(self.pair_start(self.last_mate1 + 5), self.size)
+		self.assertEqual(self.pair_start(self.last_mate2 + 5), self.size)
+	def test_ranges_keep_pairs(self):
+		#Filtre_sam_parallel with enough processes to put a boundary inside every line
+		out = os.path.join(self.dir, 'out.sam')
+		counts = filter_single_pair.Filtre_sam_parallel(None, self.sam, [None, None], out, 'sam', '1', len(self.lines) * 2)
+		self.assertEqual(counts, [3, 3])
+		self.assertEqual(open(out).readlines(), self.lines)
+
+class TestBamPairStart(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.bam = os.path.join(self.dir, 'in.bam')
+		outfile = pysam.AlignmentFile(self.bam, 'wb', header={'HD': {'VN': '1.0', 'SO': 'queryname'}, 'SQ': [{'SN': 'chr1', 'LN': 100000}]})
+		for i in range(20000):
+			for flag in [99, 147]:
+				read = pysam.AlignedSegment(outfile.header)
+				read.query_name = 'read'+str(i)
+				read.flag = flag
+				read.reference_id = 0
+				read.reference_start = i
+				read.cigarstring = str(10 + i % 50)+'M'
+				read.query_sequence = 'A' * (10 + i % 50)
+				outfile.write(read)
+		outfile.close()
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+	def test_pair_starts(self):
+		#virtual offsets of the pair starts given by pysam
+		bam = pysam.AlignmentFile(self.bam, 'rb', check_sq=False)
+		starts = []
+		read = True
+		while read is not None:
+			starts.append(bam.tell())
+			read = next(bam, None)
+			next(bam, None)
+		bam.close()
+		blocks = filter_single_pair.bgzf_blocks(self.bam)
+		self.assertEqual(blocks[-1], os.path.getsize(self.bam))
+		self.assertTrue(len(blocks) > 4)
+		file = open(self.bam, 'rb')
+		for j in range(1, len(blocks)-2):
+			start = filter_single_pair.bam_pair_start(file, blocks, j, 1)
+			self.assertEqual(start, min([n for n in starts if n >= blocks[j] << 16]))
+		file.close()
+
+if __name__ == '__main__':
+	unittest.main()